@@ -1,10 +1,40 @@
 import numpy as np
-from linear_algebra.linear_algebra import makeunit, angle
+from linear_algebra.linear_algebra import makeunit, angle, magnitude, rowcross
 from utils.utils import addchannelsgs, getDir
 
-
-def kinematics(data, r, jnt, version):
-    """ wrapper function to access different computations"""
+# signs of the flexion, abduction and twist of the tibia relative to the lab for each direction of motion
+TIBIA_LAB_SIGNS = {'Ipos': {'Right': (1, -1, 1), 'Left': (1, 1, -1)},
+                   'Ineg': {'Right': (-1, 1, -1), 'Left': (-1, -1, 1)},
+                   'Jpos': {'Right': (1, 1, -1), 'Left': (1, -1, 1)},
+                   'Jneg': {'Right': (-1, -1, 1), 'Left': (-1, 1, -1)},
+                   }
+
+# angles changing sign to match the oxford foot model conventions of each version
+MIRRORED_ANGLES = {'1.0': [('LeftAnkleOFM', ['abd', 'tw']),
+                           ('LeftFFTBA', ['abd', 'tw']),
+                           ('LeftMidFoot', ['abd', 'tw']),
+                           ('LeftMTP', ['abd', 'tw']),
+                           ],
+                   '1.1': [('LeftAnkleOFM', ['abd', 'tw']),
+                           ('LeftFFTBA', ['abd', 'tw']),
+                           ('LeftMidFoot', ['abd', 'tw']),
+                           ('RightMTP', ['abd']),
+                           ],
+                   }
+
+
+def kinematics(data, r, jnt, version, stats=None):
+    """ wrapper function to access different computations
+
+    Arguments:
+        data    ... dict, trial data
+        r       ... dict, bone axes (see getbones_data)
+        jnt     ... list, joints to compute
+        version ... str, openOFM version '1.0' or '1.1'
+        stats   ... dict, Default = None. Running statistics used to find the direction of motion (see getDir)
+    Returns:
+        data    ... dict, with joint angles appended
+    """
 
     # choose version
     if version == "1.0":
@@ -13,7 +43,7 @@ def kinematics(data, r, jnt, version):
         KIN = grood_suntay(r, jnt)
 
     # update reference system
-    data, _ = refsystem(data, KIN, version)
+    data, _ = refsystem(data, KIN, version, stats)
 
     return data
 
@@ -26,7 +56,7 @@ def grood_suntay_1_0(r, jnt):
         pbone = jnt_name[1]
         dbone = jnt_name[2]
 
-        pax = r[pbone]['ort']  # stores xyz local axes for each frame
+        pax = r[pbone]['ort']  # stores xyz local axes for each frame (n x 3 x 3)
         dax = r[dbone]['ort']
 
         if pbone.startswith('Right'):
@@ -50,7 +80,7 @@ def grood_suntay_1_0(r, jnt):
             abd_j = angle(dist_z, prox_x)
             tw_j = angle(dist_x, prox_x)
 
-        if bone == 'TibiaOFM':
+        elif bone == 'TibiaOFM':
             floatax, prox_x, dist_x, prox_y, dist_y, prox_z, dist_z = makeax_1_0(pax, dax)
             # computing tibia/hindfoot and tibia/forefoot angles
             alpha = -angle(floatax, prox_x)
@@ -84,7 +114,7 @@ def grood_suntay(r, jnt):
         pbone = jnt_name[1]
         dbone = jnt_name[2]
 
-        pax = r[pbone]['ort']  # stores xyz local axes for each frame
+        pax = r[pbone]['ort']  # stores xyz local axes for each frame (n x 3 x 3)
         dax = r[dbone]['ort']
 
         if pbone.startswith('Right'):
@@ -129,153 +159,75 @@ def grood_suntay(r, jnt):
 
 
 def makeax_1_0(pax, dax):
-    """ helper function to gather axes for grood and suntay"""
-    num_frames = len(pax)
-    num_axes = 3
-
-    prox_x = np.zeros((num_frames, num_axes))
-    prox_y = np.zeros((num_frames, num_axes))
-    prox_z = np.zeros((num_frames, num_axes))
-
-    dist_x = np.zeros((num_frames, num_axes))
-    dist_y = np.zeros((num_frames, num_axes))
-    dist_z = np.zeros((num_frames, num_axes))
+    """ helper function to gather axes for grood and suntay
 
-    floatax = np.zeros((num_frames, num_axes))
+    Arguments:
+        pax     ... n x 3 x 3 array, axes of the proximal bone for each frame (rows = x, y, z axes)
+        dax     ... n x 3 x 3 array, axes of the distal bone for each frame
+    Returns:
+        unit floating axis and unit x, y, z axes of the proximal and distal bones (n x 3 arrays)
+    """
+    pax = unitaxes(pax)
+    dax = unitaxes(dax)
 
-    for i in range(num_frames):
-        prox_x[i, :] = makeunit(pax[i][0, :])
-        prox_y[i, :] = makeunit(pax[i][1, :])
-        prox_z[i, :] = makeunit(pax[i][2, :])
+    prox_x, prox_y, prox_z = pax[:, 0, :], pax[:, 1, :], pax[:, 2, :]
+    dist_x, dist_y, dist_z = dax[:, 0, :], dax[:, 1, :], dax[:, 2, :]
 
-        dist_x[i, :] = makeunit(dax[i][0, :])
-        dist_y[i, :] = makeunit(dax[i][1, :])
-        dist_z[i, :] = makeunit(dax[i][2, :])
-
-        floatax[i, :] = np.cross(dist_z[i, :], prox_y[i, :])
-
-    floatax = makeunit(floatax)
-    prox_x = makeunit(prox_x)
-    dist_x = makeunit(dist_x)
-    prox_y = makeunit(prox_y)
-    dist_y = makeunit(dist_y)
-    prox_z = makeunit(prox_z)
-    dist_z = makeunit(dist_z)
+    floatax = makeunit(rowcross(dist_z, prox_y))
 
     return floatax, prox_x, dist_x, prox_y, dist_y, prox_z, dist_z
 
 
 def makeax(pax, dax):
-    """ helper function to gather axes for grood and suntay"""
-    num_frames = len(pax)
-    num_axes = 3
-
-    prox_x = np.zeros((num_frames, num_axes))
-    prox_y = np.zeros((num_frames, num_axes))
-    prox_z = np.zeros((num_frames, num_axes))
+    """ helper function to gather axes for grood and suntay
 
-    dist_x = np.zeros((num_frames, num_axes))
-    dist_y = np.zeros((num_frames, num_axes))
-    dist_z = np.zeros((num_frames, num_axes))
+    Arguments:
+        pax     ... n x 3 x 3 array, axes of the proximal bone for each frame (rows = x, y, z axes)
+        dax     ... n x 3 x 3 array, axes of the distal bone for each frame
+    Returns:
+        unit floating axes (OFM and ISB) and unit x, y, z axes of the proximal and distal bones (n x 3 arrays)
+    """
+    pax = unitaxes(pax)
+    dax = unitaxes(dax)
 
-    floatax = np.zeros((num_frames, num_axes))
-    floatax_isb = np.zeros((num_frames, num_axes))
+    prox_x, prox_y, prox_z = pax[:, 0, :], pax[:, 1, :], pax[:, 2, :]
+    dist_x, dist_y, dist_z = dax[:, 0, :], dax[:, 1, :], dax[:, 2, :]
 
-    for i in range(num_frames):
-        prox_x[i, :] = makeunit(pax[i][0, :])
-        prox_y[i, :] = makeunit(pax[i][1, :])
-        prox_z[i, :] = makeunit(pax[i][2, :])
-
-        dist_x[i, :] = makeunit(dax[i][0, :])
-        dist_y[i, :] = makeunit(dax[i][1, :])
-        dist_z[i, :] = makeunit(dax[i][2, :])
-
-        floatax[i, :] = np.cross(dist_x[i, :], prox_z[i, :])
-        floatax_isb[i, :] = np.cross(dist_y[i, :], prox_z[i, :])
-
-    floatax = makeunit(floatax)
-    floatax_isb = makeunit(floatax_isb)
-
-    prox_x = makeunit(prox_x)
-    dist_x = makeunit(dist_x)
-    prox_y = makeunit(prox_y)
-    dist_y = makeunit(dist_y)
-    prox_z = makeunit(prox_z)
-    dist_z = makeunit(dist_z)
+    floatax = makeunit(rowcross(dist_x, prox_z))
+    floatax_isb = makeunit(rowcross(dist_y, prox_z))
 
     return floatax, floatax_isb, prox_x, dist_x, prox_y, dist_y, prox_z, dist_z
 
 
-def refsystem(data, KIN, version):
-    """ update reference system to match oxford food model"""
-
-    direction = getDir(data)
-
-    if direction == 'Ipos':
-        # todo : test this direction
-        KIN['RightTibiaLab']['flx'] = KIN['RightTibiaLab']['flx_i']
-        KIN['RightTibiaLab']['abd'] = - KIN['RightTibiaLab']['abd_i']
-        KIN['RightTibiaLab']['tw'] = KIN['RightTibiaLab']['tw_i']
+def unitaxes(ax):
+    """ helper function to normalise every axis of an n x 3 x 3 stack of bone axes"""
+    return ax / magnitude(ax, axis=-1)[..., np.newaxis]
 
-        KIN['LeftTibiaLab']['flx'] = KIN['LeftTibiaLab']['flx_i']
-        KIN['LeftTibiaLab']['abd'] = KIN['LeftTibiaLab']['abd_i']
-        KIN['LeftTibiaLab']['tw'] = -KIN['LeftTibiaLab']['tw_i']
 
-    elif direction == 'Ineg':
-        KIN['RightTibiaLab']['flx'] = -KIN['RightTibiaLab']['flx_i']
-        KIN['RightTibiaLab']['abd'] = KIN['RightTibiaLab']['abd_i']
-        KIN['RightTibiaLab']['tw'] = -KIN['RightTibiaLab']['tw_i']
+def refsystem(data, KIN, version, stats=None):
+    """ update reference system to match oxford food model
 
-        KIN['LeftTibiaLab']['flx'] = -KIN['LeftTibiaLab']['flx_i']
-        KIN['LeftTibiaLab']['abd'] = -KIN['LeftTibiaLab']['abd_i']
-        KIN['LeftTibiaLab']['tw'] = KIN['LeftTibiaLab']['tw_i']
+    Notes:
+        - only the joints in KIN are updated, the direction of motion (see getDir) is only needed for the tibia
+        relative to the lab
+    """
 
-    elif direction == 'Jpos':
-        KIN['RightTibiaLab']['flx'] = KIN['RightTibiaLab']['flx_j']
-        KIN['RightTibiaLab']['abd'] = KIN['RightTibiaLab']['abd_j']
-        KIN['RightTibiaLab']['tw'] = - KIN['RightTibiaLab']['tw_j']
+    if 'RightTibiaLab' in KIN or 'LeftTibiaLab' in KIN:
+        direction = getDir(data, stats=stats)
+        axis = direction[0].lower()
+        for side, signs in TIBIA_LAB_SIGNS[direction].items():
+            if side + 'TibiaLab' not in KIN:
+                continue
+            # todo : test direction Ipos
+            for comp, sign in zip(['flx', 'abd', 'tw'], signs):
+                KIN[side + 'TibiaLab'][comp] = sign * KIN[side + 'TibiaLab'][comp + '_' + axis]
 
-        KIN['LeftTibiaLab']['flx'] = KIN['LeftTibiaLab']['flx_j']
-        KIN['LeftTibiaLab']['abd'] = - KIN['LeftTibiaLab']['abd_j']
-        KIN['LeftTibiaLab']['tw'] = KIN['LeftTibiaLab']['tw_j']
-
-    elif direction == 'Jneg':
-        KIN['RightTibiaLab']['flx'] = -KIN['RightTibiaLab']['flx_j']
-        KIN['RightTibiaLab']['abd'] = - KIN['RightTibiaLab']['abd_j']
-        KIN['RightTibiaLab']['tw'] = KIN['RightTibiaLab']['tw_j']
-
-        KIN['LeftTibiaLab']['flx'] = - KIN['LeftTibiaLab']['flx_j']
-        KIN['LeftTibiaLab']['abd'] = KIN['LeftTibiaLab']['abd_j']
-        KIN['LeftTibiaLab']['tw'] = - KIN['LeftTibiaLab']['tw_j']
-
-    if version == '1.0':
-        KIN['LeftAnkleOFM']['abd'] = - KIN['LeftAnkleOFM']['abd']
-        KIN['LeftAnkleOFM']['tw'] = - KIN['LeftAnkleOFM']['tw']
-
-        KIN['LeftFFTBA']['abd'] = -KIN['LeftFFTBA']['abd']
-        KIN['LeftFFTBA']['tw'] = -KIN['LeftFFTBA']['tw']
-
-        KIN['LeftMidFoot']['abd'] = -KIN['LeftMidFoot']['abd']
-        KIN['LeftMidFoot']['tw'] = -KIN['LeftMidFoot']['tw']
-
-        KIN['LeftMTP']['abd'] = -KIN['LeftMTP']['abd']
-        KIN['LeftMTP']['tw'] = -KIN['LeftMTP']['tw']
-
-    elif version == '1.1':
-        KIN['LeftAnkleOFM']['abd'] = -KIN['LeftAnkleOFM']['abd']
-        KIN['LeftAnkleOFM']['tw'] = -KIN['LeftAnkleOFM']['tw']
-
-        KIN['LeftFFTBA']['abd'] = -KIN['LeftFFTBA']['abd']
-        KIN['LeftFFTBA']['tw'] = -KIN['LeftFFTBA']['tw']
-
-        KIN['LeftMidFoot']['abd'] = -KIN['LeftMidFoot']['abd']
-        KIN['LeftMidFoot']['tw'] = -KIN['LeftMidFoot']['tw']
-
-        KIN['RightMTP']['abd'] = -KIN['RightMTP']['abd']
+    for joint, comps in MIRRORED_ANGLES[version]:
+        if joint in KIN:
+            for comp in comps:
+                KIN[joint][comp] = -KIN[joint][comp]
 
     # ----4 : ADD COMPUTED ANGLES TO DATA STRUCT------------------------------------
     data = addchannelsgs(data, KIN)
 
     return data, KIN
-
-
@@ -1,5 +1,7 @@
 import numpy as np
-from linear_algebra.linear_algebra import makeunit, gunit, ctransform, create_lcs, rotate_axes, magnitude
+from linear_algebra.linear_algebra import makeunit, rotate_axes, magnitude, rowcross, lcs_axes, gcs_2_lcs, \
+    lcs_2_gcs, rowdot, running_mean
+from utils.utils import run_sides
 
 
 def hipjointcentrePiG_data(data=None):
@@ -49,8 +51,8 @@ def hipjointcentrePiG_data(data=None):
     PELO = (LASI + RASI) / 2                  # origin (O)
     PELy = makeunit(LASI - PELO)  # lateral (L)
     PELtemp = SACR - PELO                     # temp anterior
-    PELz = makeunit(np.cross(PELy, PELtemp))  # proximal (P)
-    PELx = makeunit(np.cross(PELy, PELz))  # anterior (A)
+    PELz = makeunit(rowcross(PELy, PELtemp))  # proximal (P)
+    PELx = makeunit(rowcross(PELy, PELz))  # anterior (A)
 
     # Compute hip joint centers
     side = np.array(['R', 'L'])
@@ -66,12 +68,8 @@ def hipjointcentrePiG_data(data=None):
         HipPCS = np.array([HipPCSx, HipPCSy, HipPCSz]).T
 
         # Transform from pelvis coordinate system to global coordinate system
-        HipGCS = np.ones(RASI.shape)
-        GCS = gunit()
-        rows = RASI.shape[0]
-        for j in np.arange(rows):
-            PCS = np.array([PELx[j, :], PELy[j, :], PELz[j, :]])
-            HipGCS[j, :] = ctransform(PCS, GCS, HipPCS) + PELO[j, :]
+        PCS = np.stack((PELx, PELy, PELz), axis=1)
+        HipGCS = lcs_2_gcs(PELO, PCS, HipPCS)
 
         # add to data dict
         data[side[i] + 'HipJC'] = HipGCS
@@ -79,7 +77,19 @@ def hipjointcentrePiG_data(data=None):
     return data
 
 
-def kneejointcenterPiG(data):
+def kneejointcenterPiG(data, stats=None, sides=None, parallel=False):
+    """
+    data = KNEEJOINTCENTERPIG(data, stats, sides) computes left and right knee joint centers for plug-in gait
+    (PiG) marker data
+    ARGUMENTS
+      data      ... dict, containing PiG markers and hip joint centers
+      stats     ... dict, Default = None. Running statistics (see init_running_stats). If None, the femur
+                    rotation is averaged over the frames in data
+      sides     ... list, Default = None. Sides to compute ('R' and/or 'L'). If None, both sides
+      parallel  ... bool, Default = False. If true, the sides are computed concurrently (see run_sides)
+    RETURNS
+      data      ... dict, with appended knee joint center virtual marker as RKneeJC and LKneeJC
+    """
 
     # Compute joint offsets for knee and ankle
     KneeWidth = (data['parameters']['PROCESSING']['RKneeWidth']['value'] +
@@ -87,8 +97,7 @@ def kneejointcenterPiG(data):
     KneeOffset = (KneeWidth + data['parameters']['PROCESSING']['MarkerDiameter']['value']) / 2
 
     # Repeat for right and left sides
-    sides = ['R', 'L']
-    for side in sides:
+    def side_jc(data, side, settings):
         # Extract some PiG markers
         KNE = data[side + 'KNE']
 
@@ -105,62 +114,53 @@ def kneejointcenterPiG(data):
 
         # Calculate the femur rotation given a thigh offset
         if VCMThighOffset != 0:
-            FemurRotation = np.zeros((HipJC.shape[0], 1))
-            for i in range(HipJC.shape[0]):
-                _, _, _, _, Taxes = create_lcs(HipJC[i, :], KNE[i, :] - HipJC[i, :], THI[i, :] - KNE[i, :], 'zxy')
-
-                THI_lcl_Taxes = ctransform(gunit(), Taxes, THI[i, :] - HipJC[i, :])
-                wy = THI_lcl_Taxes[1]
-                wz = THI_lcl_Taxes[2]
-                mag = np.linalg.norm(HipJC[i, :] - KNE[i, :])
-                thi = np.arcsin(KneeOffset/mag)
-                psi = VCMThighOffset
-
-                a = wy * wy
-                b = 2 * np.cos(psi) * np.sin(psi) * np.sin(thi) * wy * wz
-                c = np.sin(psi) * np.sin(psi) * (np.sin(thi) * np.sin(thi) * wz * wz - np.cos(thi) * np.cos(thi) * wy * wy)
-
-                thetaplus = np.arcsin((-b + np.sqrt(b * b - 4 * a * c)) / (2 * a))[0]
-                thetaminus = np.arcsin((-b - np.sqrt(b * b - 4 * a * c)) / (2 * a))[0]
-
-                if thetaplus * VCMThighOffset > 0:
-                    FemurRotation[i, :] = -thetaminus
-                else:
-                    FemurRotation[i, :] = -thetaplus
+            Taxes = lcs_axes(KNE - HipJC, THI - KNE, 'zxy')
+            THI_lcl_Taxes = gcs_2_lcs(HipJC, Taxes, THI)
+            mag = magnitude(HipJC - KNE)
+            FemurRotation = wandrotation(THI_lcl_Taxes, mag, KneeOffset, VCMThighOffset)
         else:
             FemurRotation = np.zeros((HipJC.shape[0], 1))
 
-        FemurRotation = np.mean(FemurRotation)
+        FemurRotation = running_mean(np.ravel(FemurRotation), stats, side + 'FemurRotation')
 
         # Correct thigh wand marker
-        THI_lcl_Thigh = np.zeros_like(THI)
-        THR = np.zeros_like(THI)
-        for i in range(THI.shape[0]):
-            _, _, _, _, Thigh = create_lcs(KNE[i, :], HipJC[i, :] - KNE[i, :], KNE[i, :] - THI[i, :], 'zxy')
-            THI_lcl_Thigh[i, :] = ctransform(gunit(), Thigh, THI[i, :] - KNE[i, :])
-            if side == 'L':
-                rot_axes = rotate_axes(Thigh, np.rad2deg(-FemurRotation), 'z')
-            else:
-                rot_axes = rotate_axes(Thigh, np.rad2deg(FemurRotation), 'z')
-            THR_vec_gbl = ctransform(rot_axes, gunit(), THI_lcl_Thigh[i, :])
-            THR[i, :] = THR_vec_gbl + KNE[i, :]
+        Thigh = lcs_axes(HipJC - KNE, KNE - THI, 'zxy')
+        THI_lcl_Thigh = gcs_2_lcs(KNE, Thigh, THI)
+        if side == 'L':
+            rot_axes = rotate_axes(Thigh, np.rad2deg(-FemurRotation), 'z')
+        else:
+            rot_axes = rotate_axes(Thigh, np.rad2deg(FemurRotation), 'z')
+        THR = lcs_2_gcs(KNE, rot_axes, THI_lcl_Thigh)
 
         # Create knee joint center based on corrected wand marker
         KneeJC = chordPiG(THR, HipJC, KNE, KneeOffset)
         data[side + 'KneeJC'] = KneeJC
+        return data
 
-    return data
+    return run_sides(side_jc, data, None, parallel, sides)
 
 
-def anklejointcenterPiG(data):
+def anklejointcenterPiG(data, stats=None, sides=None, parallel=False):
+    """
+    data = ANKLEJOINTCENTERPIG(data, stats, sides) computes left and right ankle joint centers for plug-in gait
+    (PiG) marker data
+    ARGUMENTS
+      data      ... dict, containing PiG markers and knee joint centers
+      stats     ... dict, Default = None. Running statistics (see init_running_stats). If None, the tibia
+                    rotation is averaged over the frames in data
+      sides     ... list, Default = None. Sides to compute ('R' and/or 'L'). If None, both sides
+      parallel  ... bool, Default = False. If true, the sides are computed concurrently (see run_sides)
+    RETURNS
+      data      ... dict, with appended ankle joint center virtual marker as RAnkleJC and LAnkleJC and
+                    corrected tibia wand marker as RTIR and LTIR
+    """
     # Compute joint offsets and ankle
     AnkleWidth = (data['parameters']['PROCESSING']['RAnkleWidth']['value'] +
                   data['parameters']['PROCESSING']['LAnkleWidth']['value']) / 2
     AnkleOffset = (AnkleWidth + data['parameters']['PROCESSING']['MarkerDiameter']['value']) / 2
 
     # Repeat for right and left sides
-    sides = ['R', 'L']
-    for side in sides:
+    def side_jc(data, side, settings):
         # Create tibia segment
         # Extract values for shank offset and knee joint center
         ShankOffset = data['parameters']['PROCESSING'][side + 'ShankRotation']['value']
@@ -169,53 +169,63 @@ def anklejointcenterPiG(data):
         ANK = data[side + 'ANK']
 
         # Calculate tibia rotation
-        TibiaRotation = np.zeros((KneeJC.shape[0], 1))
         if ShankOffset != 0:
-            for i in range(KneeJC.shape[0]):
-                _, _, _, _, Taxes = create_lcs(KneeJC[i, :], ANK[i, :] - KneeJC[i, :], TIB[i, :] - ANK[i, :], 'zxy')
-                TIB_lcl_Taxes = ctransform(gunit(), Taxes, TIB[i, :] - KneeJC[i, :])
-                vy = TIB_lcl_Taxes[1]
-                vz = TIB_lcl_Taxes[2]
-                #todo: check magnitude calculation
-                mag = np.linalg.norm(KneeJC[i, :] - ANK[i, :])
-                thi = np.arcsin(AnkleOffset/mag)
-                psi = ShankOffset
-
-                a = vy * vy
-                b = 2 * np.cos(psi) * np.sin(psi) * np.sin(thi) * vy * vz
-                c = np.sin(psi) * np.sin(psi) * (np.sin(thi) * np.sin(thi) * vz * vz - np.cos(thi) * np.cos(thi) * vy * vy)
-
-                thetaplus = np.arcsin((-b + np.sqrt(b * b - 4 * a * c)) / (2 * a))
-                thetaminus = np.arcsin((-b - np.sqrt(b * b - 4 * a * c)) / (2 * a))
-
-                if thetaplus * ShankOffset > 0:
-                    TibiaRotation[i, :] = -thetaminus
-                else:
-                    TibiaRotation[i, :] = -thetaplus
+            Taxes = lcs_axes(ANK - KneeJC, TIB - ANK, 'zxy')
+            TIB_lcl_Taxes = gcs_2_lcs(KneeJC, Taxes, TIB)
+            # todo: check magnitude calculation
+            mag = magnitude(KneeJC - ANK)
+            TibiaRotation = wandrotation(TIB_lcl_Taxes, mag, AnkleOffset, ShankOffset)
         else:
             TibiaRotation = np.zeros((KneeJC.shape[0], 1))
 
-        TibiaRotation = np.mean(TibiaRotation)
+        TibiaRotation = running_mean(np.ravel(TibiaRotation), stats, side + 'TibiaRotation')
 
         # Correct TIB marker
-        TIB_lcl_Shank = np.zeros_like(TIB)
-        TIR = np.zeros_like(TIB)
-        for i in range(KneeJC.shape[0]):
-            _, _, _, _, Shank = create_lcs(ANK[i, :], KneeJC[i, :] - ANK[i, :], TIB[i, :] - ANK[i, :], 'yxz')
-            TIB_lcl_Shank[i, :] = ctransform(gunit(), Shank, TIB[i, :] - ANK[i, :])
-            if side == 'L':
-                rot_axes = rotate_axes(Shank, np.rad2deg(-TibiaRotation), 'y')
-            else:
-                rot_axes = rotate_axes(Shank, np.rad2deg(TibiaRotation), 'y')
-            TIR_vec_gbl = ctransform(rot_axes, gunit(), TIB_lcl_Shank[i, :])
-            TIR[i, :] = TIR_vec_gbl + ANK[i, :]
+        Shank = lcs_axes(KneeJC - ANK, TIB - ANK, 'yxz')
+        TIB_lcl_Shank = gcs_2_lcs(ANK, Shank, TIB)
+        if side == 'L':
+            rot_axes = rotate_axes(Shank, np.rad2deg(-TibiaRotation), 'y')
+        else:
+            rot_axes = rotate_axes(Shank, np.rad2deg(TibiaRotation), 'y')
+        TIR = lcs_2_gcs(ANK, rot_axes, TIB_lcl_Shank)
 
         # Create ankle joint center marker
         data[side + 'TIR'] = TIR
         AnkleJC = chordPiG(TIR, KneeJC, ANK, AnkleOffset)
         data[side + 'AnkleJC'] = AnkleJC
+        return data
 
-    return data
+    return run_sides(side_jc, data, None, parallel, sides)
+
+
+def wandrotation(w_lcl, mag, offset, psi):
+    """
+    rotation = WANDROTATION(w_lcl,mag,offset,psi) computes the segment rotation induced by a wand marker
+    offset, for every frame at once
+    ARGUMENTS
+      w_lcl     ... n x 3 array, wand marker expressed in the technical axes of the segment
+      mag       ... n x 1 array, length of the segment (proximal to distal joint)
+      offset    ... double, joint offset (jointWidth + mDiameter) / 2
+      psi       ... double, wand rotation offset (ThighRotation or ShankRotation)
+    RETURNS
+      rotation  ... n x 1 array, rotation of the segment for each frame
+    NOTES
+    - solves the quadratic of pyCGM.py's interpretation of the PiG thigh/shank rotation
+    """
+    wy = w_lcl[:, 1]
+    wz = w_lcl[:, 2]
+    thi = np.arcsin(offset / mag)
+
+    a = wy * wy
+    b = 2 * np.cos(psi) * np.sin(psi) * np.sin(thi) * wy * wz
+    c = np.sin(psi) * np.sin(psi) * (np.sin(thi) * np.sin(thi) * wz * wz - np.cos(thi) * np.cos(thi) * wy * wy)
+
+    thetaplus = np.arcsin((-b + np.sqrt(b * b - 4 * a * c)) / (2 * a))
+    thetaminus = np.arcsin((-b - np.sqrt(b * b - 4 * a * c)) / (2 * a))
+
+    rotation = np.where(thetaplus * psi > 0, -thetaminus, -thetaplus)
+
+    return rotation[:, np.newaxis]
 
 
 def getbones_data(data):
@@ -354,35 +364,20 @@ def chordPiG(a, b, c, delta):
     v1 = a - c
     v2 = b - c
     # v3 is cross vector of v1, v2, and then it normalized.
-    v3 = makeunit(np.cross(v1, v2))
+    v3 = makeunit(rowcross(v1, v2))
     m = (b + c) / 2
     len_ = magnitude(b-m, axis=1)
     theta = np.arccos(delta / magnitude(v2, axis=1))
-    csVec = np.cos(theta * 2)
-    snVec = np.sin(theta * 2)
-    uxMat = v3[:, 0].reshape(((v3[:, 0]).shape[0], 1))
-    uyMat = v3[:, 1].reshape(((v3[:, 1]).shape[0], 1))
-    uzMat = v3[:, 2].reshape(((v3[:, 2]).shape[0], 1))
-    # this rotation matrix is called Rodriques' rotation formula. In order to
-    # make a plane, at least 3 number of markers is required which means three
-    # physical markers on the segment can make a plane.
+    cs = np.cos(theta * 2)[:, np.newaxis]
+    sn = np.sin(theta * 2)[:, np.newaxis]
+    # Rodrigues' rotation formula. In order to make a plane, at least 3 number of markers is required
+    # which means three physical markers on the segment can make a plane.
     # Then the orthogonal vector of the plane will be rotating axis.
     # joint center is determined by rotating the one vector of plane around
     # rotating axis.
-    jc = np.zeros(a.shape)
-    for i in np.arange(len(uxMat)):
-        cs = csVec[i].item()
-        sn = snVec[i].item()
-        ux = uxMat[i, :].item()
-        uy = uyMat[i, :].item()
-        uz = uzMat[i, :].item()
-        rot = np.array([[cs + ux ** 2 * (1 - cs), ux * uy * (1 - cs) - uz * sn, ux * uz * (1 - cs) + uy * sn],
-                        [uy * ux * (1.0 - cs) + uz * sn, cs + uy ** 2 * (1 - cs), uy * uz * (1 - cs) - ux * sn],
-                        [uz * ux * (1.0 - cs) - uy * sn, uz * uy * (1.0 - cs) + ux * sn, cs + uz ** 2 * (1 - cs)]])
-        r = np.matmul(rot, v2[i, :].reshape((v2[i, :].shape[0], 1)))
-        r *= len_[i]/(magnitude(r.T, axis=1))
-        for j in np.arange(jc.shape[1]):
-            jc[i, j] = r[j] + m[i, j]
+    r = v2 * cs + rowcross(v3, v2) * sn + v3 * rowdot(v3, v2)[:, np.newaxis] * (1 - cs)
+    r *= (len_ / magnitude(r, axis=1))[:, np.newaxis]
+    jc = r + m
     return jc
 
 
@@ -400,7 +395,9 @@ def prep_bones(data, bone, dimOFM=None):
         d = [None] * len(dimOFM)
 
         if bone[i][0] == 'GLB':
-            d[0] = np.zeros(data[bone[i + 1][0] + dimOFM[0]].shape)
+            # the lab is fixed, any other bone gives the number of frames
+            ref = next(b[0] for b in bone if b[0] != 'GLB')
+            d[0] = np.zeros_like(data[ref + dimOFM[0]])
             d[1] = np.column_stack((d[0][:, 0] + 10, d[0][:, 1:3]))
             d[2] = np.column_stack((d[0][:, 0], d[0][:, 1] + 10, d[0][:, 2]))
             d[3] = np.column_stack((d[0][:, 0:2], d[0][:, 2] + 10))
@@ -409,7 +406,7 @@ def prep_bones(data, bone, dimOFM=None):
                 d[j] = data[bone[i][0] + dimOFM[j]]
 
         bn = bone[i][1]
-        ort = getdata(d)  # Assuming getdataOFM is defined elsewhere
+        ort = getdata(d)
         r[bn] = {'ort': ort}
 
     return r
@@ -422,9 +419,7 @@ def getdata(d):
     y = (d[2] - d[0]) / 10  # "Up" - Origin: Creates medial vector (right side), Lateral vector (left side)
     z = (d[3] - d[0]) / 10  # "Side" - Origin: Creates vector along long axis of bone
 
-    rw = x.shape[0]
-    ort = []
-    for i in range(rw):
-        ort.append(np.vstack((x[i], y[i], z[i])))
+    # n x 3 x 3 array, ort[i] holds the x, y, z axes of frame i as rows
+    ort = np.stack((x, y, z), axis=1)
 
     return ort
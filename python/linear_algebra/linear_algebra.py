@@ -10,26 +10,68 @@ def static2dynamic(o_dyn, x_dyn, y_dyn, z_dyn, mrk_lcl_av):
     x_dyn: numpy array of shape (n, 3) representing the anterior axis of the LCS of dynamic trial.
     y_dyn: numpy array of shape (n, 3) representing the lateral axis of the LCS of dynamic trial.
     z_dyn: numpy array of shape (n, 3) representing the proximal axis of the LCS of dynamic trial.
-    mrk_lcl_av: numpy array of shape (n, 3) representing the virtual markers in LCS of static trial.
+    mrk_lcl_av: numpy array of shape (3,) or (1, 3) representing the virtual marker in LCS of static trial,
+                or (m, 1, 3) for a stack of m virtual markers.
 
     Returns:
-    - mrk_dyn: numpy array of shape (n, 3) representing the dynamic version of the static marker.
+    - mrk_dyn: numpy array of shape (n, 3) (or (m, n, 3)) representing the dynamic version of the static marker.
     """
-    mrk_dyn = np.zeros_like(o_dyn)
-    for i in range(len(mrk_dyn)):
-        # create LCS for dynamic trial at each frame
-        x_prime = makeunit(x_dyn[i, :] - o_dyn[i, :])
-        y_prime = makeunit(y_dyn[i, :] - o_dyn[i, :])
-        z_prime = makeunit(z_dyn[i, :] - o_dyn[i, :])
-        lcs_prime = np.vstack([x_prime, y_prime, z_prime])
+    axes = axes_from_markers(o_dyn, x_dyn, y_dyn, z_dyn)
+    mrk_dyn = lcs_2_gcs(o_dyn, axes, mrk_lcl_av)
 
-        # transform marker from lcs_prime to gcs
-        mrk_lcl_prime = ctransform(lcs_prime, gunit(), mrk_lcl_av)
+    return mrk_dyn
 
-        # translate marker position from 0 to origin of LCS dynamic
-        mrk_dyn[i, :] = mrk_lcl_prime + np.expand_dims(o_dyn[i, :], axis=0)
 
-    return mrk_dyn
+def axes_from_markers(O, A, L, P):
+    """
+     creates the stack of unit axes of a local coordinate system defined by marker positions
+     ARGUMENTS
+       O            ...  n x 3 array: origin of the local coordinate system
+       A, L, P      ...  n x 3 arrays: markers on the first, second and third axis
+                         (e.g. lcs1, lcs2, lcs3 returned by create_lcs)
+
+     RETURNS
+       axes         ...  n x 3 x 3 array: axes[i] is the 3 x 3 axes system of frame i
+                         (rows = axes 1, 2, 3, columns = X, Y, Z)
+    """
+    return np.stack((makeunit(A - O), makeunit(L - O), makeunit(P - O)), axis=-2)
+
+
+def gcs_2_lcs(O, axes, mrk):
+    """
+     transforms markers from the global coordinate system to a moving local coordinate system
+     ARGUMENTS
+       O            ...  n x 3 array: origin of the local coordinate system
+       axes         ...  n x 3 x 3 array: axes of the local coordinate system (see lcs_axes)
+       mrk          ...  n x 3 array of marker coordinates in GCS, or m x n x 3 stack of m markers
+
+     RETURNS
+       mrk_lcl      ...  n x 3 (or m x n x 3) array: markers expressed in the local coordinate system
+
+     NOTES
+     - all frames and markers are transformed in a single batched operation
+    """
+    mrk_lcl = np.matmul(axes, (mrk - O)[..., np.newaxis])
+    return mrk_lcl[..., 0]
+
+
+def lcs_2_gcs(O, axes, mrk_lcl):
+    """
+     transforms markers from a moving local coordinate system to the global coordinate system
+     ARGUMENTS
+       O            ...  n x 3 array: origin of the local coordinate system
+       axes         ...  n x 3 x 3 array: axes of the local coordinate system (see lcs_axes)
+       mrk_lcl      ...  n x 3 array of marker coordinates in LCS, 3 or 1 x 3 array for a marker fixed in
+                         the LCS, or m x n x 3 (m x 1 x 3) stack of m markers
+
+     RETURNS
+       mrk          ...  n x 3 (or m x n x 3) array: markers expressed in the global coordinate system
+
+     NOTES
+     - all frames and markers are transformed in a single batched operation
+    """
+    mrk = np.matmul(np.asarray(mrk_lcl)[..., np.newaxis, :], axes)
+    return mrk[..., 0, :] + O
 
 
 def create_lcs(O, vec1, vec2, order):
@@ -59,39 +101,64 @@ def create_lcs(O, vec1, vec2, order):
     if np.ndim(vec2) == 1:
         vec2 = np.expand_dims(vec2, 1).T  # fix (3,) to (1,3)
 
+    axes = lcs_axes(vec1, vec2, order)
+    axis1 = axes[:, 0, :]
+    axis2 = axes[:, 1, :]
+    axis3 = axes[:, 2, :]
+
+    lcs1 = O + axis1
+    lcs2 = O + axis2
+    lcs3 = O + axis3
+    axes_system = np.vstack((axis1, axis2, axis3))
+
+    return O, lcs1, lcs2, lcs3, axes_system
+
+
+def lcs_axes(vec1, vec2, order):
+    """
+     creates the unit axes of a local coordinate system for every frame at once
+     ARGUMENTS
+       vec1         ...  n x 3 array: vector representing the first axis
+       vec2         ...  n x 3 array: second vector used to create the axes
+       order        ...  str, order in which the axes are created (see create_lcs)
+
+     RETURNS
+       axes         ...  n x 3 x 3 array: axes[i] is the 3 x 3 axes system of frame i
+                         (rows = axes 1, 2, 3, columns = X, Y, Z)
+    """
+    if np.ndim(vec1) == 1:
+        vec1 = np.expand_dims(vec1, 1).T  # fix (3,) to (1,3)
+    if np.ndim(vec2) == 1:
+        vec2 = np.expand_dims(vec2, 1).T  # fix (3,) to (1,3)
+
     if order == 'xyz':
         axis1 = makeunit(vec1)
-        axis2 = makeunit(np.cross(vec2, axis1))
-        axis3 = makeunit(np.cross(axis1, axis2))
+        axis2 = makeunit(rowcross(vec2, axis1))
+        axis3 = makeunit(rowcross(axis1, axis2))
     elif order == 'xzy':
         axis1 = makeunit(vec1)
-        axis3 = makeunit(np.cross(axis1, vec2))
-        axis2 = makeunit(np.cross(axis3, axis1))
+        axis3 = makeunit(rowcross(axis1, vec2))
+        axis2 = makeunit(rowcross(axis3, axis1))
     elif order == 'zxy':
         axis3 = makeunit(vec1)  # z - anterior
-        axis1 = makeunit(np.cross(vec2, axis3))  # x - proximal
-        axis2 = makeunit(np.cross(axis3, axis1))  # y - medial for right
+        axis1 = makeunit(rowcross(vec2, axis3))  # x - proximal
+        axis2 = makeunit(rowcross(axis3, axis1))  # y - medial for right
     elif order == 'zyx':
         axis3 = makeunit(vec1)  # z - anterior
-        axis2 = makeunit(np.cross(vec2, axis3))  # y - medial for right
-        axis1 = makeunit(np.cross(axis3, axis2))  # x - proximal
+        axis2 = makeunit(rowcross(vec2, axis3))  # y - medial for right
+        axis1 = makeunit(rowcross(axis3, axis2))  # x - proximal
     elif order == 'yzx':
         axis2 = makeunit(vec1)  # y - up
-        axis3 = makeunit(np.cross(axis2, vec2))  # y - medial for right
-        axis1 = makeunit(np.cross(axis2, axis3))  # x - anterior
+        axis3 = makeunit(rowcross(axis2, vec2))  # y - medial for right
+        axis1 = makeunit(rowcross(axis2, axis3))  # x - anterior
     elif order == 'yxz':
         axis2 = makeunit(vec1)  # y - up
-        axis1 = makeunit(np.cross(vec2, axis2))  # x - forward
-        axis3 = makeunit(np.cross(axis1, axis2))  # z - lateral for right
+        axis1 = makeunit(rowcross(vec2, axis2))  # x - forward
+        axis3 = makeunit(rowcross(axis1, axis2))  # z - lateral for right
     else:
         raise ValueError("Invalid order. Must be 'xyz', 'xzy', 'zxy', 'zyx', 'yzx', or 'yxz'.")
 
-    lcs1 = O + axis1
-    lcs2 = O + axis2
-    lcs3 = O + axis3
-    axes_system = np.vstack((axis1, axis2, axis3))
-
-    return O, lcs1, lcs2, lcs3, axes_system
+    return np.stack((axis1, axis2, axis3), axis=1)
 
 
 def angle(m1, m2, ref='deg'):
@@ -107,7 +174,7 @@ def angle(m1, m2, ref='deg'):
 
     """
 
-    dotp = np.diag(np.matmul(m1, np.conj(m2).T))
+    dotp = rowdot(m1, np.conj(m2))
     r = np.arcsin(dotp)
 
     # convert from rad to degree
@@ -131,11 +198,42 @@ def makeunit(vec):
     if np.ndim(vec) == 1:
         vec = np.expand_dims(vec, axis=0)
 
-    mag = np.sqrt(np.diag(np.dot(vec, vec.T)))
-    unt = np.divide(vec.T, mag).T
+    mag = magnitude(vec)
+    unt = vec / mag[..., np.newaxis]
     return unt
 
 
+def rowdot(m1, m2):
+    """ row-wise dot product of two n x 3 matrices
+     ARGUMENTS
+       m1       ...     n x 3 (or 1 x 3) array of vectors
+       m2       ...     n x 3 (or 1 x 3) array of vectors
+     RETURNS
+       d        ...     np.array. n x 1. dot product of each pair of rows
+
+     NOTES
+     - memory and time are linear in the number of rows (unlike np.diag(m1 @ m2.T))
+    """
+    return np.einsum('...j,...j->...', m1, m2)
+
+
+def rowcross(m1, m2):
+    """ row-wise cross product of two n x 3 matrices
+     ARGUMENTS
+       m1       ...     n x 3 (or 1 x 3) array of vectors
+       m2       ...     n x 3 (or 1 x 3) array of vectors
+     RETURNS
+       c        ...     np.array. n x 3. cross product m1 x m2 of each pair of rows
+    """
+    m1 = np.asarray(m1)
+    m2 = np.asarray(m2)
+    c = np.empty(np.broadcast_shapes(m1.shape, m2.shape), dtype=np.result_type(m1, m2))
+    c[..., 0] = m1[..., 1] * m2[..., 2] - m1[..., 2] * m2[..., 1]
+    c[..., 1] = m1[..., 2] * m2[..., 0] - m1[..., 0] * m2[..., 2]
+    c[..., 2] = m1[..., 0] * m2[..., 1] - m1[..., 1] * m2[..., 0]
+    return c
+
+
 def magnitude(r, axis=1):
     """ compute magnitude of a vector
      ARGUMENTS
@@ -190,103 +288,108 @@ def ctransform(c1, c2, vec):
         raise IOError('inputs must be arrays')
 
 
-def replace4(p1, p2, p3, p4):
-    # Move p1 to local system 234
-    p1_vec_lcl = np.zeros_like(p1)
-    for i in range(p1.shape[0]):
-        # Create system 234 for each frame of trial
-        _, _, _, _, s234 = create_lcs(p3[i, :], p2[i, :] - p3[i, :], p3[i, :] - p4[i, :], 'xyz')
+def replace4(p1, p2, p3, p4, stats=None, key='replace4'):
+    """
+     corrects the position of each marker of a rigid 4 marker cluster using the other 3 markers
+     ARGUMENTS
+       p1, p2, p3, p4 ... n x 3 arrays, markers of the cluster
+       stats          ... dict, Default = None. Running statistics (see init_running_stats). If None, the
+                          local positions are averaged over the n frames given
+       key            ... str, name of the cluster in stats
+
+     RETURNS
+       rep_p1, rep_p2, rep_p3, rep_p4 ... n x 3 arrays, corrected markers
+
+     NOTES
+     - each marker is expressed in the system created by the other 3 markers (system 234 for p1,
+       341 for p2, 412 for p3 and 123 for p4), averaged over the trial, moved back to global and
+       averaged with the original marker
+     - all frames are processed at once, the systems are n x 3 x 3 stacks
+     - with stats, the average is taken over all frames seen so far (streaming) or over the frames
+       accumulated in a previous pass (chunked processing), see running_mean
+    """
+    pts = [p1, p2, p3, p4]
+    rep = []
+    for k in range(len(pts)):
+        p = pts[k]
+        pa = pts[(k + 1) % 4]
+        pb = pts[(k + 2) % 4]
+        pc = pts[(k + 3) % 4]
+
+        # Create system (e.g. 234 for p1) for each frame of trial, origin is pb
+        s = lcs_axes(pa - pb, pb - pc, 'xyz')
+
         # Transform to local for each frame of trial
-        p1_vec_lcl[i, :] = ctransform(gunit(), s234, p1[i, :] - p3[i, :])
+        p_vec_lcl = gcs_2_lcs(pb, s, p)
 
-    # Calculate average location of p1 in system 234
-    if p1.shape[0] > 1:
-        p1_vec_lcl_av = np.mean(p1_vec_lcl, axis=0)
-    else:
-        p1_vec_lcl_av = p1_vec_lcl
-
-    # Move the average location of p1 in system 234 back to global
-    p1_vec_gbl = np.zeros_like(p1)
-    new_p1 = np.zeros_like(p1)
-    rep_p1 = np.zeros_like(p1)
-    for i in range(p1.shape[0]):
-        # Create system 234 for each frame of trial
-        _, _, _, _, s234 = create_lcs(p3[i, :], p2[i, :] - p3[i, :], p3[i, :] - p4[i, :], 'xyz')
-        # Transform average location of p1 in system 234 back to global for every frame of trial
-        p1_vec_gbl[i, :] = ctransform(s234, gunit(), p1_vec_lcl_av)
-        # Add position back to local origin to obtain marker position
-        new_p1[i, :] = p1_vec_gbl[i, :] + p3[i, :]
-        # Create average of new_p1 and original p1
-        rep_p1[i, :] = (new_p1[i, :] + p1[i, :]) / 2
-
-    # Create system 341
-    p2_vec_lcl = np.zeros_like(p2)
-    for i in range(p2.shape[0]):
-        _, _, _, _, s341 = create_lcs(p4[i, :], p3[i, :] - p4[i, :], p4[i, :] - p1[i, :], 'xyz')
-        p2_vec_lcl[i, :] = ctransform(gunit(), s341, p2[i, :] - p4[i, :])
-
-    if p2.shape[0] > 1:
-        p2_vec_lcl_av = np.mean(p2_vec_lcl, axis=0)
-    else:
-        p2_vec_lcl_av = p2_vec_lcl
-
-    p2_vec_gbl = np.zeros_like(p2)
-    new_p2 = np.zeros_like(p2)
-    rep_p2 = np.zeros_like(p2)
-    for i in range(p2.shape[0]):
-        _, _, _, _, s341 = create_lcs(p4[i, :], p3[i, :] - p4[i, :], p4[i, :] - p1[i, :], 'xyz')
-        p2_vec_gbl[i, :] = ctransform(s341, gunit(), p2_vec_lcl_av)
-        new_p2[i, :] = p2_vec_gbl[i, :] + p4[i, :]
-        rep_p2[i, :] = (new_p2[i, :] + p2[i, :]) / 2
-
-    # Create system 412
-    p3_vec_lcl = np.zeros_like(p3)
-    for i in range(p3.shape[0]):
-        _, _, _, _, s412 = create_lcs(p1[i, :], p4[i, :] - p1[i, :], p1[i, :] - p2[i, :], 'xyz')
-        p3_vec_lcl[i, :] = ctransform(gunit(), s412, p3[i, :] - p1[i, :])
-
-    if p3.shape[0] > 1:
-        p3_vec_lcl_av = np.mean(p3_vec_lcl, axis=0)
-    else:
-        p3_vec_lcl_av = p3_vec_lcl
-
-    p3_vec_gbl = np.zeros_like(p3)
-    new_p3 = np.zeros_like(p3)
-    rep_p3 = np.zeros_like(p3)
-    for i in range(p3.shape[0]):
-        _, _, _, _, s412 = create_lcs(p1[i, :], p4[i, :] - p1[i, :], p1[i, :] - p2[i, :], 'xyz')
-        p3_vec_gbl[i, :] = ctransform(s412, gunit(), p3_vec_lcl_av)
-        new_p3[i, :] = p3_vec_gbl[i, :] + p1[i, :]
-        rep_p3[i, :] = (new_p3[i, :] + p3[i, :]) / 2
-
-    # Create system 123
-    p4_vec_lcl = np.zeros_like(p4)
-    for i in range(p4.shape[0]):
-        _, _, _, _, s123 = create_lcs(p2[i, :], p1[i, :] - p2[i, :], p2[i, :] - p3[i, :], 'xyz')
-        p4_vec_lcl[i, :] = ctransform(gunit(), s123, p4[i, :] - p2[i, :])
-
-    if p4.shape[0] > 1:
-        p4_vec_lcl_av = np.mean(p4_vec_lcl, axis=0)
-    else:
-        p4_vec_lcl_av = p4_vec_lcl
-
-    p4_vec_gbl = np.zeros_like(p4)
-    new_p4 = np.zeros_like(p4)
-    rep_p4 = np.zeros_like(p4)
-    for i in range(p4.shape[0]):
-        _, _, _, _, s123 = create_lcs(p2[i, :], p1[i, :] - p2[i, :], p2[i, :] - p3[i, :], 'xyz')
-        p4_vec_gbl[i, :] = ctransform(s123, gunit(), p4_vec_lcl_av)
-        new_p4[i, :] = p4_vec_gbl[i, :] + p2[i, :]
-        rep_p4[i, :] = (new_p4[i, :] + p4[i, :]) / 2
-
-    # rep_p1 = p1
-    # rep_p2 = p2
-    # rep_p3 = p3
-    # rep_p4 = p4
+        # Calculate average location of p in local system
+        p_vec_lcl_av = running_mean(p_vec_lcl, stats, key + str(k + 1))
+
+        # Move the average location back to global and add position of local origin
+        new_p = lcs_2_gcs(pb, s, p_vec_lcl_av)
+
+        # Create average of new_p and original p
+        rep.append((new_p + p) / 2)
+
+    rep_p1, rep_p2, rep_p3, rep_p4 = rep
 
     return rep_p1, rep_p2, rep_p3, rep_p4
 
 
+def init_running_stats(update=True):
+    """
+     stats = INIT_RUNNING_STATS(update) creates an empty set of running statistics, used in place of the
+     whole-trial averages of the batch code when a trial is processed frame by frame or in chunks
+
+     ARGUMENTS
+       update ... bool, Default = True. If true, the statistics are updated with every block of frames
+                  processed. If false, the statistics are frozen (e.g. after a first pass over the trial)
+
+     RETURNS
+       stats  ... dict, with keys 'update', 'sum' and 'n' (running sums and counts of valid frames),
+                  'ends' (first and last frames), 'direction' (if set, direction of motion used instead of
+                  the running estimate), 'fallback_direction' and 'min_travel' (direction used until the
+                  subject has travelled min_travel mm), see utils.getDir
+    """
+    return {'update': update, 'sum': {}, 'n': {}, 'ends': {}, 'direction': None, 'fallback_direction': None,
+            'min_travel': 0.0}
+
+
+def running_mean(values, stats=None, key=None):
+    """
+     av = RUNNING_MEAN(values, stats, key) averages values over frames
+
+     ARGUMENTS
+       values ... n x ... array, values for each frame of the current block
+       stats  ... dict, Default = None. Running statistics (see init_running_stats). If None, the mean of
+                  values over the n frames is returned
+       key    ... str, name of the statistic in stats
+
+     RETURNS
+       av     ... array, mean over frames
+
+     NOTES
+     - with stats, frames with NaN values (gaps) are ignored and the sums are only updated if
+       stats['update'] is true
+    """
+    if stats is None:
+        return np.mean(values, axis=0)
+
+    if stats['update']:
+        valid = ~np.isnan(values)
+        block_sum = np.where(valid, values, 0).sum(axis=0)
+        block_n = valid.sum(axis=0)
+        if key in stats['sum']:
+            stats['sum'][key] = stats['sum'][key] + block_sum
+            stats['n'][key] = stats['n'][key] + block_n
+        else:
+            stats['sum'][key] = block_sum
+            stats['n'][key] = block_n
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return stats['sum'][key] / stats['n'][key]
+
+
 def point_to_plane(p1, p2, p3, p4):
     """
      proj_p1 = POINT_TO_PLANE(p1,p2,p3,p4) projects marker p1 into a plane
@@ -306,12 +409,10 @@ def point_to_plane(p1, p2, p3, p4):
     a = p2 - p4
     b = p3 - p4
     # create vector normal to the plane
-    n = makeunit(np.cross(a, b))
+    n = makeunit(rowcross(a, b))
 
-    # make each row of n a unit vector and calculate t
-    t = np.zeros(n.shape)
-    for i in range(n.shape[0]):
-        t[i, :] = np.dot(w[i, :], n[i, :]) * n[i, :]
+    # component of w along the normal of the plane
+    t = rowdot(w, n)[:, np.newaxis] * n
 
     # subtract t from w and add back p2 to get coordinates of projected point
     proj_p1 = (w - t) + p2
@@ -321,21 +422,10 @@ def point_to_plane(p1, p2, p3, p4):
 def pointonline(p1, p2, pos):
     # p1: first point m x 3 matrix
     # p2: second point m x 3 matrix
-    # pos: distance from p1
+    # pos: distance from p1 (scalar or m array, as a fraction of the distance from p1 to p2)
 
     ln = p2 - p1
-    [r, _] = ln.shape
-
-    if r == 1:
-        pt = np.zeros((1, 3))
-        pt[0] = p1[0] + ln[0] * pos
-        pt[1] = p1[1] + ln[1] * pos
-        pt[2] = p1[2] + ln[2] * pos
-    else:
-        pt = np.zeros(ln.shape)
-        pt[:, 0] = p1[:, 0] + ln[:, 0] * pos
-        pt[:, 1] = p1[:, 1] + ln[:, 1] * pos
-        pt[:, 2] = p1[:, 2] + ln[:, 2] * pos
+    pt = p1 + ln * np.asarray(pos)[..., np.newaxis]
 
     return pt
 
@@ -390,77 +480,86 @@ def move_marker_gcs_2_lcs(O, A, L, P, M):
     A -- n x 3 array, Anterior axis of the segment
     L -- n x 3 array, Lateral axis of the segment (medial for right side)
     P -- n x 3 array, Proximal axis of the segment
-    M -- n x 3 array, Marker coordinates in GCS
+    M -- n x 3 array, Marker coordinates in GCS (or m x n x 3 stack of markers)
 
     Returns:
-    m_lcs_static -- n x 3 array, Marker moved from GCS to LCS
+    m_lcs_static -- n x 3 (or m x n x 3) array, Marker moved from GCS to LCS
     """
-    m_lcs_static = np.zeros_like(O)
-
-    for i in range(len(m_lcs_static)):
-        # Create LCS for static trial at each frame
-        a = makeunit(np.expand_dims(A[i, :] - O[i, :], axis=0))
-        l = makeunit(np.expand_dims(L[i, :] - O[i, :], axis=0))
-        p = makeunit(np.expand_dims(P[i, :] - O[i, :], axis=0))
-        lcs_static = np.vstack((a, l, p))
-
-        # Translate marker to origin of GCS
-        m_static = np.expand_dims(M[i, :] - O[i, :], axis=0)
-
-        # Transform marker position from GCS to lcs_static
-        m_lcs_static[i, :] = ctransform(gunit(), lcs_static, m_static)
+    lcs_static = axes_from_markers(O, A, L, P)
+    m_lcs_static = gcs_2_lcs(O, lcs_static, M)
 
     return m_lcs_static
 
 
 def rotate_axes(axes, theta, axis):
+    """
+     rotates a local coordinate system about one of its own axes
+     ARGUMENTS
+       axes     ...  3 x 3 array (rows = axes) or n x 3 x 3 stack of axes (see lcs_axes)
+       theta    ...  float, rotation angle in degrees
+       axis     ...  str, axis to rotate about: 'x', 'y' or 'z'
+
+     RETURNS
+       rot_axes ...  3 x 3 (or n x 3 x 3) array of rotated axes
+    """
     # Convert axis to lowercase for comparison
     axis = axis.lower()
 
     # Extract the specified axis from the local coordinate system
     if axis == 'x':
-        axis_vector = axes[0, :]
+        axis_vector = axes[..., 0, :]
     elif axis == 'y':
-        axis_vector = axes[1, :]
+        axis_vector = axes[..., 1, :]
     elif axis == 'z':
-        axis_vector = axes[2, :]
+        axis_vector = axes[..., 2, :]
     else:
         raise ValueError("Invalid axis. Must be 'x', 'y', or 'z'.")
 
     # Compute axis variables
-    L = np.linalg.norm(axis_vector)
-    a, b, c = axis_vector
+    L = magnitude(axis_vector, axis=-1)
+    a = axis_vector[..., 0]
+    b = axis_vector[..., 1]
+    c = axis_vector[..., 2]
     V = np.sqrt(b ** 2 + c ** 2)
+    zero = np.zeros_like(a)
+    one = np.ones_like(a)
+    cos_t = np.cos(np.deg2rad(theta)) * one
+    sin_t = np.sin(np.deg2rad(theta)) * one
 
     # Rotate about the global x-axis
-    rot_x = np.array([[1, 0, 0],
-                      [0, c / V, b / V],
-                      [0, -b / V, c / V]])
+    rot_x = _stack3x3([[one, zero, zero],
+                       [zero, c / V, b / V],
+                       [zero, -b / V, c / V]])
 
     # Rotate about the global y-axis
-    rot_y = np.array([[V / L, 0, a / L],
-                      [0, 1, 0],
-                      [-a / L, 0, V / L]])
+    rot_y = _stack3x3([[V / L, zero, a / L],
+                       [zero, one, zero],
+                       [-a / L, zero, V / L]])
 
     # Rotate about the global z-axis
-    rot_z = np.array([[np.cos(np.deg2rad(theta)), np.sin(np.deg2rad(theta)), 0],
-                      [-np.sin(np.deg2rad(theta)), np.cos(np.deg2rad(theta)), 0],
-                      [0, 0, 1]])
+    rot_z = _stack3x3([[cos_t, sin_t, zero],
+                       [-sin_t, cos_t, zero],
+                       [zero, zero, one]])
 
     # Reverse the rotation about the y-axis
-    rev_rot_y = np.array([[V / L, 0, -a / L],
-                          [0, 1, 0],
-                          [a / L, 0, V / L]])
+    rev_rot_y = _stack3x3([[V / L, zero, -a / L],
+                           [zero, one, zero],
+                           [a / L, zero, V / L]])
 
     # Reverse the rotation about the x-axis
-    rev_rot_x = np.array([[1, 0, 0],
-                          [0, c / V, -b / V],
-                          [0, b / V, c / V]])
+    rev_rot_x = _stack3x3([[one, zero, zero],
+                           [zero, c / V, -b / V],
+                           [zero, b / V, c / V]])
 
     # Create transformation matrix
-    t = np.dot(rot_x, np.dot(rot_y, np.dot(rot_z, np.dot(rev_rot_y, rev_rot_x))))
+    t = np.matmul(rot_x, np.matmul(rot_y, np.matmul(rot_z, np.matmul(rev_rot_y, rev_rot_x))))
 
     # Rotate axes
-    rot_axes = np.dot(axes, t)
+    rot_axes = np.matmul(axes, t)
+
+    return rot_axes
+
 
-    return rot_axes
\ No newline at end of file
+def _stack3x3(rows):
+    """ helper function to build a (stack of) 3 x 3 matrices from 9 scalars or n x 1 arrays"""
+    return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
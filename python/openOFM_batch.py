@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import fnmatch
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from openOFM_static import openOFM_static
+from openOFM_dynamic import openOFM_dynamic
+from utils.utils import get_python_settings, make_plot_title, ANGLE_JOINTS, PRECISIONS
+from utils.utils_profile import profiling_enabled, profile_path, aggregate_profiles, print_summary
+from utils.utils_gait import cycles_path, SIDES
+from utils.utils_aggregate import init_aggregate, update_aggregate, save_aggregate
+from utils.utils_export import EXPORT_FORMATS
+from plotting.plotting_report import render_reports, report_channels, REPORT_FORMATS
+
+
+def find_subjects(path, static_name='static.c3d'):
+    """ find subject folders to process
+
+    Arguments:
+        path        ... str, root of a directory tree or manifest file listing one subject folder per line
+                        (relative to the manifest, lines starting with # are ignored)
+        static_name ... str, name of the static trial, folders containing this file are subjects
+    Returns:
+        subjects    ... list, full path to each subject folder
+    """
+    if os.path.isfile(path):
+        root = os.path.dirname(os.path.abspath(path))
+        with open(path, 'r') as f:
+            lines = [line.strip() for line in f.readlines()]
+        return [os.path.join(root, line) for line in lines if line and not line.startswith('#')]
+
+    subjects = []
+    for folder, _, files in os.walk(path):
+        if static_name in files:
+            subjects.append(os.path.abspath(folder))
+    return sorted(subjects)
+
+
+def find_dynamic_trials(subject_dir, static_name='static.c3d', exclude=('*_processed.c3d',)):
+    """ list the dynamic trials (all .c3d files other than the static trial) of a subject folder"""
+    trials = []
+    for fl in sorted(os.listdir(subject_dir)):
+        if not fl.lower().endswith('.c3d') or fl == static_name:
+            continue
+        if any(fnmatch.fnmatch(fl, pattern) for pattern in exclude):
+            continue
+        trials.append(fl)
+    return trials
+
+
+def run_trial(settings):
+    """ process a single static or dynamic trial, returns a short report (safe to run in a worker process)"""
+    report = dict(subject=settings['data_dir'], trial=settings['file_name'], trial_type=settings['trial_type'])
+    t0 = time.perf_counter()
+    try:
+        if settings['use_settings']:
+            settings.update(get_python_settings(settings))
+        if settings['trial_type'] == 'static':
+            data = openOFM_static(settings=settings)
+        else:
+            data = openOFM_dynamic(settings=settings)
+        report['frames'] = len(data['RHEE']) if 'RHEE' in data else None
+        report['status'] = 'ok'
+        if profiling_enabled(settings):
+            with open(profile_path(settings), 'r') as f:
+                report['profile'] = json.load(f)
+        if settings.get('cycles') and settings['trial_type'] == 'dynamic':
+            with np.load(cycles_path(settings)) as f:
+                report['cycles'] = {side: (f[side], [str(ch) for ch in f[side + '_channels']])
+                                    for side in SIDES.values()}
+        if settings.get('cohort_report') and settings['trial_type'] == 'dynamic':
+            report['report_job'] = dict(data=report_channels(data), title=make_plot_title(settings))
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = '{}: {}'.format(type(e).__name__, e)
+        report['traceback'] = traceback.format_exc()
+    report['time'] = time.perf_counter() - t0
+
+    return report
+
+
+def openOFM_batch(subjects, version='1.0', use_settings=False, static_name='static.c3d',
+                  exclude=('*_processed.c3d',), workers=None, verbose=True, profile=False, aggregate=None,
+                  export=None, report=None, precision=None, report_fl=None):
+    """ process whole cohorts in parallel
+
+    Arguments:
+        subjects     ... list, full path to subject folders
+        version      ... str, openOFM version '1.0' or '1.1'
+        use_settings ... bool, if true uses the settings.yml of each subject folder
+        static_name  ... str, name of the static trial in each subject folder
+        exclude      ... tuple, file patterns that are not dynamic trials
+        workers      ... int, Default = None. Number of worker processes. If None, the number of cores
+        verbose      ... bool, if true prints a line per processed trial
+        profile      ... bool or str, if true profiles each trial (see utils_profile), the profile is added to its report.
+                         If 'memory', also records the peak memory of each step
+        aggregate    ... dict, Default = None. Aggregate (see utils_aggregate.init_aggregate) updated with the gait
+                         cycles of every dynamic trial (see openOFM_dynamic, cycles)
+        export       ... str, Default = None. 'hdf5' or 'parquet', exports the results of every dynamic trial next to
+                         it (see openOFM_dynamic, export)
+        report       ... str, Default = None. 'png' or 'svg' saves a plot of the angles of every dynamic trial next
+                         to it, each worker reuses its figure (see plotting_report). 'pdf' saves the plots of all
+                         dynamic trials as the pages of a single pdf (see report_fl)
+        precision    ... str, Default = None. 'float64' or 'float32', floating point type of the computations (see
+                         utils.set_precision). If None, float64
+        report_fl    ... str, Default = None. Full path to the pdf of all trials (report 'pdf'). If None,
+                         openOFM_report.pdf in the folder common to all subjects
+    Returns:
+        reports      ... list, one report per trial (subject, trial, status, time, frames, error, profile)
+
+    Notes:
+        - the static trial of a subject is processed first, its dynamic trials are then processed
+        concurrently with the trials of all other subjects
+        - with aggregate, workers send the normalised cycles of each trial, which are added to the aggregate and
+        dropped, so that memory does not grow with the number of trials
+        - with report 'pdf', workers send the angles of each trial (see report_channels), the pages are written
+        once all trials are processed, in the order of subjects and trials
+    """
+    cohort_report = report == 'pdf'
+    base = dict(nexus=False, version=version, use_settings=use_settings, make_plot=False, profile=profile,
+                cycles=aggregate is not None, export=export, report=None if cohort_report else report,
+                cohort_report=cohort_report, precision=precision)
+    reports = []
+    jobs = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for subject in subjects:
+            settings = dict(base, data_dir=subject, file_name=static_name, trial_type='static')
+            pending[pool.submit(run_trial, settings)] = subject
+
+        while pending:
+            future = next(as_completed(pending))
+            subject = pending.pop(future)
+            report = future.result()
+            for cycles, channels in report.pop('cycles', {}).values():
+                update_aggregate(aggregate, cycles, channels)
+            if 'report_job' in report:
+                jobs.append(dict(report.pop('report_job'), subject=report['subject'], trial=report['trial']))
+            reports.append(report)
+            if verbose:
+                print_report(report)
+
+            # dynamic trials can start once the static calibration of the subject is available
+            if report['trial_type'] == 'static':
+                if report['status'] != 'ok':
+                    continue
+                for trial in find_dynamic_trials(subject, static_name, exclude):
+                    settings = dict(base, data_dir=subject, file_name=trial, trial_type='dynamic',
+                                    static_name=static_name)
+                    pending[pool.submit(run_trial, settings)] = subject
+
+    if cohort_report and jobs:
+        if report_fl is None:
+            report_fl = os.path.join(os.path.commonpath(subjects), 'openOFM_report.pdf')
+        render_reports(sorted(jobs, key=lambda job: (job['subject'], job['trial'])), report_fl)
+
+    return reports
+
+
+def print_report(report):
+    """ helper function to print the outcome of a trial"""
+    name = os.path.join(report['subject'], report['trial'])
+    if report['status'] == 'ok':
+        print('[ok]     {} ({} frames, {:.2f} s)'.format(name, report['frames'], report['time']))
+    else:
+        print('[failed] {} ({})'.format(name, report['error']))
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='openOFM batch processing of static and dynamic trials for whole cohorts',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('path', help='Root folder containing subject folders, or manifest file listing them')
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
+    parser.add_argument('--static_name', default='static.c3d', help='name of the static trial of each subject')
+    parser.add_argument('--exclude', nargs='*', default=['*_processed.c3d'],
+                        help='file patterns to skip when looking for dynamic trials')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--use_settings', action="store_true",
+                        help='If true, looks for settings.yml in each subject folder. '
+                             'If false, looks for settings in .c3d files')
+    parser.add_argument('--profile', action="store_true",
+                        help='If true, profiles each trial and prints where the time of the batch goes')
+    parser.add_argument('--profile_memory', action="store_true",
+                        help='If true, also records the peak memory of each step, with tracemalloc slowing down '
+                             'every step')
+    parser.add_argument('--profile_out', default=None, help='json file of the profiles of all trials')
+    parser.add_argument('--aggregate', default=None,
+                        help='npz file of the mean, variance, min and max of the gait cycles of all dynamic trials')
+    parser.add_argument('--export', choices=list(EXPORT_FORMATS), default=None,
+                        help='exports the results of each dynamic trial to <trial>_openOFM.h5 or .parquet')
+    parser.add_argument('--report', choices=REPORT_FORMATS, default=None,
+                        help='saves a plot of the angles of each dynamic trial to <trial>_report.png (or .svg), or of '
+                             'all dynamic trials to a single pdf (see --report_out)')
+    parser.add_argument('--report_out', default=None,
+                        help='pdf of all dynamic trials with --report pdf (default: openOFM_report.pdf in the folder '
+                             'common to all subjects)')
+    parser.add_argument('--precision', choices=list(PRECISIONS), default=None,
+                        help='floating point type of the computations (default: float64)')
+    parser.add_argument('--quantiles', action="store_true",
+                        help='If true, the aggregate also estimates quantiles of the gait cycles')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    subjects = find_subjects(args.path, args.static_name)
+    agg = None
+    if args.aggregate is not None:
+        channels = [name + angle + axis for name in SIDES.values() for angle in ANGLE_JOINTS
+                    for axis in ['_x', '_y', '_z']]
+        agg = init_aggregate(channels, sketch=args.quantiles)
+    reports = openOFM_batch(subjects, version=args.version, use_settings=args.use_settings,
+                            static_name=args.static_name, exclude=tuple(args.exclude), workers=args.workers,
+                            profile='memory' if args.profile_memory else args.profile, aggregate=agg, export=args.export,
+                            report=args.report, precision=args.precision, report_fl=args.report_out)
+    if agg is not None:
+        save_aggregate(agg, args.aggregate)
+
+    profiles = [r['profile'] for r in reports if 'profile' in r]
+    if profiles:
+        summary = aggregate_profiles(profiles)
+        print_summary(summary)
+        if args.profile_out is not None:
+            with open(args.profile_out, 'w') as f:
+                json.dump(dict(trials=profiles, summary=summary), f, indent=1)
+
+    failed = [r for r in reports if r['status'] != 'ok']
+    print('processed {} trials of {} subjects in {:.1f} s, {} failed'.format(
+        len(reports), len(subjects), time.perf_counter() - t0, len(failed)))
+    sys.exit(1 if failed else 0)
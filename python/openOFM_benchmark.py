@@ -0,0 +1,414 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+
+from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG
+from OFM.virtual_markers import create_virtual_markers, animate_virtual_markers
+from OFM.segments import segments
+from OFM.kinematics import kinematics, grood_suntay, grood_suntay_1_0, refsystem
+from utils.utils import c3d_to_dict, addchannelsgs, find_repo_root, get_processing, get_calibration, set_data
+from utils.utils_c3d import write_c3d
+from utils.utils_fake_nexus import init_fake_nexus, fake_nexus, call_summary
+
+DEFAULT_LENGTHS = [1000, 10000, 100000, 1000000]
+
+# longest trial run through the in-memory pipeline stage by stage (about 1 GB at 100k frames), longer trials are
+# run through openOFM_chunked (see benchmark_chunked)
+IN_MEMORY_MAX_FRAMES = 100000
+
+# entry points whose import time (cold start of a new interpreter) is benchmarked
+STARTUP_MODULES = ['openOFM_static', 'openOFM_dynamic', 'openOFM_batch']
+
+# ezc3d reads at most 65535 frames, longer trials are only read with the memory-mapped reader
+EZC3D_MAX_FRAMES = 65535
+
+
+def run_benchmark(data_dir='Data_Sample/Sample', lengths=None, versions=('1.0', '1.1'), repeat=3, verbose=True,
+                  nexus_latency=0.0, startup=True):
+    """ time and memory-profile each stage of the pipeline at several trial lengths
+
+    Arguments:
+        data_dir    ... str, subject folder (relative to root) with static.c3d and dynamic.c3d
+        lengths     ... list, Default = None. Trial lengths in frames. If None, DEFAULT_LENGTHS
+        versions    ... tuple, openOFM versions to run
+        repeat      ... int, Default = 3. Each stage is run repeat times, the fastest run is reported
+        verbose     ... bool, if true prints a line per stage
+        nexus_latency ... float, Default = 0. Time (s) added to every call to Nexus by the fake Nexus used for the
+                        get_nexus_data and set_nexus_data stages (see utils_fake_nexus)
+        startup     ... bool, Default = True. If true, also times the import of the entry points (see
+                        benchmark_startup)
+    Returns:
+        results     ... dict, with keys 'meta' (commit, versions of python and numpy, ...) and 'results' (one
+                        entry per version, length and stage with the wall times in s and peak memory in MB)
+
+    Notes:
+        - trials of any length are made by repeating the subject's trials, every other copy is played backwards
+        so that markers are continuous
+        - peak memory is the peak of memory allocated by python and numpy during one extra run of the stage
+        (see tracemalloc), memory allocated by ezc3d is not included
+        - the whole pipeline is kept in memory up to IN_MEMORY_MAX_FRAMES (1M frames would need about 10 GB),
+        longer trials are only read (c3d_to_dict_mmap) and processed with openOFM_chunked under its default
+        memory budget, run once (see benchmark_chunked)
+        - the Nexus stages exchange data with a fake Nexus backed by the c3d file, their results also hold the
+        number of calls to Nexus per run ('nexus_calls')
+        - the stages computed side by side (joint centres, virtual markers and segments) are timed one side after
+        the other ('sides_sequential') and with both sides in threads ('parallel_sides', see run_sides), whose
+        result also holds the 'speedup' and the number of CPUs of the machine ('cpus')
+    """
+    if lengths is None:
+        lengths = DEFAULT_LENGTHS
+
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    sdata_raw = c3d_to_dict(os.path.join(root_dir, data_dir, 'static.c3d'), cache=False)
+    data_raw = c3d_to_dict(os.path.join(root_dir, data_dir, 'dynamic.c3d'), cache=False)
+
+    results = {'meta': get_meta(data_dir, repeat), 'results': []}
+    if startup:
+        for result in benchmark_startup(repeat=repeat):
+            results['results'].append(result)
+            if verbose:
+                print_result(result)
+    tmp_dir = tempfile.mkdtemp(prefix='openOFM_benchmark_')
+    try:
+        for n in lengths:
+            data = tile_trial(data_raw, n)
+            fl = os.path.join(tmp_dir, 'dynamic.c3d')
+            write_c3d(data, fl, rate=100.0)
+            if n > IN_MEMORY_MAX_FRAMES:
+                sdata = sdata_raw
+                data = None
+                gc.collect()
+            else:
+                sdata = tile_trial(sdata_raw, n)
+            for version in versions:
+                if data is None:
+                    stages = benchmark_chunked(sdata, fl, version, repeat)
+                else:
+                    stages = benchmark_trial(sdata, data, fl, version, repeat, nexus_latency)
+                for stage, times, peak, *extra in stages:
+                    result = dict(version=version, frames=n, stage=stage, time=min(times), times=times, peak_mb=peak)
+                    if extra:
+                        result.update(extra[0])
+                    results['results'].append(result)
+                    if verbose:
+                        print_result(result)
+            os.remove(fl)
+            del sdata, data
+            gc.collect()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def benchmark_trial(sdata, data, fl, version, repeat=3, nexus_latency=0.0):
+    """ helper function to run every stage of the pipeline on a trial, yields (stage, times, peak_mb) and a dict
+    of extra results for the Nexus stages (calls to Nexus per run) and the parallel_sides stage (speedup)"""
+    n = len(data['RHEE'])
+    settings = dict(version=version, processing=get_processing(sdata))
+
+    # 1: reading the dynamic trial
+    if n <= EZC3D_MAX_FRAMES:
+        times, peak, _ = time_stage(lambda: c3d_to_dict(fl, cache=False), repeat)
+        yield 'c3d_to_dict', times, peak
+    times, peak, _ = time_stage(lambda: c3d_to_dict(fl, mmap=True, cache=False), repeat)
+    yield 'c3d_to_dict_mmap', times, peak
+
+    # 2: static calibration
+    times, peak, sdata = time_stage(lambda: create_virtual_markers(copy_trial(sdata), settings), repeat)
+    yield 'create_virtual_markers', times, peak
+
+    # dynamic trial with the calibration of the static trial
+    data = copy_trial(data)
+    calibration = get_calibration(sdata)['PROCESSING']
+    data['parameters']['PROCESSING'].update({k: v for k, v in calibration.items() if 'openOFM' in k})
+
+    # 3: dynamic trial
+    data_sides = data
+    if version == '1.0':
+        for stage in [hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG]:
+            times, peak, data = time_stage(lambda: stage(copy_trial(data)), repeat)
+            yield stage.__name__, times, peak
+
+    times, peak, data = time_stage(lambda: animate_virtual_markers(copy_trial(data), settings), repeat)
+    yield 'animate_virtual_markers', times, peak
+
+    times, peak, (data, r, jnt) = time_stage(lambda: segments(copy_trial(data), version), repeat)
+    yield 'segments', times, peak
+
+    times, peak, data = time_stage(lambda: kinematics(copy_trial(data), r, jnt, version), repeat)
+    yield 'kinematics', times, peak
+
+    KIN = grood_suntay_1_0(r, jnt) if version == '1.0' else grood_suntay(r, jnt)
+    _, KIN = refsystem(copy_trial(data), KIN, version)
+    times, peak, _ = time_stage(lambda: addchannelsgs({}, KIN), repeat)
+    yield 'addchannelsgs', times, peak
+
+    # 4: data exchange with Nexus
+    state = init_fake_nexus(fl, latency=nexus_latency, parameters=data['parameters']['PROCESSING'])
+    with fake_nexus(state):
+        from utils.utils_nexus import get_nexus_data, set_nexus_data
+        for stage, fn in [('get_nexus_data', lambda: get_nexus_data(dict(version=version, trial_type='dynamic'))),
+                          ('set_nexus_data', lambda: set_nexus_data(data, 'dynamic'))]:
+            state['calls'] = []
+            times, peak, _ = time_stage(fn, repeat)
+            calls = sum(s['calls'] for s in call_summary(state).values()) // (repeat + 1)
+            yield stage, times, peak, dict(nexus_calls=calls)
+
+    # 5: stages computed side by side, one side after the other and concurrently
+    sequential, peak, _ = time_stage(lambda: run_side_stages(copy_trial(data_sides), settings, version), repeat)
+    yield 'sides_sequential', sequential, peak
+    times, peak, _ = time_stage(lambda: run_side_stages(copy_trial(data_sides), settings, version, True), repeat)
+    yield 'parallel_sides', times, peak, dict(speedup=min(sequential) / min(times), cpus=os.cpu_count())
+
+
+def benchmark_chunked(sdata, fl, version, repeat=3):
+    """ helper function to read a long trial and process it with openOFM_chunked, yields (stage, times, peak_mb)
+
+    Notes:
+        - the static trial is calibrated in memory and saved next to the trial (parameters.txt), as by
+        openOFM_static
+        - openOFM_chunked is run once (and once more for its peak memory), a run of 1M frames takes minutes
+    """
+    from openOFM_chunked import openOFM_chunked
+
+    times, peak, _ = time_stage(lambda: c3d_to_dict(fl, mmap=True, cache=False), repeat)
+    yield 'c3d_to_dict_mmap', times, peak
+
+    data_dir = os.path.dirname(fl)
+    settings = dict(version=version, processing=get_processing(sdata))
+    set_data(create_virtual_markers(copy_trial(sdata), settings), dict(data_dir=data_dir))
+    settings = dict(version=version, trial_type='dynamic', data_dir=data_dir, file_name=os.path.basename(fl),
+                    use_settings=False, out_dir=os.path.join(data_dir, 'chunked'))
+    times, peak, _ = time_stage(lambda: openOFM_chunked(dict(settings)), 1)
+    yield 'openOFM_chunked', times, peak
+
+
+def run_side_stages(data, settings, version, parallel=False):
+    """ helper function to run the stages of the dynamic trial computed side by side (see run_sides)"""
+    if version == '1.0':
+        data = hipjointcentrePiG_data(data)
+        data = kneejointcenterPiG(data, parallel=parallel)
+        data = anklejointcenterPiG(data, parallel=parallel)
+    data = animate_virtual_markers(data, settings, parallel=parallel)
+    data, _, _ = segments(data, version, parallel)
+    return data
+
+
+def benchmark_startup(modules=None, repeat=3):
+    """ times the import of entry points in new interpreters, as Nexus runs each pipeline step
+
+    Arguments:
+        modules     ... list, Default = None. Modules to import. If None, STARTUP_MODULES
+        repeat      ... int, Default = 3. Imports of each module, the fastest is reported
+    Returns:
+        results     ... list, one result per module (stage 'import_<module>', version 'all' and 0 frames) with the
+                        wall times (s) of the new interpreters, the import time (s) reported by python -X importtime
+                        and the slowest modules imported ('slowest', cumulative s)
+    """
+    if modules is None:
+        modules = STARTUP_MODULES
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    results = []
+    for module in modules:
+        times = []
+        imports = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=cwd,
+                                 capture_output=True, text=True, check=True)
+            times.append(time.perf_counter() - t0)
+            parsed = parse_importtime(out.stderr)
+            if imports is None or parsed[module] < imports[module]:
+                imports = parsed
+        slowest = sorted(((name, t) for name, t in imports.items() if name != module), key=lambda x: -x[1])[:5]
+        results.append(dict(version='all', frames=0, stage='import_' + module, time=min(times), times=times,
+                            peak_mb=0.0, import_time=imports[module], slowest=slowest))
+    return results
+
+
+def parse_importtime(stderr):
+    """ helper function to get the cumulative import time (s) of the modules imported by the top module from the
+    output of python -X importtime"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+def time_stage(fn, repeat=3):
+    """ helper function to time fn, returns the wall times of repeat runs, the peak memory (MB) of an extra run
+    and the output of fn"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+        del out
+
+    gc.collect()
+    tracemalloc.start()
+    out = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return times, peak / 1024 / 1024, out
+
+
+def copy_trial(data):
+    """ helper function to copy a trial, stages replace markers of data by new arrays but never modify them"""
+    data = dict(data)
+    data['parameters'] = dict(data['parameters'])
+    data['parameters']['PROCESSING'] = dict(data['parameters']['PROCESSING'])
+    return data
+
+
+def tile_trial(data, n):
+    """ repeat the markers of a trial up to n frames, every other copy is played backwards"""
+    n_trial = len(data['RHEE'])
+    reps = int(np.ceil(n / n_trial))
+    index = np.concatenate([np.arange(n_trial) if i % 2 == 0 else np.arange(n_trial)[::-1] for i in range(reps)])[:n]
+
+    tiled = {}
+    for key, value in data.items():
+        if isinstance(value, np.ndarray) and value.ndim == 2 and len(value) == n_trial:
+            tiled[key] = value[index]
+        else:
+            tiled[key] = value
+    return tiled
+
+
+def get_meta(data_dir, repeat):
+    """ helper function to describe the machine and the code being benchmarked"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return dict(commit=commit or 'unknown', date=time.strftime('%Y-%m-%d %H:%M:%S'), data_dir=data_dir,
+                repeat=repeat, python=platform.python_version(), numpy=np.__version__,
+                platform=platform.platform(), processor=platform.processor())
+
+
+def save_benchmark(results, fl):
+    """ save benchmark results to json file fl"""
+    with open(fl, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def load_benchmark(fl):
+    """ load benchmark results from json file fl"""
+    with open(fl, 'r') as f:
+        return json.load(f)
+
+
+def compare_benchmarks(base, new, threshold=0.2, min_time=0.001, min_mb=1.0):
+    """ compare two benchmark results
+
+    Arguments:
+        base        ... dict, baseline results (see run_benchmark)
+        new         ... dict, new results
+        threshold   ... float, Default = 0.2. Relative increase in time or memory flagged as a regression
+        min_time    ... float, Default = 0.001. Increases in time smaller than min_time (s) are ignored (noise)
+        min_mb      ... float, Default = 1. Increases in peak memory smaller than min_mb (MB) are ignored
+    Returns:
+        rows        ... list, one dict per stage found in both results, with the ratios new / base and a list of
+                        regressions ('time' and/or 'memory')
+    """
+    base_results = {(r['version'], r['frames'], r['stage']): r for r in base['results']}
+
+    rows = []
+    for r in new['results']:
+        key = (r['version'], r['frames'], r['stage'])
+        if key not in base_results:
+            continue
+        b = base_results[key]
+        row = dict(version=r['version'], frames=r['frames'], stage=r['stage'], base_time=b['time'], time=r['time'],
+                   base_peak_mb=b['peak_mb'], peak_mb=r['peak_mb'], regressions=[])
+        row['time_ratio'] = r['time'] / b['time'] if b['time'] > 0 else np.inf
+        row['peak_ratio'] = r['peak_mb'] / b['peak_mb'] if b['peak_mb'] > 0 else np.inf
+        if row['time_ratio'] > 1 + threshold and r['time'] - b['time'] > min_time:
+            row['regressions'].append('time')
+        if row['peak_ratio'] > 1 + threshold and r['peak_mb'] - b['peak_mb'] > min_mb:
+            row['regressions'].append('memory')
+        rows.append(row)
+
+    return rows
+
+
+def print_result(result):
+    """ helper function to print a benchmark result"""
+    print('{:>4} {:>8} {:<24} {:10.4f} s {:10.1f} MB {:12.0f} frames/s'.format(
+        result['version'], result['frames'], result['stage'], result['time'], result['peak_mb'],
+        result['frames'] / result['time'] if result['time'] > 0 else np.inf)
+          + ('  {:.2f}x on {} cpus'.format(result['speedup'], result['cpus']) if 'speedup' in result else ''))
+
+
+def print_comparison(rows, base, new):
+    """ helper function to print the comparison of two benchmark results"""
+    print('comparing {} ({}) to {} ({})'.format(new['meta']['commit'], new['meta']['date'],
+                                                base['meta']['commit'], base['meta']['date']))
+    for row in rows:
+        flag = ' <-- ' + ', '.join(row['regressions']) if row['regressions'] else ''
+        print('{:>4} {:>8} {:<24} {:10.4f} s ({:5.2f}x) {:10.1f} MB ({:5.2f}x){}'.format(
+            row['version'], row['frames'], row['stage'], row['time'], row['time_ratio'], row['peak_mb'],
+            row['peak_ratio'], flag))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='openOFM benchmark of each pipeline stage at several trial lengths',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark and save the results',
+                                       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    run_parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
+    run_parser.add_argument('--lengths', type=int, nargs='*', default=DEFAULT_LENGTHS, help='trial lengths (frames)')
+    run_parser.add_argument('--versions', nargs='*', default=['1.0', '1.1'], help='Versions of openOFM to run')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs of each stage, the fastest is kept')
+    run_parser.add_argument('--nexus_latency', type=float, default=0.0,
+                            help='time (s) added to every call to the fake Nexus of the Nexus stages')
+    run_parser.add_argument('--no_startup', action='store_true', help='skip the import time of the entry points')
+    run_parser.add_argument('--out', default=None, help='json file of the results (default: benchmark_<commit>.json)')
+
+    compare_parser = subparsers.add_parser('compare', help='compare results to a baseline',
+                                           formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    compare_parser.add_argument('base', help='json file of the baseline results')
+    compare_parser.add_argument('new', help='json file of the new results')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='relative increase flagged')
+    compare_parser.add_argument('--min_time', type=float, default=0.001, help='smallest increase in time (s) flagged')
+    compare_parser.add_argument('--min_mb', type=float, default=1.0, help='smallest increase in memory (MB) flagged')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmark(args.data_dir, args.lengths, tuple(args.versions), args.repeat,
+                                nexus_latency=args.nexus_latency, startup=not args.no_startup)
+        out = args.out or 'benchmark_{}.json'.format(results['meta']['commit'])
+        save_benchmark(results, out)
+        print('Saved benchmark to {}'.format(out))
+    else:
+        base_results, new_results = load_benchmark(args.base), load_benchmark(args.new)
+        comparison = compare_benchmarks(base_results, new_results, args.threshold, args.min_time, args.min_mb)
+        print_comparison(comparison, base_results, new_results)
+        n_regressions = sum(1 for row in comparison if row['regressions'])
+        print('{} regressions in {} stages'.format(n_regressions, len(comparison)))
+        sys.exit(1 if n_regressions else 0)
@@ -0,0 +1,179 @@
+import os
+import numpy as np
+
+from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG
+from OFM.virtual_markers import animate_virtual_markers
+from OFM.segments import segments
+from OFM.kinematics import kinematics
+from linear_algebra.linear_algebra import init_running_stats
+from utils.utils import (get_data, get_python_settings, getDir, find_repo_root, init_direction, stream_markers,
+                         stream_angles, MIN_TRAVEL, PELVIS_MARKERS)
+from utils.utils_c3d import c3d_memmap, c3d_to_dict_mmap
+from utils.utils_export import init_export, write_export, close_export, export_path, trial_metadata, EXPORT_FORMATS
+
+TRIAL_TYPE = 'dynamic'
+
+# approximate peak memory of the dynamic pipeline per frame (markers, virtual markers, segment axes and angles)
+BYTES_PER_FRAME = 4096
+
+DEFAULT_MEMORY_MB = 256
+
+
+def openOFM_chunked(settings):
+    """ process a (long) dynamic trial in fixed-size windows of frames under a memory budget
+
+    Arguments:
+        settings    ... dict, settings as for openOFM_dynamic with optional keys
+                        memory_mb  ... float, memory budget of the pipeline in MB (default DEFAULT_MEMORY_MB)
+                        chunk_size ... int, frames per window. If given, memory_mb is ignored
+                        channels   ... list, channels to save (default: the angles of stream_angles)
+                        out_dir    ... str, folder of the results (default: <file_name>_openOFM next to the trial)
+                        export     ... str, 'hdf5' or 'parquet'. If given, channels are written to a single
+                                       <file_name>_openOFM.h5 or .parquet file instead (see utils_export)
+    Returns:
+        results     ... dict, channels as keys and read-only memory-mapped .npy files (n x 3) as values, or str,
+                        full path to the exported file (with export)
+
+    Notes:
+        - a first pass over the trial accumulates the whole-trial statistics (replace4 cluster averages, PiG
+        femur and tibia rotations and the direction of motion, see init_running_stats). Only the markers and
+        steps needed for these statistics are processed
+        - the second pass runs the full pipeline window by window with the statistics frozen, and writes the
+        requested channels of each window to disk, so that intermediates (TIB0..3, HDF0..3, ...) are never held
+        for more than a window
+        - results match openOFM_dynamic, except that frames with gaps are left out of the averages instead of
+        turning them into NaN
+    """
+    version = settings['version']
+
+    # calibration and subject parameters without loading any marker
+    data, settings = get_data(dict(settings, markers=[], mmap=True))
+    parameters = data['parameters']
+
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    fl = os.path.join(root_dir, settings['data_dir'], settings['file_name'])
+    n_frames = c3d_memmap(fl)[3]['frames']
+
+    chunk_size = settings.get('chunk_size')
+    if chunk_size is None:
+        chunk_size = int(settings.get('memory_mb', DEFAULT_MEMORY_MB) * 1024 * 1024 // BYTES_PER_FRAME)
+    chunk_size = max(int(chunk_size), 1)
+    windows = [(i, min(i + chunk_size, n_frames)) for i in range(0, n_frames, chunk_size)]
+
+    markers = stream_markers(version) + [mrk for mrk in PELVIS_MARKERS if mrk not in stream_markers(version)]
+
+    def load(window):
+        chunk = c3d_to_dict_mmap(fl, markers=markers, frames=window)
+        chunk['parameters'] = parameters
+        return chunk
+
+    # 1: first pass, whole-trial statistics
+    stats = init_direction(init_running_stats(), settings)
+    shank_rotation = version == '1.0' and any(parameters['PROCESSING'][side + 'ShankRotation']['value'] != 0
+                                              for side in ['R', 'L'])
+    thigh_rotation = version == '1.0' and any(parameters['PROCESSING'][side + 'ThighRotation']['value'] != 0
+                                              for side in ['R', 'L'])
+    for window in windows:
+        chunk = load(window)
+        if version == '1.0':
+            chunk = hipjointcentrePiG_data(chunk)
+            chunk = kneejointcenterPiG(chunk, stats)
+            if not (shank_rotation and thigh_rotation):
+                chunk = anklejointcenterPiG(chunk, stats)
+        chunk = animate_virtual_markers(chunk, settings, stats)
+        getDir(chunk, stats=stats)
+    stats['update'] = False
+
+    # tibia rotation depends on the knee joint centre, and therefore on the final femur rotation
+    if shank_rotation and thigh_rotation:
+        tibia_stats = init_running_stats()
+        for window in windows:
+            chunk = hipjointcentrePiG_data(load(window))
+            chunk = kneejointcenterPiG(chunk, stats)
+            anklejointcenterPiG(chunk, tibia_stats)
+        stats['sum'].update(tibia_stats['sum'])
+        stats['n'].update(tibia_stats['n'])
+
+    # 2: second pass, full pipeline window by window
+    channels = settings.get('channels', stream_angles())
+    export = None
+    if settings.get('export'):
+        export = init_export(export_path(settings), settings['export'], metadata=trial_metadata(data, settings),
+                             parameters=parameters)
+    else:
+        out_dir = settings.get('out_dir')
+        if out_dir is None:
+            out_dir = os.path.splitext(fl)[0] + '_openOFM'
+        os.makedirs(out_dir, exist_ok=True)
+
+    outputs = {}
+    for start, stop in windows:
+        chunk = load((start, stop))
+        if version == '1.0':
+            chunk = hipjointcentrePiG_data(chunk)
+            chunk = kneejointcenterPiG(chunk, stats)
+            chunk = anklejointcenterPiG(chunk, stats)
+        chunk = animate_virtual_markers(chunk, settings, stats)
+        chunk, r, jnt = segments(chunk, version)
+        chunk = kinematics(chunk, r, jnt, version, stats)
+
+        if export is not None:
+            write_export(export, dict(chunk, **{ch: get_channel(chunk, ch) for ch in channels}), channels)
+            continue
+        for ch in channels:
+            value = get_channel(chunk, ch)
+            if ch not in outputs:
+                outputs[ch] = np.lib.format.open_memmap(os.path.join(out_dir, ch + '.npy'), mode='w+',
+                                                        dtype=float, shape=(n_frames,) + value.shape[1:])
+            outputs[ch][start:stop] = value
+
+    if export is not None:
+        close_export(export)
+        return export['fl']
+
+    results = {}
+    for ch, out in outputs.items():
+        out.flush()
+        results[ch] = np.load(out.filename, mmap_mode='r')
+    print('Saved {} channels of {} frames to {}'.format(len(results), n_frames, out_dir))
+
+    return results
+
+
+def get_channel(data, ch):
+    """ helper function to extract channel ch from data, angles are returned as n x 3 arrays"""
+    if ch in data:
+        return data[ch]
+    return np.column_stack([data[ch + '_x'], data[ch + '_y'], data[ch + '_z']])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='openOFM dynamic trial processing in windows of frames (for long trials)',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
+    parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
+    parser.add_argument('--file_name', default='dynamic.c3d', help='name of dynamic trial to process')
+    parser.add_argument('--static_name', default='static.c3d',
+                        help='name of the static trial, whose facing direction is the direction of motion when the '
+                             'pelvis travels less than {} mm (e.g. on a treadmill)'.format(MIN_TRAVEL))
+    parser.add_argument('--direction', default=None, choices={'Ipos', 'Ineg', 'Jpos', 'Jneg'},
+                        help='direction of motion, estimated from the pelvis markers if not given')
+    parser.add_argument('--use_settings', action="store_true",
+                        help='If true, looks for settings.yml in the subject folder. '
+                             'If false, looks for settings in .c3d file')
+    parser.add_argument('--memory_mb', type=float, default=DEFAULT_MEMORY_MB, help='memory budget in MB')
+    parser.add_argument('--chunk_size', type=int, default=None, help='frames per window (overrides memory_mb)')
+    parser.add_argument('--channels', nargs='*', default=stream_angles(), help='channels to save')
+    parser.add_argument('--out_dir', default=None, help='folder of the results')
+    parser.add_argument('--export', choices=list(EXPORT_FORMATS), default=None,
+                        help='writes the channels to <file_name>_openOFM.h5 (hdf5) or .parquet (parquet) instead')
+    args = vars(parser.parse_args())
+    settings_params = dict(args, trial_type=TRIAL_TYPE, nexus=False)
+    if settings_params['use_settings']:
+        settings_params.update(get_python_settings(args))
+
+    openOFM_chunked(settings=settings_params)
@@ -2,41 +2,102 @@ from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenter
 from OFM.virtual_markers import animate_virtual_markers
 from OFM.segments import segments
 from OFM.kinematics import kinematics
-from utils.utils import get_data, get_python_settings, is_nexus, make_plot_title
-from plotting.plotting import plot_angles
+from linear_algebra.linear_algebra import init_running_stats
+from utils.utils import (get_data, get_python_settings, is_nexus, make_plot_title, set_precision, getDir,
+                         init_direction, MIN_TRAVEL, PRECISIONS)
+from utils.utils_gaps import fill_gaps, GAP_METHODS
+from utils.utils_filter import filter_markers, cutoff_type
+from utils.utils_gait import gait_events, save_cycles, cycles_path
+from utils.utils_export import export_trial, export_path, trial_metadata, EXPORT_FORMATS
+from utils.utils_profile import init_profile, profile_stage, set_frames, save_profile, profile_path
+from plotting.plotting_report import render_report, report_path, REPORT_FORMATS
 
 TRIAL_TYPE = 'dynamic'
 
 
 def openOFM_dynamic(settings):
+    profile = init_profile(settings)
+
     # 1: Access static calibration file
-    if settings['nexus']:
-        data, settings = get_nexus_data(settings)
-    else:
-        data, settings = get_data(settings)
+    with profile_stage(profile, 'load'):
+        if settings['nexus']:
+            from utils.utils_nexus import get_nexus_data
+            data, settings = get_nexus_data(settings)
+        else:
+            data, settings = get_data(settings)
+    set_frames(profile, len(data['RHEE']))
+
+    # fill gaps of marker trajectories
+    if settings.get('gap_fill'):
+        with profile_stage(profile, 'gap_fill'):
+            data = fill_gaps(data, settings['gap_fill'], max_gap=settings.get('max_gap'))
+
+    # low-pass filter marker trajectories
+    if settings.get('filter'):
+        with profile_stage(profile, 'filter'):
+            data = filter_markers(data, settings['filter'])
+
+    # direction of motion from the pelvis travel, or the direction faced in the static trial on a treadmill
+    stats = init_direction(init_running_stats(), settings)
+
+    # detect gait events from the heel and toe markers, before markers are corrected (see replace4)
+    cycles = settings.get('cycles') and not settings['nexus']
+    if cycles:
+        with profile_stage(profile, 'events'):
+            stats['direction'] = getDir(data, stats=stats)
+            events = gait_events(data, direction=stats['direction'])
+
+    # compute joint centres, virtual markers, segments and angles in float32 (or float64)
+    if settings.get('precision'):
+        data = set_precision(data, settings['precision'])
 
     if settings['version'] == '1.0':
         # % compute hip, knee and ankle joint center
-        data = hipjointcentrePiG_data(data)
-        data = kneejointcenterPiG(data)
-        data = anklejointcenterPiG(data)
+        with profile_stage(profile, 'joint_centres'):
+            data = hipjointcentrePiG_data(data)
+            data = kneejointcenterPiG(data)
+            data = anklejointcenterPiG(data)
 
     # 2: Create dynamic version of virtual markers present in static trial + compute phi and omega
-    data = animate_virtual_markers(data, settings)
+    with profile_stage(profile, 'virtual_markers'):
+        data = animate_virtual_markers(data, settings)
 
     # 3: Create virtual segment embedded axes
-    data, r, jnt = segments(data, settings['version'])
+    with profile_stage(profile, 'segments'):
+        data, r, jnt = segments(data, settings['version'])
 
     # 4: Compute joint angles according to Grood and Suntay method
-    data = kinematics(data, r, jnt, settings['version'])
+    with profile_stage(profile, 'kinematics'):
+        data = kinematics(data, r, jnt, settings['version'], stats)
+
+    # cut angles into gait cycles normalised to 101 points
+    if cycles:
+        with profile_stage(profile, 'cycles'):
+            save_cycles(data, events, cycles_path(settings))
+
+    # write results to a chunked columnar file
+    if settings.get('export') and not settings['nexus']:
+        with profile_stage(profile, 'export'):
+            export_trial(data, export_path(settings), settings['export'], metadata=trial_metadata(data, settings))
 
     if settings['nexus']:
-        set_nexus_data(data, TRIAL_TYPE)
+        with profile_stage(profile, 'save'):
+            from utils.utils_nexus import set_nexus_data
+            set_nexus_data(data, TRIAL_TYPE, settings.get('nexus_session'))
 
     # 5: Plot results
-    if settings['make_plot']:
-        plot_title = make_plot_title(settings)
-        plot_angles(data=data, plot_title=plot_title)
+    if settings.get('report') and not settings['nexus']:
+        with profile_stage(profile, 'report'):
+            render_report(data, report_path(settings), title=make_plot_title(settings))
+
+    if settings.get('make_plot'):
+        with profile_stage(profile, 'plot'):
+            from plotting.plotting import plot_angles
+            plot_title = make_plot_title(settings)
+            plot_angles(data=data, plot_title=plot_title)
+
+    if profile is not None:
+        save_profile(profile, None if settings['nexus'] else profile_path(settings))
 
     return data
 
@@ -51,7 +112,6 @@ if __name__ == "__main__":
 
     if nexus:
         import sys
-        from utils.utils_nexus import set_nexus_data, get_nexus_data
 
         settings_params['nexus'] = nexus
         settings_params['version'] = sys.argv[1]
@@ -66,15 +126,45 @@ if __name__ == "__main__":
         parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
         parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
         parser.add_argument('--file_name', default='dynamic.c3d', help='name of dynamic trial to process')
+        parser.add_argument('--static_name', default='static.c3d',
+                            help='name of the static trial, whose facing direction is the direction of motion when '
+                                 'the pelvis travels less than {} mm (e.g. on a treadmill)'.format(MIN_TRAVEL))
+        parser.add_argument('--direction', default=None, choices={'Ipos', 'Ineg', 'Jpos', 'Jneg'},
+                            help='direction of motion, estimated from the pelvis markers if not given')
         parser.add_argument('--use_settings', action="store_true",
                             help='If true, looks for settings.yml in the subject folder. '
                                  'If false, looks for settings in .c3d file')
         parser.add_argument('--make_plot', action="store_true",
                             help='If true, makes a plot showing kinematic results. '
                                  'If false, no plot is made')
+        parser.add_argument('--profile', action="store_true",
+                            help='If true, saves the time used by each step to <file_name>_profile.json')
+        parser.add_argument('--profile_memory', action="store_true",
+                            help='If true, also saves the peak memory of each step, with tracemalloc slowing down '
+                                 'every step')
+        parser.add_argument('--gap_fill', nargs='+', choices=GAP_METHODS, default=None,
+                            help='gap filling methods applied to the markers before processing, e.g. rigid spline')
+        parser.add_argument('--max_gap', type=int, default=None, help='longest gap (frames) to fill')
+        parser.add_argument('--filter', type=cutoff_type, default=None,
+                            help='cutoff frequency (Hz) of the low-pass filter of the markers, or auto to find the '
+                                 'cutoff of each marker by residual analysis')
+        parser.add_argument('--cycles', action="store_true",
+                            help='If true, detects gait events and saves the angles of each gait cycle, normalised '
+                                 'to 101 points, to <file_name>_cycles.npz')
+        parser.add_argument('--report', choices=REPORT_FORMATS, default=None,
+                            help='saves a plot of the angles to <file_name>_report.png (or .pdf, .svg) without '
+                                 'opening a window')
+        parser.add_argument('--export', choices=list(EXPORT_FORMATS), default=None,
+                            help='exports angles, virtual markers, segments and parameters to '
+                                 '<file_name>_openOFM.h5 (hdf5) or <file_name>_openOFM.parquet (parquet)')
+        parser.add_argument('--precision', choices=list(PRECISIONS), default=None,
+                            help='floating point type of the computations (default: float64), float32 halves the '
+                                 'memory of long trials, see openOFM_validate.py --precision for its accuracy')
         args = vars(parser.parse_args())
         settings_params.update(args)
         settings_params['nexus'] = nexus
+        if settings_params['profile_memory']:
+            settings_params['profile'] = 'memory'
         if settings_params['use_settings']:
             settings_params.update(get_python_settings(args))
 
@@ -0,0 +1,273 @@
+import os
+from functools import partial
+import numpy as np
+
+from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG, prep_bones
+from OFM.virtual_markers import animate_forefoot, animate_hindfoot, animate_tibia
+from OFM.segments import tibia_segment, hindfoot_segment, forefoot_segment, hallux_segment
+from OFM.kinematics import grood_suntay, grood_suntay_1_0, refsystem
+from linear_algebra.linear_algebra import init_running_stats
+from utils.utils import get_data, get_python_settings, find_repo_root, init_direction, ANGLE_JOINTS
+from utils.utils_c3d import c3d_memmap
+
+TRIAL_TYPE = 'dynamic'
+
+SIDES = {'R': 'Right', 'L': 'Left'}
+
+# bones of each segment as (channel prefix, bone name), see getbones_data
+BONES = {'TibiaOFM': 'TIB', 'TibiaLab': 'LabTIB', 'HindFoot': 'HDF', 'ForeFoot': 'FOF', 'Hallux': 'HLX'}
+
+# proximal and distal bones of each joint
+JOINT_BONES = {'AnkleOFM': ('TibiaOFM', 'HindFoot'),
+               'FFTBA': ('TibiaOFM', 'ForeFoot'),
+               'MidFoot': ('HindFoot', 'ForeFoot'),
+               'MTP': ('ForeFoot', 'Hallux'),
+               'TibiaLab': ('Global', 'TibiaLab'),
+               }
+
+# markers used to find the direction of motion, RPCA (a virtual marker) if the trial has no pelvis markers (see
+# getDir)
+DIRECTION_MARKERS = ['RPSI', 'LPSI', 'SACR', 'RPCA']
+
+
+def pipeline_graph(version='1.0'):
+    """ the steps of openOFM_dynamic as a graph of named channels
+
+    Arguments:
+        version     ... str, openOFM version '1.0' or '1.1'
+    Returns:
+        graph       ... list, steps in the order of openOFM_dynamic. Each step is a dict with keys
+                        name    ... str, name of the step
+                        inputs  ... list, channels read by the step (markers or outputs of earlier steps)
+                        outputs ... list, channels written by the step
+                        run     ... callable, run(data, settings) returns data with the outputs appended
+
+    Notes:
+        - steps may overwrite channels (e.g. replace4 corrects P1M), a step reads the channel as written by the
+        last step before it, or the marker of the trial if no earlier step writes it
+    """
+    graph = []
+
+    def add(name, inputs, outputs, run):
+        graph.append(dict(name=name, inputs=inputs, outputs=outputs, run=run))
+
+    # PiG joint centres
+    if version == '1.0':
+        add('HipJC', ['RASI', 'LASI', 'RPSI', 'LPSI', 'SACR'], ['RHipJC', 'LHipJC'],
+            lambda data, settings: hipjointcentrePiG_data(data))
+        for s in SIDES:
+            add(s + 'KneeJC', [s + 'HipJC', s + 'KNE', s + 'THI'], [s + 'KneeJC'],
+                partial(_run_side, kneejointcenterPiG, s))
+        for s in SIDES:
+            add(s + 'AnkleJC', [s + 'KneeJC', s + 'TIB', s + 'ANK'], [s + 'TIR', s + 'AnkleJC'],
+                partial(_run_side, anklejointcenterPiG, s))
+
+    # virtual markers
+    for s in SIDES:
+        add(s + 'ForeFootMarkers', [s + 'D5M', s + 'P5M', s + 'P1M', s + 'TOE'],
+            [s + 'D1M0', s + 'D5M0', s + 'P1M', s + 'P5M', s + 'TOE', s + 'D1Mlat', s + 'P1Mlat', s + 'D5Mlat',
+             s + 'ArchHeight'],
+            partial(_run_virtual_markers, animate_forefoot, s))
+        add(s + 'HindFootMarkers', [s + 'STL', s + 'LCA', s + 'CPG', s + 'HEE'],
+            [s + 'PCA', s + 'HFPlantar', s + 'HEE'],
+            partial(_run_virtual_markers, animate_hindfoot, s))
+        add(s + 'TibiaMarkers', [s + 'ANK', s + 'HFB', s + 'SHN', s + 'TUB'],
+            [s + 'MMA', s + 'ANK', s + 'TUB', s + 'HFB'],
+            partial(_run_virtual_markers, animate_tibia, s))
+
+    # segments
+    for s in SIDES:
+        inputs = [s + 'ANK', s + 'MMA', s + 'TUB', s + 'HFB']
+        if version == '1.0':
+            inputs += [s + 'KneeJC', s + 'AnkleJC', s + 'TIR']
+        add(s + 'TibiaOFM', inputs, _bone(s, 'TIB') + _bone(s, 'LabTIB'),
+            partial(_run_segment, tibia_segment, s))
+        add(s + 'HindFoot', [s + 'PCA', s + 'HEE', s + 'HFPlantar'], _bone(s, 'HDF'),
+            partial(_run_segment, hindfoot_segment, s))
+        add(s + 'ForeFoot', [s + 'P1M', s + 'P5M', s + 'D1M0', s + 'D5M0', s + 'TOE', s + 'P1Mlat', s + 'D1Mlat',
+                             s + 'D5Mlat'],
+            _bone(s, 'FOF') + [s + 'ArchHeightIndex', s + 'ArchHeight_openOFM'],
+            partial(_run_segment, forefoot_segment, s))
+        inputs = [s + 'HLX', s + 'D1M0'] + ([s + 'D5M0'] if version == '1.0' else [s + 'FOF0', s + 'FOF3'])
+        add(s + 'Hallux', inputs, _bone(s, 'HLX'), partial(_run_segment, hallux_segment, s))
+
+    # joint angles
+    for s, side in SIDES.items():
+        for angle, (joint, _) in ANGLE_JOINTS.items():
+            inputs = []
+            for bone in JOINT_BONES[joint]:
+                if bone != 'Global':
+                    inputs += _bone(s, BONES[bone])
+            if joint == 'TibiaLab':
+                inputs += DIRECTION_MARKERS
+            add(side + angle, inputs, [side + angle + axis for axis in ['_x', '_y', '_z']],
+                partial(_run_joint, side, joint))
+
+    return graph
+
+
+def plan_graph(graph, outputs, labels):
+    """ find the steps of graph needed to compute outputs
+
+    Arguments:
+        graph       ... list, steps (see pipeline_graph)
+        outputs     ... list, channels to compute. OFM angles may be given without component (e.g. 'RightFFHFA'
+                        for 'RightFFHFA_x', '_y' and '_z')
+        labels      ... list, markers of the trial (see c3d_memmap)
+    Returns:
+        steps       ... list, steps to run, in order
+        markers     ... list, markers of the trial read by the steps
+        outputs     ... list, channels to compute, angles expanded to their components
+        last_use    ... dict, channels as keys and the index in steps of the last step reading them as values
+
+    Notes:
+        - channels not written by any step are expected to be markers of the trial. Requested outputs that are
+        neither written by a step nor markers of the trial (e.g. typos) raise a ValueError
+    """
+    angles = [side + angle for side in SIDES.values() for angle in ANGLE_JOINTS]
+    expanded = []
+    for ch in outputs:
+        expanded += [ch + axis for axis in ['_x', '_y', '_z']] if ch in angles else [ch]
+
+    written = set(ch for step in graph for ch in step['outputs'])
+    unknown = [ch for ch in expanded if ch not in written and ch not in labels]
+    if unknown:
+        raise ValueError('outputs {} are neither computed by openOFM nor markers of the trial'.format(unknown))
+
+    # walk the steps backwards, a step is needed if it writes a channel needed by a later step
+    needed = set(expanded)
+    steps = []
+    for step in reversed(graph):
+        written = needed.intersection(step['outputs'])
+        if written:
+            steps.insert(0, step)
+            needed -= written
+            needed.update(step['inputs'])
+    markers = sorted(needed)
+
+    last_use = {}
+    for i, step in enumerate(steps):
+        for ch in step['inputs']:
+            last_use[ch] = i
+
+    return steps, markers, expanded, last_use
+
+
+def run_graph(data, settings, steps, outputs, last_use):
+    """ run the steps of a plan (see plan_graph) on data
+
+    Notes:
+        - markers and intermediate channels are removed from data once no later step reads them, unless they
+        are requested outputs, so that only the channels still needed are kept in memory
+    """
+    keep = set(outputs)
+    for i, step in enumerate(steps):
+        data = step['run'](data, settings)
+        for ch in step['inputs'] + step['outputs']:
+            if ch in data and ch not in keep and last_use.get(ch, -1) <= i:
+                del data[ch]
+
+    return data
+
+
+def openOFM_outputs(settings, outputs):
+    """ process a dynamic trial, computing only the steps needed for outputs
+
+    Arguments:
+        settings    ... dict, settings as for openOFM_dynamic
+        outputs     ... list, channels to compute (e.g. ['RightFFHFA'], or every angle of the left side), see
+                        plan_graph
+    Returns:
+        data        ... dict, requested outputs (and the parameters of the trial)
+
+    Notes:
+        - only the markers read by the needed steps are loaded
+        - results are identical to openOFM_dynamic, as whole-trial averages (replace4, PiG wand rotations) do not
+        depend on other outputs
+    """
+    steps, markers, outputs, last_use = plan_graph(pipeline_graph(settings['version']), outputs,
+                                                   trial_labels(settings))
+    data, settings = get_data(dict(settings, markers=markers))
+    data = run_graph(data, settings, steps, outputs, last_use)
+
+    return data
+
+
+def trial_labels(settings):
+    """ helper function to read the marker names of the trial settings['file_name'] without reading its frames"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    return c3d_memmap(os.path.join(root_dir, settings['data_dir'], settings['file_name']))[1]
+
+
+def _bone(side, prefix):
+    """ helper function to list the channels of a bone"""
+    return [side + prefix + i for i in ['0', '1', '2', '3']]
+
+
+def _run_side(fn, side, data, settings):
+    """ helper function to run a PiG joint centre step for one side"""
+    return fn(data, sides=[side])
+
+
+def _run_virtual_markers(fn, side, data, settings):
+    """ helper function to run a virtual marker step for one side"""
+    return fn(data, side, settings)
+
+
+def _run_segment(fn, side, data, settings):
+    """ helper function to run a segment step for one side"""
+    return fn(data, side, settings['version'])
+
+
+def _run_joint(side, joint, data, settings):
+    """ helper function to compute the angles of a joint"""
+    proximal, distal = JOINT_BONES[joint]
+    bone = []
+    for name in [proximal, distal]:
+        if name == 'Global':
+            bone.append(['GLB', 'Global'])
+        else:
+            bone.append([side[0] + BONES[name], side + name])
+    r = prep_bones(data, bone)
+    jnt = [[side + joint, side + proximal if proximal != 'Global' else 'Global', side + distal]]
+
+    if settings['version'] == '1.0':
+        KIN = grood_suntay_1_0(r, jnt)
+    else:
+        KIN = grood_suntay(r, jnt)
+    stats = init_direction(init_running_stats(), settings) if joint == 'TibiaLab' else None
+    data, _ = refsystem(data, KIN, settings['version'], stats)
+
+    return data
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='openOFM dynamic trial processing of selected outputs only',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
+    parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
+    parser.add_argument('--file_name', default='dynamic.c3d', help='name of dynamic trial to process')
+    parser.add_argument('--use_settings', action="store_true",
+                        help='If true, looks for settings.yml in the subject folder. '
+                             'If false, looks for settings in .c3d file')
+    parser.add_argument('--outputs', nargs='*', default=['RightFFHFA'], help='channels to compute')
+    parser.add_argument('--plan', action="store_true", help='If true, only prints the steps needed')
+    args = vars(parser.parse_args())
+    settings_params = dict(args, trial_type=TRIAL_TYPE, nexus=False)
+    if settings_params['use_settings']:
+        settings_params.update(get_python_settings(args))
+
+    if args['plan']:
+        steps, markers, _, _ = plan_graph(pipeline_graph(args['version']), args['outputs'],
+                                          trial_labels(settings_params))
+        print('markers: ' + ', '.join(markers))
+        print('steps:   ' + ', '.join(step['name'] for step in steps))
+    else:
+        data = openOFM_outputs(settings_params, args['outputs'])
+        for ch, value in data.items():
+            if isinstance(value, np.ndarray):
+                print(ch, value.shape)
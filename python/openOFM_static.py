@@ -1,25 +1,43 @@
 from OFM.virtual_markers import create_virtual_markers
-from utils.utils import is_nexus, get_python_settings
+from utils.utils import is_nexus, get_python_settings, set_precision, PRECISIONS
 from utils.utils import get_data, set_data
+from utils.utils_profile import init_profile, profile_stage, set_frames, save_profile, profile_path
 
 TRIAL_TYPE = 'static'
 
 
 def openOFM_static(settings):
+    profile = init_profile(settings)
 
     # 1: Access static calibration file
-    if settings['nexus']:
-        sdata, settings = get_nexus_data(settings)
-    else:
-        sdata, _ = get_data(settings)
+    with profile_stage(profile, 'load'):
+        if settings['nexus']:
+            from utils.utils_nexus import get_nexus_data
+            sdata, settings = get_nexus_data(settings)
+        else:
+            sdata, _ = get_data(settings)
+    set_frames(profile, len(sdata['RHEE']))
+
+    # compute in float32 (or float64), the calibration is saved in float64
+    if settings.get('precision'):
+        sdata = set_precision(sdata, settings['precision'])
 
     # 2: Create dynamic version of virtual markers present in static trial + compute phi and omega
-    sdata = create_virtual_markers(sdata, settings)
+    with profile_stage(profile, 'virtual_markers'):
+        sdata = create_virtual_markers(sdata, settings)
 
-    if settings['nexus']:
-        set_nexus_data(sdata, TRIAL_TYPE)
-    else:
-        set_data(sdata, settings)
+    if settings.get('precision'):
+        sdata = set_precision(sdata, 'float64')
+
+    with profile_stage(profile, 'save'):
+        if settings['nexus']:
+            from utils.utils_nexus import set_nexus_data
+            set_nexus_data(sdata, TRIAL_TYPE, settings.get('nexus_session'))
+        else:
+            set_data(sdata, settings)
+
+    if profile is not None:
+        save_profile(profile, None if settings['nexus'] else profile_path(settings))
 
     return sdata
 
@@ -34,7 +52,6 @@ if __name__ == "__main__":
 
     if nexus:
         import sys
-        from utils.utils_nexus import set_nexus_data, get_nexus_data
         settings_params['nexus'] = nexus
         settings_params['version'] = sys.argv[1]
     else:
@@ -50,9 +67,18 @@ if __name__ == "__main__":
         parser.add_argument('--use_settings', action="store_true",
                             help='If true, looks for settings.yml in the subject folder. '
                                  'If false, looks for settings in .c3d file')
+        parser.add_argument('--profile', action="store_true",
+                            help='If true, saves the time used by each step to <file_name>_profile.json')
+        parser.add_argument('--profile_memory', action="store_true",
+                            help='If true, also saves the peak memory of each step, with tracemalloc slowing down '
+                                 'every step')
+        parser.add_argument('--precision', choices=list(PRECISIONS), default=None,
+                            help='floating point type of the computations (default: float64)')
         args = vars(parser.parse_args())
         settings_params.update(args)
         settings_params['nexus'] = nexus
+        if settings_params['profile_memory']:
+            settings_params['profile'] = 'memory'
         if settings_params['use_settings']:
             settings_params.update(get_python_settings(args))
 
@@ -0,0 +1,170 @@
+import time
+import numpy as np
+
+from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG
+from OFM.virtual_markers import create_virtual_markers, animate_virtual_markers
+from OFM.segments import segments
+from OFM.kinematics import kinematics
+from linear_algebra.linear_algebra import init_running_stats
+from utils.utils import (get_data, get_python_settings, set_subject_params, get_calibration, init_direction,
+                         stream_markers, stream_angles)
+
+
+def init_stream(settings, sdata=None):
+    """ prepare the frame-by-frame processing of a dynamic trial from the static calibration
+
+    Arguments:
+        settings    ... dict, settings as for openOFM_dynamic (version, data_dir, use_settings, ...) and
+                        static_name (name of the static trial). Optional key 'direction' ('Ipos', 'Ineg', 'Jpos'
+                        or 'Jneg') fixes the direction of motion, optional key 'min_travel' sets the distance (mm)
+                        travelled before the direction is estimated from the stream (see init_direction)
+        sdata       ... dict, Default = None. Static trial processed by create_virtual_markers. If None, the
+                        static trial in settings['data_dir'] is loaded and processed
+    Returns:
+        stream      ... dict, state of the stream to pass to process_frames
+
+    Notes:
+        - the static calibration is kept in memory, parameters.txt is neither read nor written
+    """
+    settings = dict(settings)
+    if sdata is None:
+        static_settings = dict(settings, trial_type='static', file_name=settings['static_name'])
+        sdata, static_settings = get_data(static_settings)
+        sdata = create_virtual_markers(sdata, static_settings)
+        settings['processing'] = static_settings['processing']
+
+    parameters = get_calibration(sdata)
+    if settings.get('use_settings', False):
+        parameters = set_subject_params({'parameters': parameters}, settings)['parameters']
+
+    # until the subject has travelled min_travel, the direction of motion is the direction the subject faced in
+    # the static trial, which is also the direction of motion on a treadmill
+    stats = init_direction(init_running_stats(), settings, sdata)
+
+    stream = dict(settings=settings, parameters=parameters, stats=stats, frames=0,
+                  latency={'last': 0.0, 'max': 0.0, 'total': 0.0, 'blocks': 0})
+
+    return stream
+
+
+def process_frames(stream, frames):
+    """ compute OFM angles for a block of frames
+
+    Arguments:
+        stream      ... dict, state of the stream (see init_stream), updated in place
+        frames      ... dict, markers as keys (see stream_markers) and n x 3 arrays (or 3 element arrays for a
+                        single frame) as values
+    Returns:
+        angles      ... dict, angle channels as keys (see stream_angles) and n x 3 arrays as values
+
+    Notes:
+        - the whole-trial averages of the batch code (replace4 clusters, PiG femur and tibia rotations) are
+        replaced by running averages over all frames received so far, the direction of motion by comparing the
+        first frame received to the last once the subject has travelled far enough (see init_stream and getDir)
+        - the cost of a block only depends on its size, not on the number of frames already processed
+    """
+    t0 = time.perf_counter()
+    settings = stream['settings']
+    version = settings['version']
+    stats = stream['stats']
+
+    data = {mrk: np.reshape(np.asarray(value, dtype=float), (-1, 3)) for mrk, value in frames.items()}
+    data['parameters'] = stream['parameters']
+
+    if version == '1.0':
+        # the pelvis is tracked either by RPSI and LPSI or by SACR
+        if 'SACR' in data and np.isnan(data.get('RPSI', np.nan)).all():
+            data.pop('RPSI', None)
+            data.pop('LPSI', None)
+        data = hipjointcentrePiG_data(data)
+        data = kneejointcenterPiG(data, stats)
+        data = anklejointcenterPiG(data, stats)
+    data = animate_virtual_markers(data, settings, stats)
+    data, r, jnt = segments(data, version)
+    data = kinematics(data, r, jnt, version, stats)
+
+    angles = {}
+    for ch in stream_angles():
+        angles[ch] = np.column_stack((data[ch + '_x'], data[ch + '_y'], data[ch + '_z']))
+
+    latency = time.perf_counter() - t0
+    stream['frames'] += len(angles[ch])
+    stream['latency']['last'] = latency
+    stream['latency']['max'] = max(stream['latency']['max'], latency)
+    stream['latency']['total'] += latency
+    stream['latency']['blocks'] += 1
+
+    return angles
+
+
+def run_stream(stream, source, sink=None, verbose=False):
+    """ process every block of frames of source
+
+    Arguments:
+        stream      ... dict, state of the stream (see init_stream)
+        source      ... iterable, yields blocks of frames (see utils_stream.udp_source and c3d_source)
+        sink        ... callable, Default = None. Called with the angles of each block (see utils_stream.udp_sink)
+        verbose     ... bool, Default = False. If true, prints the angles of the last frame of each block
+    Returns:
+        stream      ... dict, final state of the stream
+    """
+    for frames in source:
+        angles = process_frames(stream, frames)
+        if sink is not None:
+            sink(angles)
+        if verbose:
+            print('frame {:6d} ({:5.1f} ms): RHFTBA {} LHFTBA {}'.format(
+                stream['frames'], stream['latency']['last'] * 1000,
+                np.round(angles['RightHFTBA'][-1], 1), np.round(angles['LeftHFTBA'][-1], 1)))
+
+    return stream
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    from utils.utils import find_repo_root
+    from utils.utils_stream import STREAM_HOST, STREAM_PORT, udp_source, udp_sink, c3d_source
+
+    parser = argparse.ArgumentParser(
+        description='openOFM real-time processing of a marker stream',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
+    parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
+    parser.add_argument('--static_name', default='static.c3d', help='name of static trial used for calibration')
+    parser.add_argument('--use_settings', action="store_true",
+                        help='If true, looks for settings.yml in the subject folder. '
+                             'If false, looks for settings in .c3d file')
+    parser.add_argument('--source', default='udp',
+                        help='"udp" to listen to a marker stream or name of a dynamic trial to replay')
+    parser.add_argument('--host', default=STREAM_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=STREAM_PORT, help='port to listen on')
+    parser.add_argument('--send_to', default=None, help='host:port to send the angles to')
+    parser.add_argument('--block', type=int, default=1, help='frames per block when replaying a trial')
+    parser.add_argument('--rate', type=float, default=None, help='frame rate when replaying a trial (Hz)')
+    parser.add_argument('--direction', default=None, choices={'Ipos', 'Ineg', 'Jpos', 'Jneg'},
+                        help='direction of motion, estimated from the stream if not given')
+    args = vars(parser.parse_args())
+    if args['use_settings']:
+        args.update(get_python_settings(args))
+
+    stream = init_stream(args)
+    markers = stream_markers(args['version'])
+
+    if args['source'] == 'udp':
+        print('listening for markers on {}:{}'.format(args['host'], args['port']))
+        source = udp_source(markers, host=args['host'], port=args['port'])
+    else:
+        fl = os.path.join(find_repo_root(os.path.dirname(__file__)), args['data_dir'], args['source'])
+        source = c3d_source(fl, markers, block=args['block'], rate=args['rate'])
+
+    sink = None
+    if args['send_to'] is not None:
+        host, port = args['send_to'].split(':')
+        sink = udp_sink(stream_angles(), host=host, port=int(port))
+
+    stream = run_stream(stream, source, sink=sink, verbose=True)
+    latency = stream['latency']
+    print('processed {} frames, latency per block {:.2f} ms (mean), {:.2f} ms (max)'.format(
+        stream['frames'], latency['total'] / max(latency['blocks'], 1) * 1000, latency['max'] * 1000))
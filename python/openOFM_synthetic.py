@@ -0,0 +1,462 @@
+import os
+import copy
+import numpy as np
+
+from PiG.pig import hipjointcentrePiG_data, kneejointcenterPiG, anklejointcenterPiG
+from OFM.virtual_markers import create_virtual_markers, animate_virtual_markers
+from OFM.segments import segments
+from linear_algebra.linear_algebra import lcs_axes
+from OFM.kinematics import TIBIA_LAB_SIGNS, MIRRORED_ANGLES
+from utils.utils import (c3d_to_dict, find_repo_root, getDirStat, get_processing, get_calibration, stream_angles,
+                         ANGLE_JOINTS, PELVIS_MARKERS)
+from utils.utils_c3d import write_c3d
+
+# markers of each side rigidly attached to each segment, the pelvis markers are attached to the pelvis
+SEGMENT_MARKERS = {'femur': ['THI', 'KNE'],
+                   'tibia': ['TIB', 'ANK', 'MMA', 'HFB', 'TUB', 'SHN'],
+                   'hindfoot': ['HEE', 'HE1', 'PCA', 'STL', 'LCA', 'CPG'],
+                   'forefoot': ['P1M', 'P5M', 'D1M', 'D5M', 'TOE'],
+                   'hallux': ['HLX'],
+                   }
+
+# markers only present in static trials
+STATIC_MARKERS = ['D1M', 'PCA', 'MMA']
+
+# joints as (name, proximal segment, distal segment), in the order of the kinematic chain
+JOINTS = [('Hip', 'pelvis', 'femur'),
+          ('Knee', 'femur', 'tibia'),
+          ('Ankle', 'tibia', 'hindfoot'),
+          ('MidFoot', 'hindfoot', 'forefoot'),
+          ('MTP', 'forefoot', 'hallux'),
+          ]
+
+# amplitude (deg) of the default flexion, abduction and twist curves of each joint
+AMPLITUDES = {'Hip': (25.0, 5.0, 5.0),
+              'Knee': (30.0, 3.0, 5.0),
+              'Ankle': (15.0, 8.0, 5.0),
+              'MidFoot': (6.0, 4.0, 3.0),
+              'MTP': (20.0, 3.0, 2.0),
+              }
+
+# segment each bone of the OFM joints moves with (see PiG.pig.getbones_data), the lab (Global) does not move.
+# The hallux bone is not rigid with the hallux, its axes also depend on the forefoot (see hallux_axes)
+BONE_SEGMENTS = {'Global': None,
+                 'TibiaLab': 'tibia',
+                 'TibiaOFM': 'tibia',
+                 'HindFoot': 'hindfoot',
+                 'ForeFoot': 'forefoot',
+                 }
+
+# landmarks of the OFM segments (markers and virtual markers), used to compute the axes of the bones
+LANDMARKS = {'tibia': ['ANK', 'MMA', 'TUB', 'HFB', 'KneeJC', 'AnkleJC', 'TIR'],
+             'hindfoot': ['PCA', 'HEE', 'HFPlantar'],
+             'forefoot': ['P1M', 'P5M', 'D1M0', 'D5M0', 'TOE', 'P1Mlat', 'D1Mlat', 'D5Mlat'],
+             'hallux': ['HLX'],
+             }
+
+VERSIONS = ['1.0', '1.1']
+
+
+def generate_trial(n_frames=1000, rate=100.0, angles=None, cadence=1.0, speed=1200.0, noise=0.0, gaps=None,
+                   random_gaps=0, gap_length=10, seed=None, n_static=100, static_noise=0.0, processing=None,
+                   template=None):
+    """ generate static and dynamic OFM + PiG trials from prescribed joint angles, with known ground truth
+
+    Arguments:
+        n_frames     ... int, number of frames of the dynamic trial
+        rate         ... float, frame rate in Hz
+        angles       ... dict, Default = None. Joint angles in deg as n_frames x 3 arrays (flexion, abduction,
+                         twist), with side + joint as keys (e.g. 'RightKnee', see JOINTS). Missing joints follow
+                         default gait-like curves (see default_angles)
+        cadence      ... float, strides per second of the default curves
+        speed        ... float, walking speed in mm/s. The pelvis moves in the direction the subject faces in
+                         the template. Use 0 for a treadmill: TIBA of the ground truth is then relative to the
+                         direction faced in the static trial, as openOFM_dynamic uses it when the pelvis travels
+                         less than MIN_TRAVEL (see init_direction)
+        noise        ... float, standard deviation (mm) of the noise added to the markers of the dynamic trial
+        gaps         ... list, Default = None. Gaps of the dynamic trial as (marker, start, stop) frames
+        random_gaps  ... int, number of gaps of gap_length frames added to random markers of the dynamic trial
+        gap_length   ... int, length of the random gaps in frames
+        seed         ... int, Default = None. Seed of the noise and random gaps
+        n_static     ... int, number of frames of the static trial
+        static_noise ... float, standard deviation (mm) of the noise added to the markers of the static trial
+        processing   ... dict, Default = None. Processing options (RHindFootFlat, RUseFloorFF, ...) overriding
+                         those of the template
+        template     ... dict, Default = None. Static trial whose average pose is the neutral pose of the model.
+                         If None, the static trial of Data_Sample/Sample is used
+    Returns:
+        sdata        ... dict, static trial (markers and parameters, as returned by c3d_to_dict)
+        data         ... dict, dynamic trial
+        truth        ... dict, 'prescribed' joint angles and, for each version in VERSIONS, the angles of
+                         stream_angles expected for the prescribed motion, all as n_frames x 3 arrays
+
+    Notes:
+        - the segments are rigid bodies rotating about the joint centres of the neutral pose (PiG hip, knee and
+        ankle joint centres, middle of the hindfoot and proximal forefoot markers, D1M). Joint rotations are
+        applied in the order flexion (about the medio-lateral axis), abduction (about the anterior axis) and
+        twist (about the vertical axis) of the lab in the neutral pose, mirrored for the left side
+        - the prescribed angles are rotations about the axes of the lab, the angles of openOFM are rotations about
+        the anatomical axes of the segments, which are not aligned with the lab in the template. The expected
+        angles are therefore not the prescribed angles, but follow exactly from them (see ground_truth): they
+        start from the angles of the neutral pose and include the cross-talk between the axes of the lab and of
+        the segments
+        - the ground truth is not affected by noise and gaps, nor computed from the dynamic trial. The difference
+        between the output of openOFM and the ground truth is the error due to the marker data and to the
+        dynamic processing (landmarks, segments and joint angles of every frame)
+    """
+    rng = np.random.default_rng(seed)
+
+    if template is None:
+        root_dir = find_repo_root(os.path.dirname(__file__))
+        template = c3d_to_dict(os.path.join(root_dir, 'Data_Sample', 'Sample', 'static.c3d'))
+    neutral, parameters = get_neutral(template, processing)
+
+    # 1: motion of the segments
+    time = np.arange(n_frames) / rate
+    prescribed = default_angles(time, cadence)
+    if angles is not None:
+        prescribed.update({joint: np.asarray(value, dtype=float) for joint, value in angles.items()})
+    poses = segment_poses(neutral, parameters, prescribed, time, speed)
+
+    # 2: static and dynamic trials
+    sdata = {mrk: np.tile(value, (n_static, 1)) for mrk, value in neutral.items()}
+    sdata['parameters'] = copy.deepcopy(parameters)
+
+    data = {}
+    for mrk in neutral:
+        if mrk[1:] in STATIC_MARKERS:
+            continue
+        data[mrk] = move(poses[marker_segment(mrk)], neutral[mrk])
+    data['parameters'] = copy.deepcopy(parameters)
+    for trial in [sdata, data]:
+        trial['parameters']['POINT'] = {'RATE': {'value': np.array([rate])}}
+
+    # 3: ground truth from exact landmarks
+    truth = {'prescribed': prescribed}
+    for version in VERSIONS:
+        truth[version] = ground_truth(neutral, parameters, poses, version)
+
+    # 4: measurement errors
+    add_noise(sdata, static_noise, rng)
+    add_noise(data, noise, rng)
+    gaps = list(gaps) if gaps is not None else []
+    markers = [mrk for mrk in data if mrk != 'parameters']
+    for _ in range(random_gaps):
+        start = int(rng.integers(0, max(n_frames - gap_length, 1)))
+        gaps.append((markers[rng.integers(len(markers))], start, start + gap_length))
+    for mrk, start, stop in gaps:
+        data[mrk][start:stop] = np.nan
+
+    return sdata, data, truth
+
+
+def get_neutral(template, processing=None):
+    """ helper function to extract the neutral pose (average of each labeled marker) and parameters of a
+    static trial"""
+    neutral = {}
+    for mrk, value in template.items():
+        if isinstance(value, np.ndarray) and value.ndim == 2 and not mrk.startswith('*'):
+            neutral[mrk] = np.nanmean(value, axis=0)
+
+    parameters = {'PROCESSING': {}}
+    for key, param in template['parameters']['PROCESSING'].items():
+        if isinstance(param, dict) and 'value' in param and not key.startswith('%'):
+            parameters['PROCESSING'][key] = {'value': np.ravel(np.array(param['value'], dtype=float))}
+    if processing is not None:
+        for key, value in processing.items():
+            parameters['PROCESSING'][key] = {'value': np.array([float(value)])}
+
+    return neutral, parameters
+
+
+def marker_segment(mrk):
+    """ helper function to find the segment (with side prefix, except pelvis) a marker is attached to"""
+    if mrk in PELVIS_MARKERS:
+        return 'pelvis'
+    for segment, markers in SEGMENT_MARKERS.items():
+        if mrk[1:] in markers:
+            return mrk[0] + segment
+    raise KeyError('marker {} is not attached to any segment'.format(mrk))
+
+
+def default_angles(time, cadence=1.0):
+    """ gait-like joint angles (deg), sinusoids of amplitude AMPLITUDES with the left side half a stride
+    behind the right side"""
+    angles = {}
+    for side, phase in [('Right', 0.0), ('Left', np.pi)]:
+        stride = 2 * np.pi * cadence * time + phase
+        for joint, amplitude in AMPLITUDES.items():
+            angles[side + joint] = np.column_stack((amplitude[0] * np.sin(stride),
+                                                    amplitude[1] * np.sin(stride + np.pi / 3),
+                                                    amplitude[2] * np.sin(stride + 2 * np.pi / 3)))
+    return angles
+
+
+def joint_centres(neutral, parameters):
+    """ helper function to compute the centre of rotation of each joint in the neutral pose"""
+    pig = {mrk: value[np.newaxis] for mrk, value in neutral.items()}
+    pig['parameters'] = parameters
+    pig = hipjointcentrePiG_data(pig)
+    pig = kneejointcenterPiG(pig)
+    pig = anklejointcenterPiG(pig)
+
+    centres = {}
+    for side in ['R', 'L']:
+        centres[side + 'Hip'] = pig[side + 'HipJC'][0]
+        centres[side + 'Knee'] = pig[side + 'KneeJC'][0]
+        centres[side + 'Ankle'] = pig[side + 'AnkleJC'][0]
+        centres[side + 'MidFoot'] = ((neutral[side + 'STL'] + neutral[side + 'LCA']) / 2 +
+                                     (neutral[side + 'P1M'] + neutral[side + 'P5M']) / 2) / 2
+        centres[side + 'MTP'] = neutral[side + 'D1M']
+    return centres
+
+
+def segment_poses(neutral, parameters, angles, time, speed):
+    """ helper function to compute the pose of each segment relative to the neutral pose
+
+    Returns:
+        poses   ... dict, segment (with side prefix, except pelvis) as keys and (R, t) as values, such that a
+                    point x of the neutral pose is at R @ x + t. R is n x 3 x 3, t is n x 3
+    """
+    n = len(time)
+    forward, right, up = lab_axes(neutral)
+    lab = np.column_stack((right, forward, up))
+    centres = joint_centres(neutral, parameters)
+
+    poses = {'pelvis': (np.tile(np.eye(3), (n, 1, 1)), speed * time[:, np.newaxis] * forward)}
+    for side, name in [('R', 'Right'), ('L', 'Left')]:
+        mirror = np.array([1.0, 1.0, 1.0]) if side == 'R' else np.array([1.0, -1.0, -1.0])
+        for joint, proximal, distal in JOINTS:
+            Rp, tp = poses[proximal if proximal == 'pelvis' else side + proximal]
+            theta = np.deg2rad(angles[name + joint] * mirror)
+            Rj = lab @ rotation_xyz(theta) @ lab.T
+            c = centres[side + joint]
+            R = Rp @ Rj
+            t = np.einsum('nij,nj->ni', Rp, c - np.einsum('nij,j->ni', Rj, c)) + tp
+            poses[side + distal] = (R, t)
+
+    return poses
+
+
+def lab_axes(neutral):
+    """ helper function to find the forward, right and up directions of the subject in the neutral pose"""
+    direction = getDirStat({mrk: value[np.newaxis] for mrk, value in neutral.items()})
+    forward = np.zeros(3)
+    forward[0 if direction[0] == 'I' else 1] = 1.0 if direction[1:] == 'pos' else -1.0
+    up = np.array([0.0, 0.0, 1.0])
+    right = np.cross(forward, up)
+    return forward, right, up
+
+
+def rotation_xyz(theta):
+    """ helper function to build rotation matrices Rx(theta[:, 0]) @ Ry(theta[:, 1]) @ Rz(theta[:, 2])"""
+    c = np.cos(theta)
+    s = np.sin(theta)
+    n = len(theta)
+    R = np.zeros((3, n, 3, 3))
+    for i, (j, k) in enumerate([(1, 2), (2, 0), (0, 1)]):
+        R[i, :, i, i] = 1.0
+        R[i, :, j, j] = c[:, i]
+        R[i, :, k, k] = c[:, i]
+        R[i, :, j, k] = -s[:, i]
+        R[i, :, k, j] = s[:, i]
+    return R[0] @ R[1] @ R[2]
+
+
+def move(pose, x):
+    """ helper function to move point x of the neutral pose with pose (R, t)"""
+    R, t = pose
+    return np.einsum('nij,...j->ni', R, x) + t
+
+
+def ground_truth(neutral, parameters, poses, version):
+    """ helper function to compute the angles of openOFM version expected for the prescribed motion
+
+    Notes:
+        - openOFM only computes the axes of the bones in the neutral pose (static calibration, landmarks and
+        segments of a single frame)
+        - the axes of each bone are rotated with the segment it belongs to (see segment_poses), except for the
+        hallux, built from its single marker and the forefoot (see hallux_axes), and the angles follow from the
+        Grood and Suntay definitions of the oxford foot model (see grood_suntay_angles). The dynamic processing of
+        openOFM (OFM.segments and OFM.kinematics on every frame) is not used
+    """
+    settings = dict(version=version)
+
+    # calibration
+    sdata = {mrk: value[np.newaxis] for mrk, value in neutral.items()}
+    sdata['parameters'] = copy.deepcopy(parameters)
+    settings['processing'] = get_processing(sdata)
+    sdata = create_virtual_markers(sdata, settings)
+    calibration = get_calibration(sdata)
+
+    # landmarks in the neutral pose
+    data = {mrk: value[np.newaxis] for mrk, value in neutral.items() if mrk[1:] not in STATIC_MARKERS}
+    data['parameters'] = calibration
+    data = hipjointcentrePiG_data(data)
+    data = kneejointcenterPiG(data)
+    data = anklejointcenterPiG(data)
+    data = animate_virtual_markers(data, settings)
+
+    # axes of the bones in the neutral pose
+    ndata = {mrk: neutral[mrk][np.newaxis] for mrk in PELVIS_MARKERS if mrk in neutral}
+    for side in ['R', 'L']:
+        for segment, landmarks in LANDMARKS.items():
+            for landmark in landmarks:
+                if version == '1.1' and landmark in ['KneeJC', 'AnkleJC', 'TIR']:
+                    continue
+                ndata[side + landmark] = data[side + landmark]
+    ndata['parameters'] = calibration
+    ndata, r, jnt = segments(ndata, version)
+
+    # angles of the axes moved with the segments
+    axes = {bone: bone_axes(r, bone, poses) for bone in r if not bone.endswith('Hallux')}
+    for side, name in [('R', 'Right'), ('L', 'Left')]:
+        axes[name + 'Hallux'] = hallux_axes(ndata, axes[name + 'ForeFoot'], side, poses, version)
+    KIN = {}
+    for joint, pbone, dbone in jnt:
+        KIN[joint] = grood_suntay_angles(axes[pbone], axes[dbone], pbone, version)
+
+    # reference system of the oxford foot model
+    direction = getDirStat({mrk: value[np.newaxis] for mrk, value in neutral.items()})
+    for side, signs in TIBIA_LAB_SIGNS[direction].items():
+        for comp, sign in zip(['flx', 'abd', 'tw'], signs):
+            KIN[side + 'TibiaLab'][comp] = sign * KIN[side + 'TibiaLab'][comp + '_' + direction[0].lower()]
+    for joint, comps in MIRRORED_ANGLES[version]:
+        for comp in comps:
+            KIN[joint][comp] = -KIN[joint][comp]
+
+    truth = {}
+    for ch in stream_angles():
+        side = 'Right' if ch.startswith('Right') else 'Left'
+        joint, components = ANGLE_JOINTS[ch[len(side):]]
+        truth[ch] = np.column_stack([KIN[side + joint][comp] for comp in components])
+    return truth
+
+
+def bone_axes(r, bone, poses):
+    """ helper function to move the unit axes of a bone in the neutral pose (rows x, y, z) with its segment, as
+    n x 3 x 3 arrays"""
+    name = bone[5:] if bone.startswith('Right') else bone[4:] if bone.startswith('Left') else bone
+    axes = r[bone]['ort'][0]
+    axes = axes / np.linalg.norm(axes, axis=1)[:, np.newaxis]
+    if BONE_SEGMENTS[name] is None:
+        return np.tile(axes, (len(poses['pelvis'][0]), 1, 1))
+    R = poses[bone[0] + BONE_SEGMENTS[name]][0]
+    return np.einsum('nij,kj->nki', R, axes)
+
+
+def hallux_axes(ndata, forefoot, side, poses, version):
+    """ helper function to build the unit axes of the hallux bone of side ('R' or 'L') as in
+    OFM.segments.hallux_segment: long axis from the hallux marker (moving with the hallux) to D1M0, plane from the
+    forefoot (moving with the forefoot)"""
+    HLX = move(poses[side + 'hallux'], ndata[side + 'HLX'][0])
+    D1M0 = move(poses[side + 'forefoot'], ndata[side + 'D1M0'][0])
+    if version == '1.0':
+        D5M0 = move(poses[side + 'forefoot'], ndata[side + 'D5M0'][0])
+        sign = 1 if side == 'R' else -1
+        return lcs_axes(HLX - D1M0, sign * (D1M0 - D5M0), 'zxy')
+    return lcs_axes(HLX - D1M0, forefoot[:, 2], 'yxz')
+
+
+def grood_suntay_angles(pax, dax, pbone, version):
+    """ joint angles (deg) between two bones with the Grood and Suntay definitions of the oxford foot model
+
+    Arguments:
+        pax         ... n x 3 x 3 array, unit axes of the proximal bone for each frame (rows = x, y, z axes)
+        dax         ... n x 3 x 3 array, unit axes of the distal bone
+        pbone       ... str, name of the proximal bone (e.g. 'RightTibiaOFM', 'Global')
+        version     ... str, openOFM version '1.0' or '1.1'
+    Returns:
+        angles      ... dict, 'flx', 'abd' and 'tw' angles (n arrays), or their projections on the i and j axes
+                        of the lab ('flx_i', ..., 'tw_j') if pbone is the lab
+
+    Notes:
+        - each angle is the arcsine of the cosine between two axes, with the floating axis perpendicular to the
+        distal z (1.0) or x (1.1) axis and the proximal y (1.0) or z (1.1) axis. The lab has no floating axis
+        - written from the definitions of the model, independently of OFM.kinematics, to compute the ground truth
+        of synthetic trials
+    """
+    px, py, pz = pax[:, 0], pax[:, 1], pax[:, 2]
+    dx, dy, dz = dax[:, 0], dax[:, 1], dax[:, 2]
+    bone = pbone[5:] if pbone.startswith('Right') else pbone[4:] if pbone.startswith('Left') else pbone
+
+    def asind(a, b):
+        return np.rad2deg(np.arcsin(np.clip(np.einsum('ni,ni->n', a, b), -1.0, 1.0)))
+
+    if bone == 'Global':
+        long_axis = dz if version == '1.0' else dy
+        return {'flx_i': asind(long_axis, px), 'abd_i': asind(py, long_axis), 'tw_i': asind(dx, py),
+                'flx_j': asind(py, long_axis), 'abd_j': asind(long_axis, px), 'tw_j': asind(dx, px)}
+
+    if version == '1.0':
+        floatax = np.cross(dz, py)
+        floatax /= np.linalg.norm(floatax, axis=1)[:, np.newaxis]
+        if bone == 'TibiaOFM':
+            return {'flx': -asind(floatax, px), 'abd': asind(floatax, dy), 'tw': asind(py, dz)}
+        return {'flx': -asind(floatax, pz), 'abd': asind(py, dz), 'tw': asind(floatax, dy)}
+
+    floatax = np.cross(dx, pz)
+    floatax /= np.linalg.norm(floatax, axis=1)[:, np.newaxis]
+    flx = asind(floatax, py if bone == 'ForeFoot' else px)
+    if bone == 'HindFoot':
+        return {'flx': flx, 'abd': -asind(pz, dx), 'tw': asind(floatax, dz)}
+    return {'flx': flx, 'abd': asind(floatax, dz), 'tw': -asind(pz, dx)}
+
+
+def add_noise(data, noise, rng):
+    """ helper function to add gaussian noise of standard deviation noise (mm) to every marker of data"""
+    if noise <= 0:
+        return
+    for mrk, value in data.items():
+        if mrk != 'parameters':
+            data[mrk] = value + rng.normal(0.0, noise, value.shape)
+
+
+def save_trial(out_dir, sdata, data, truth, rate=100.0, static_name='static.c3d', file_name='dynamic.c3d'):
+    """ write a synthetic trial to out_dir as static and dynamic c3d files and the ground truth to truth.npz
+    (keys 'group/channel', see load_truth)"""
+    os.makedirs(out_dir, exist_ok=True)
+    write_c3d(sdata, os.path.join(out_dir, static_name), rate=rate)
+    write_c3d(data, os.path.join(out_dir, file_name), rate=rate)
+
+    arrays = {group + '/' + ch: value for group, channels in truth.items() for ch, value in channels.items()}
+    np.savez_compressed(os.path.join(out_dir, 'truth.npz'), **arrays)
+
+
+def load_truth(fl):
+    """ read the ground truth written by save_trial"""
+    truth = {}
+    with np.load(fl) as arrays:
+        for key in arrays.files:
+            group, ch = key.split('/')
+            truth.setdefault(group, {})[ch] = arrays[key]
+    return truth
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='openOFM synthetic trials with known ground truth angles',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--data_dir', default='Data_Synthetic', help='Name of subfolder relative to root to write to')
+    parser.add_argument('--frames', type=int, default=1000, help='number of frames of the dynamic trial')
+    parser.add_argument('--rate', type=float, default=100.0, help='frame rate in Hz')
+    parser.add_argument('--cadence', type=float, default=1.0, help='strides per second')
+    parser.add_argument('--speed', type=float, default=1200.0,
+                        help='walking speed in mm/s, 0 for a treadmill (TIBA is then relative to the direction faced '
+                             'in the static trial, as in openOFM_dynamic, see init_direction)')
+    parser.add_argument('--noise', type=float, default=0.0, help='marker noise (mm) of the dynamic trial')
+    parser.add_argument('--static_noise', type=float, default=0.0, help='marker noise (mm) of the static trial')
+    parser.add_argument('--random_gaps', type=int, default=0, help='number of random gaps')
+    parser.add_argument('--gap_length', type=int, default=10, help='length of the random gaps in frames')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the noise and gaps')
+    args = parser.parse_args()
+
+    sdata, data, truth = generate_trial(n_frames=args.frames, rate=args.rate, cadence=args.cadence,
+                                        speed=args.speed, noise=args.noise, static_noise=args.static_noise,
+                                        random_gaps=args.random_gaps, gap_length=args.gap_length, seed=args.seed)
+    out_dir = os.path.join(find_repo_root(os.path.dirname(__file__)), args.data_dir)
+    save_trial(out_dir, sdata, data, truth, rate=args.rate)
+    print('Saved synthetic trial of {} frames to {}'.format(args.frames, out_dir))
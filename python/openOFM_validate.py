@@ -1,8 +1,9 @@
 import os
+import json
+import numpy as np
 from openOFM_dynamic import openOFM_dynamic
 from openOFM_static import openOFM_static
-from utils.utils import find_repo_root, c3d_to_dict, make_plot_title, get_nrmse
-from plotting.plotting import plot_angles
+from utils.utils import find_repo_root, c3d_to_dict, make_plot_title, get_nrmse, get_jc_error, PRECISIONS
 
 # global settings
 validation_dir = 'Data_Validate'
@@ -11,6 +12,9 @@ dynamic_trial = 'dynamic.c3d'
 static_trial_processed = 'static_processed.c3d'
 dynamic_trial_processed = 'dynamic_processed.c3d'
 
+# largest deviation (deg) of the angles computed in reduced precision from the float64 angles (see precision_report)
+PRECISION_TOLERANCE = 0.05
+
 
 def ofm_validate():
     """script to demonstrate validation of open OFM against Vicon processed data"""
@@ -50,14 +54,97 @@ def ofm_validate():
         settings['make_plot'] = False
         data = openOFM_dynamic(settings=settings)
 
+        # compare PiG joint centres between vicon generated OFM and openOFM
+        data = get_jc_error(data, data_processed)
+        for key in [key for key in data if key.startswith('jcerror')]:
+            print('{}: mean = {:.3f} mm, max = {:.3f} mm'.format(key[7:], data[key]['mean'], data[key]['max']))
+
         # compute normalized root mean squared error between vicon generated OFM and openOFM
         data = get_nrmse(data, data_processed)
 
         # compare angles between vicon generated OFM and openOFM
+        from plotting.plotting import plot_angles
         plot_title = make_plot_title(settings)
         plot_angles(data=data, vicon_data=data_processed, plot_title=plot_title)
 
 
+def precision_report(precision='float32', versions=('1.0', '1.1'), tolerance=PRECISION_TOLERANCE, out=None):
+    """ quantifies the deviation of openOFM run in reduced precision from the float64 path on the validation trials
+
+    Arguments:
+        precision   ... str, Default = 'float32'. Precision to validate (see utils.set_precision)
+        versions    ... tuple, Default = ('1.0', '1.1'). Versions of openOFM to validate
+        tolerance   ... float, Default = PRECISION_TOLERANCE. Largest deviation of the angles (deg) accepted
+        out         ... str, Default = None. json file of the report
+    Returns:
+        report      ... dict, one entry per subject and version with the largest deviation of each angle (deg), of
+                        the markers, virtual markers and segment axes ('markers', mm), the angle deviating most
+                        ('worst') and the memory of the trial data in each precision (MB), and 'passed', true if
+                        no angle deviates by more than tolerance
+
+    Notes:
+        - the static and dynamic trials of each subject are processed in both precisions, the static calibration of
+        each precision is used by its dynamic trial
+        - float64 runs last, so that parameters.txt of each subject holds the float64 calibration
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision {}, must be one of {}'.format(precision, list(PRECISIONS)))
+
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    report = dict(precision=precision, tolerance=tolerance, trials=[])
+
+    for subject in sorted(os.listdir(os.path.join(root_dir, validation_dir))):
+        for version in versions:
+            data = {p: run_validation(subject, version, p) for p in [precision, 'float64']}
+            reduced, full = data[precision], data['float64']
+
+            angles = {ch: max_deviation(reduced[ch], full[ch]) for ch in full
+                      if ch.startswith(('Right', 'Left')) and isinstance(full[ch], np.ndarray)}
+            markers = max(max_deviation(reduced[ch], full[ch]) for ch in full
+                          if isinstance(full[ch], np.ndarray) and full[ch].ndim == 2)
+            worst = max(angles, key=angles.get)
+            trial = dict(subject=subject, version=version, frames=len(full['RHEE']), angles=angles,
+                         worst=worst, max_angle=angles[worst], markers=markers,
+                         memory_mb={p: data_memory(data[p]) for p in data})
+            report['trials'].append(trial)
+            print('{} {}: angles deviate by at most {:.5f} deg ({}), markers by {:.5f} mm, {:.2f} MB in {} '
+                  'instead of {:.2f} MB'.format(subject, version, trial['max_angle'], worst, markers,
+                                                trial['memory_mb'][precision], precision,
+                                                trial['memory_mb']['float64']))
+
+    report['max_angle'] = max(trial['max_angle'] for trial in report['trials'])
+    report['passed'] = bool(report['max_angle'] <= tolerance)
+    print('{}: largest angle deviation {:.5f} deg, {} the tolerance of {} deg'.format(
+        precision, report['max_angle'], 'within' if report['passed'] else 'ABOVE', tolerance))
+
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+def run_validation(subject, version, precision):
+    """ helper function to process the static and dynamic validation trials of a subject in a given precision"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    settings = dict(nexus=False, version=version, use_settings=False, precision=precision,
+                    data_dir=os.path.join(validation_dir, subject))
+    sdata_processed = c3d_to_dict(os.path.join(root_dir, settings['data_dir'], static_trial_processed))
+    settings.update(get_validation_settings(sdata_processed, settings))
+
+    openOFM_static(settings=dict(settings, trial_type='static', file_name=static_trial))
+    return openOFM_dynamic(settings=dict(settings, trial_type='dynamic', file_name=dynamic_trial, make_plot=False))
+
+
+def max_deviation(a, b):
+    """ helper function to get the largest absolute difference between two channels, ignoring gaps"""
+    return float(np.nanmax(np.abs(np.asarray(a, dtype=float) - b)))
+
+
+def data_memory(data):
+    """ helper function to get the memory (MB) of the arrays of a trial"""
+    return sum(value.nbytes for value in data.values() if isinstance(value, np.ndarray)) / 1e6
+
+
 def get_validation_settings(sdata_processed, settings):
     """ populates settings parameters with values computed by Vicon OFM pipleline for validation"""
     params = sdata_processed['parameters']['PROCESSING']
@@ -85,4 +172,22 @@ def get_validation_settings(sdata_processed, settings):
 
 
 if __name__ == "__main__":
-    ofm_validate()
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='validates openOFM against Vicon processed data, or its reduced precision against float64',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--precision', choices=[p for p in PRECISIONS if p != 'float64'], default=None,
+                        help='instead of plotting against Vicon, reports the deviation of the angles computed in '
+                             'this precision from the float64 angles')
+    parser.add_argument('--tolerance', type=float, default=PRECISION_TOLERANCE,
+                        help='largest deviation of the angles (deg) accepted with --precision')
+    parser.add_argument('--out', default=None, help='json file of the precision report')
+    args = parser.parse_args()
+
+    if args.precision is None:
+        ofm_validate()
+    else:
+        report = precision_report(args.precision, tolerance=args.tolerance, out=args.out)
+        sys.exit(0 if report['passed'] else 1)
@@ -0,0 +1,209 @@
+import os
+import numpy as np
+from utils.utils import find_repo_root
+
+# graphic settings of the reports, as in plot_angles
+REPORT_GSETTINGS = {'LineWidth': 1.5, 'FontSize': 15, 'FontName': 'Arial', 'vcol': 'k', 'zcol': 'r', 'vstyle': '-',
+                    'zstyle': '--'}
+
+# panels of the reports as in plot_angles: row (plane), column (of a side), angle, component of the openOFM angle,
+# column of the Vicon angle, title and title with Vicon angles
+REPORT_PANELS = [(0, 0, 'TIBA', '_x', 0, 'LabTibia', 'LabTibia'),
+                 (0, 1, 'FFTBA', '_x', 0, 'FFTBA', 'FF/TIB'),
+                 (0, 2, 'HFTBA', '_x', 0, 'HFTBA', 'HF/TB'),
+                 (0, 3, 'FFHFA', '_x', 0, 'FFHFA', 'FF/HF'),
+                 (0, 4, 'HXFFA', '_x', 0, 'HXFFA', 'HX/FF'),
+                 (1, 0, 'TIBA', '_y', 1, '', ''),
+                 (1, 1, 'FFTBA', '_z', 2, '', ''),
+                 (1, 2, 'HFTBA', '_z', 2, '', ''),
+                 (1, 3, 'FFHFA', '_z', 2, '', ''),
+                 (2, 0, 'TIBA', '_z', 2, '', ''),
+                 (2, 1, 'FFTBA', '_y', 1, '', ''),
+                 (2, 2, 'HFTBA', '_y', 1, '', ''),
+                 (2, 3, 'FFHFA', '_y', 1, '', ''),
+                 (2, 4, 'HXFFA', '_y', 1, '', ''),
+                 ]
+
+REPORT_YLABELS = ['Sagittal Angles (deg)', 'Coronal Angles (deg)', 'Transverse Angles (deg)']
+
+# formats of the report pages
+REPORT_FORMATS = ['png', 'pdf', 'svg']
+
+# most ticks of the y axes, tick labels are the largest share of the drawing time
+REPORT_YTICKS = 4
+
+# size (inches) and resolution of the report pages
+REPORT_SIZE = (24, 10)
+REPORT_DPI = 100
+
+# zlib compression of png pages, encoding at the default level takes about a third of the time of a page
+PNG_COMPRESSION = 1
+
+# report templates of the current process, built once and reused for every trial (see render_report)
+_TEMPLATES = {}
+
+
+def init_report(vicon=False, gsettings=None, figsize=REPORT_SIZE):
+    """ builds the figure of an angle report (as plot_angles) once, to be filled with the angles of each trial
+
+    Arguments:
+        vicon       ... bool, Default = False. If true, the report also shows Vicon angles and NRMSE
+        gsettings   ... dict, Default = None. Graphic settings. If None, REPORT_GSETTINGS
+        figsize     ... tuple, Default = REPORT_SIZE. Size of the figure (inches)
+    Returns:
+        report      ... dict, figure 'fig', 'lines' and 'titles' of each panel, see update_report
+
+    Notes:
+        - the figure is drawn with the Agg canvas, without pyplot or a GUI backend, so reports can be rendered
+        on servers and in worker processes
+        - axes, labels, fonts and legend are created once, update_report only changes the data of the lines
+        - frames are labelled on the transverse (bottom) row only
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.ticker import MaxNLocator
+
+    if gsettings is None:
+        gsettings = REPORT_GSETTINGS
+    font = dict(fontsize=gsettings['FontSize'], fontname=gsettings['FontName'])
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    grid = fig.add_gridspec(3, 10)
+    report = dict(fig=fig, vicon=vicon, lines={}, titles={}, axes=[])
+
+    for offset, side in [(0, 'Right'), (5, 'Left')]:
+        for row, col, angle, axis, vicon_col, title, vicon_title in REPORT_PANELS:
+            ax = fig.add_subplot(grid[row, offset + col])
+            ax.yaxis.set_major_locator(MaxNLocator(REPORT_YTICKS))
+            if row < 2:
+                ax.tick_params(labelbottom=False)
+            report['axes'].append(ax)
+            zline, = ax.plot([], [], color=gsettings['zcol'], linestyle=gsettings['zstyle'],
+                             linewidth=gsettings['LineWidth'])
+            vline = None
+            if vicon:
+                vline, = ax.plot([], [], color=gsettings['vcol'], linestyle=gsettings['vstyle'],
+                                 linewidth=gsettings['LineWidth'])
+                title_font = dict(font, fontsize=gsettings['FontSize'] * 0.8)
+                report['titles'][side + angle + axis] = (ax.set_title('', **title_font),
+                                                         side[0] + vicon_title + ' \n ' if vicon_title else '')
+            elif title:
+                ax.set_title(side[0] + title, **font)
+            report['lines'][side + angle + axis] = (zline, vline, side[0] + angle, vicon_col)
+            if offset == 0 and col == 0:
+                ax.set_ylabel(REPORT_YLABELS[row], **font)
+
+        # legend in place of the empty coronal panel of each side
+        handles = [zline] if not vicon else [vline, zline]
+        labels = ['openFoot'] if not vicon else ['ViconOFM', 'openFoot']
+        ax = fig.add_subplot(grid[1, offset + 4])
+        ax.axis('off')
+        ax.legend(handles, labels, loc='center', frameon=False)
+
+    report['suptitle'] = fig.suptitle('', **font)
+    return report
+
+
+def update_report(report, data, vicon_data=None, title=''):
+    """ fills a report (see init_report) with the angles of a trial
+
+    Arguments:
+        report      ... dict, report built by init_report
+        data        ... dict, processed trial data with OFM angles (and NRMSE if vicon_data is given, see get_nrmse)
+        vicon_data  ... dict, Default = None. Vicon angles, for reports built with vicon
+        title       ... str, Default = ''. Title of the report (see make_plot_title)
+    Returns:
+        report      ... dict, updated report
+    """
+    for ch, (zline, vline, vicon_ch, vicon_col) in report['lines'].items():
+        y = np.asarray(data[ch])
+        zline.set_data(np.arange(len(y)), y)
+        if vline is not None:
+            v = np.asarray(vicon_data[vicon_ch])[:, vicon_col] if vicon_data is not None else np.array([])
+            vline.set_data(np.arange(len(v)), v)
+        ax = zline.axes
+        ax.relim()
+        ax.autoscale_view()
+    for ch, (text, prefix) in report['titles'].items():
+        text.set_text(prefix + 'NRMSE = ' + data['nrmse' + ch] if 'nrmse' + ch in data else prefix)
+    report['suptitle'].set_text('multi-segment foot OFM for ' + title if title else '')
+    return report
+
+
+def save_report(report, fl, dpi=REPORT_DPI):
+    """ saves the page of a report (see update_report) to fl, the format is given by the extension (.png, .pdf,
+    .svg)"""
+    folder = os.path.dirname(os.path.abspath(fl))
+    os.makedirs(folder, exist_ok=True)
+    kwargs = dict(pil_kwargs={'compress_level': PNG_COMPRESSION}) if fl.lower().endswith('.png') else {}
+    report['fig'].savefig(fl, dpi=dpi, **kwargs)
+    return fl
+
+
+def render_report(data, fl, vicon_data=None, title='', gsettings=None):
+    """ renders the angle report of a trial to fl, with the report template of the current process
+
+    Arguments:
+        data        ... dict, processed trial data with OFM angles
+        fl          ... str, full path to the page (.png, .pdf, .svg)
+        vicon_data  ... dict, Default = None. Vicon angles to compare to (see plot_angles)
+        title       ... str, Default = ''. Title of the report
+        gsettings   ... dict, Default = None. Graphic settings. If None, REPORT_GSETTINGS
+    Returns:
+        fl          ... str, full path to the page
+
+    Notes:
+        - the template is built at the first call of each process (and graphic settings), later calls only update
+        the lines, so batch workers render their trials without rebuilding the figure
+    """
+    key = (vicon_data is not None, None if gsettings is None else tuple(sorted(gsettings.items())))
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = init_report(vicon=key[0], gsettings=gsettings)
+    report = update_report(_TEMPLATES[key], data, vicon_data, title)
+    return save_report(report, fl)
+
+
+def render_reports(jobs, fl, gsettings=None):
+    """ renders the angle reports of many trials as the pages of a single pdf
+
+    Arguments:
+        jobs        ... list, one dict per trial with keys 'data' (see report_channels), 'title' and optional
+                        'vicon_data'
+        fl          ... str, full path to the multi-page .pdf
+        gsettings   ... dict, Default = None. Graphic settings. If None, REPORT_GSETTINGS
+    Returns:
+        fl          ... str, full path to the pdf
+
+    Notes:
+        - pages of a pdf are written in order by a single process, reusing one template for all trials (see
+        openOFM_batch --report pdf, where workers only send the channels of the reports, see report_channels)
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    folder = os.path.dirname(os.path.abspath(fl))
+    os.makedirs(folder, exist_ok=True)
+    reports = {}
+    with PdfPages(fl) as pdf:
+        for job in jobs:
+            vicon = job.get('vicon_data') is not None
+            if vicon not in reports:
+                reports[vicon] = init_report(vicon=vicon, gsettings=gsettings)
+            update_report(reports[vicon], job['data'], job.get('vicon_data'), job.get('title', ''))
+            pdf.savefig(reports[vicon]['fig'])
+    print('Saved {} report pages to {}'.format(len(jobs), fl))
+    return fl
+
+
+def report_channels(data):
+    """ helper function to keep only the channels of a trial shown in the reports (angles and NRMSE), to send to
+    worker processes"""
+    return {ch: value for ch, value in data.items()
+            if ch.startswith(('Right', 'Left', 'nrmseRight', 'nrmseLeft'))}
+
+
+def report_path(settings):
+    """ helper function to get the report page of a trial, next to the trial"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    return os.path.join(root_dir, settings['data_dir'],
+                        os.path.splitext(settings['file_name'])[0] + '_report.' + settings['report'])
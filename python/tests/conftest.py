@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the openOFM modules import each other from the python folder (e.g. linear_algebra.linear_algebra)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
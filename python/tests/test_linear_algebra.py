@@ -0,0 +1,114 @@
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from linear_algebra.linear_algebra import (rowdot, rowcross, makeunit, magnitude, angle, lcs_axes, gcs_2_lcs,
+                                           lcs_2_gcs, init_running_stats, running_mean)
+from openOFM_benchmark import tile_trial
+from utils.utils import c3d_to_dict, find_repo_root
+
+# frames of the long trial, and of the short trial it is compared to for the scaling test
+LONG_FRAMES = 1000000
+SHORT_FRAMES = 100000
+
+# rows of the long trial checked against the per-frame reference
+SAMPLE_ROWS = 2000
+
+# largest ratio of the time and peak memory of the long and short trials, 10 for exactly linear scaling (the
+# n x n matrices of np.diag(m1 @ m2.T) would give 100 for the time and cannot be allocated at all for 1M frames)
+MAX_TIME_RATIO = 20
+MAX_MEMORY_RATIO = 12
+
+# markers of the tibia and foot used as vectors and origins
+MARKERS = ['RTUB', 'RSHN', 'RANK', 'RHEE', 'RTOE']
+
+
+@pytest.fixture(scope='module')
+def trial():
+    """ 1M frames of the markers of the sample dynamic trial"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    data = c3d_to_dict(os.path.join(root_dir, 'Data_Sample', 'Sample', 'dynamic.c3d'), cache=False)
+    data = {mrk: data[mrk].astype(float) for mrk in MARKERS}
+    return tile_trial(data, LONG_FRAMES)
+
+
+def process(data):
+    """ helper function to run every row-wise helper over a trial, as the OFM segments and kinematics do"""
+    O = data['RANK']
+    axes = lcs_axes(data['RTUB'] - O, data['RSHN'] - O, 'zxy')
+    toe_lcl = gcs_2_lcs(O, axes, data['RTOE'])
+    toe = lcs_2_gcs(O, axes, toe_lcl)
+    foot = makeunit(data['RTOE'] - data['RHEE'])
+    flx = angle(foot, axes[:, 0])
+    cross = rowcross(foot, axes[:, 2])
+    stats = init_running_stats()
+    av = running_mean(toe_lcl, stats, 'toe')
+    return dict(axes=axes, toe_lcl=toe_lcl, toe=toe, foot=foot, flx=flx, cross=cross, av=av)
+
+
+def test_rows_match_per_frame_reference(trial):
+    out = process(trial)
+    rows = np.random.default_rng(0).choice(LONG_FRAMES, SAMPLE_ROWS, replace=False)
+
+    for i in rows:
+        O = trial['RANK'][i]
+        z = (trial['RTUB'][i] - O) / np.linalg.norm(trial['RTUB'][i] - O)
+        x = np.cross(trial['RSHN'][i] - O, z)
+        x /= np.linalg.norm(x)
+        y = np.cross(z, x)
+        y /= np.linalg.norm(y)
+        axes = np.array([x, y, z])
+        np.testing.assert_allclose(out['axes'][i], axes, atol=1e-12)
+
+        toe_lcl = axes @ (trial['RTOE'][i] - O)
+        np.testing.assert_allclose(out['toe_lcl'][i], toe_lcl, atol=1e-9)
+        np.testing.assert_allclose(out['toe'][i], toe_lcl @ axes + O, atol=1e-9)
+
+        foot = trial['RTOE'][i] - trial['RHEE'][i]
+        foot /= np.linalg.norm(foot)
+        np.testing.assert_allclose(out['foot'][i], foot, atol=1e-12)
+        np.testing.assert_allclose(out['flx'][i], np.rad2deg(np.arcsin(np.dot(foot, x))), atol=1e-9)
+        np.testing.assert_allclose(out['cross'][i], np.cross(foot, z), atol=1e-12)
+
+    np.testing.assert_allclose(out['av'], out['toe_lcl'].mean(axis=0), rtol=1e-9)
+    np.testing.assert_allclose(rowdot(trial['RHEE'][rows], trial['RTOE'][rows]),
+                               [np.dot(a, b) for a, b in zip(trial['RHEE'][rows], trial['RTOE'][rows])])
+    np.testing.assert_allclose(magnitude(trial['RHEE'][rows]), [np.linalg.norm(a) for a in trial['RHEE'][rows]])
+
+
+def test_running_mean_of_blocks(trial):
+    values = trial['RTOE'][:SHORT_FRAMES].copy()
+    values[100:200] = np.nan
+    stats = init_running_stats()
+    for start in range(0, SHORT_FRAMES, 7919):
+        av = running_mean(values[start:start + 7919], stats, 'toe')
+    np.testing.assert_allclose(av, np.nanmean(values, axis=0), rtol=1e-12)
+
+
+def test_time_and_memory_scale_linearly(trial):
+    short = {mrk: value[:SHORT_FRAMES] for mrk, value in trial.items()}
+    time_short, peak_short = measure(short)
+    time_long, peak_long = measure(trial)
+
+    assert time_long / time_short < MAX_TIME_RATIO
+    assert peak_long / peak_short < MAX_MEMORY_RATIO
+
+
+def measure(data, repeat=3):
+    """ helper function to get the best time of a few runs of process and its peak memory (MB)"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        process(data)
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        process(data)
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
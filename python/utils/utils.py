@@ -1,6 +1,31 @@
 import os
 import numpy as np
-from linear_algebra.linear_algebra import nrmse
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from linear_algebra.linear_algebra import nrmse, magnitude
+from utils.utils_cache import cache_enabled, cached_c3d_to_dict
+
+# floating point types of the computations (see set_precision)
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+# joint and components (x, y, z) of each OFM angle
+ANGLE_JOINTS = {'HFTBA': ('AnkleOFM', ('flx', 'tw', 'abd')),
+                'FFHFA': ('MidFoot', ('flx', 'abd', 'tw')),
+                'HXFFA': ('MTP', ('flx', 'abd', 'tw')),
+                'TIBA': ('TibiaLab', ('flx', 'abd', 'tw')),
+                'FFTBA': ('FFTBA', ('flx', 'tw', 'abd')),
+                }
+
+# markers of each side used to process a dynamic frame (see stream_markers)
+FOOT_MARKERS = ['D5M', 'P5M', 'P1M', 'TOE', 'STL', 'LCA', 'CPG', 'HEE', 'ANK', 'HFB', 'SHN', 'TUB', 'HLX']
+PIG_MARKERS = ['KNE', 'THI', 'TIB']
+PELVIS_MARKERS = ['RASI', 'LASI', 'RPSI', 'LPSI', 'SACR']
+
+# distance (mm) the pelvis must travel before the direction of motion is estimated from it (see init_direction)
+MIN_TRAVEL = 1000.0
+
+# markers of the static trial used to find the direction the subject faces (see getDirStat)
+STAND_MARKERS = ['RPCA', 'RD1M']
 
 
 def find_repo_root(test, dirs=(".git",), default=None):
@@ -13,12 +38,18 @@ def find_repo_root(test, dirs=(".git",), default=None):
     return default or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-def c3d_to_dict(fl, verbose=False):
+def c3d_to_dict(fl, verbose=False, markers=None, frames=None, mmap=False, cache=None):
     """ convert c3d file located at fl into dictionary with easily accessible marker data
 
     Arguments:
         fl      ... str, full path to c3d file
         verbose ... bool, Default = False. If true, information about processing printed to screen
+        markers ... list, Default = None. Marker names to keep. If None, all markers are kept
+        frames  ... tuple, Default = None. (start, stop) indices of the frames to keep. If None, all frames are kept
+        mmap    ... bool, Default = False. If true, the point block is memory-mapped and only the requested
+                    markers and frames are read (analog channels are skipped), see utils_c3d.c3d_to_dict_mmap
+        cache   ... bool, Default = None. If true, the parsed file is stored in and reloaded from a sidecar cache,
+                    see utils_cache.cached_c3d_to_dict. If None, the cache is used if OPENOFM_CACHE=1
     Returns:
         data    ... dict, c3d file with markers as keys and coordinates as values
 
@@ -27,6 +58,15 @@ def c3d_to_dict(fl, verbose=False):
         https://github.com/pyomeca/ezc3d#python-3
     """
 
+    if cache is None:
+        cache = cache_enabled()
+    if cache:
+        return cached_c3d_to_dict(fl, markers=markers, frames=frames, mmap=mmap)
+
+    if mmap:
+        from utils.utils_c3d import c3d_to_dict_mmap
+        return c3d_to_dict_mmap(fl, markers=markers, frames=frames, verbose=verbose)
+
     import ezc3d
 
     if verbose:
@@ -38,8 +78,12 @@ def c3d_to_dict(fl, verbose=False):
     # add all markers to a dictionary
     marker_names = d['parameters']['POINT']['LABELS']['value']  # marker names
     point_data = d['data']['points']  # 4xNxT, where 4 represent the components XYZ1
+    if frames is not None:
+        point_data = point_data[:, :, frames[0]:frames[1]]
     data = {}
     for i, marker_name in enumerate(marker_names):
+        if markers is not None and marker_name not in markers:
+            continue
         data[marker_name] = point_data[0:3, i, :].T  # we only want XYZ components in N X 3 format
 
     # add analog data to dictionary
@@ -66,34 +110,53 @@ def c3d_to_dict(fl, verbose=False):
 
 
 def addchannelsgs(data, KIN):
-    """ helper function to add all the computed data to the data dict"""
+    """ helper function to add all the computed data to the data dict, angles of joints missing in KIN are
+    skipped"""
     sides = ['Right', 'Left']
     for side in sides:
-        data[side + 'HFTBA_x'] = KIN[side + 'AnkleOFM']['flx']
-        data[side + 'HFTBA_y'] = KIN[side + 'AnkleOFM']['tw']
-        data[side + 'HFTBA_z'] = KIN[side + 'AnkleOFM']['abd']
+        for angle, (joint, components) in ANGLE_JOINTS.items():
+            if side + joint not in KIN:
+                continue
+            for axis, component in zip(['_x', '_y', '_z'], components):
+                data[side + angle + axis] = KIN[side + joint][component]
 
-        data[side + 'FFHFA_x'] = KIN[side + 'MidFoot']['flx']
-        data[side + 'FFHFA_y'] = KIN[side + 'MidFoot']['abd']
-        data[side + 'FFHFA_z'] = KIN[side + 'MidFoot']['tw']
+    return data
 
-        data[side + 'HXFFA_x'] = KIN[side + 'MTP']['flx']
-        data[side + 'HXFFA_y'] = KIN[side + 'MTP']['abd']
-        data[side + 'HXFFA_z'] = KIN[side + 'MTP']['tw']
 
-        data[side + 'TIBA_x'] = KIN[side + 'TibiaLab']['flx']
-        data[side + 'TIBA_y'] = KIN[side + 'TibiaLab']['abd']
-        data[side + 'TIBA_z'] = KIN[side + 'TibiaLab']['tw']
+def stream_markers(version='1.0'):
+    """ list of markers required to process a frame with openOFM version"""
+    markers = []
+    if version == '1.0':
+        markers += PELVIS_MARKERS
+    for side in ['R', 'L']:
+        if version == '1.0':
+            markers += [side + mrk for mrk in PIG_MARKERS]
+        markers += [side + mrk for mrk in FOOT_MARKERS if side + mrk not in markers]
+    return markers
 
-        data[side + 'FFTBA_x'] = KIN[side + 'FFTBA']['flx']
-        data[side + 'FFTBA_y'] = KIN[side + 'FFTBA']['tw']
-        data[side + 'FFTBA_z'] = KIN[side + 'FFTBA']['abd']
 
-    return data
+def stream_angles():
+    """ list of the angle channels emitted by openOFM_stream.process_frames (x, y, z components of each side)"""
+    return [side + angle for side in ['Right', 'Left'] for angle in ANGLE_JOINTS]
 
 
-def getDir(data, ch=None):
-    """ get direction of movement based on marker ch"""
+def getDir(data, ch=None, stats=None):
+    """ get direction of movement based on marker ch
+
+    Arguments:
+        data    ... dict, trial data
+        ch      ... str, Default = None. Marker used to find the direction. If None, the PiG pelvis markers or
+                    the PCA marker are used
+        stats   ... dict, Default = None. Running statistics (see init_running_stats). If None, the direction
+                    is found from the first and last frames in data. Else, stats['direction'] is returned if
+                    set, otherwise the first frame seen so far is compared to the last frame of data. While the
+                    distance travelled is below stats['min_travel'], stats['fallback_direction'] is returned
+                    if set
+    Returns:
+        walkDir ... str, direction of movement 'Ipos', 'Ineg', 'Jpos' or 'Jneg'
+    """
+    if stats is not None and stats['direction'] is not None:
+        return stats['direction']
 
     # use PiG pelvis marker or inputted channel
     if ch is None:
@@ -110,10 +173,17 @@ def getDir(data, ch=None):
     else:
         vec = data[ch]
 
+    if stats is not None:
+        vec = running_ends(vec, stats, 'direction')
+
     # Determine if most of motion is along global X or Y
     X = abs(vec[0, 0] - vec[-1, 0])
     Y = abs(vec[0, 1] - vec[-1, 1])
 
+    # e.g. first frames of a stream or walking on a treadmill
+    if stats is not None and stats['fallback_direction'] is not None and not max(X, Y) >= stats['min_travel']:
+        return stats['fallback_direction']
+
     if Y > X:  # moving along Y
         axis = 'J'
         dim = 1
@@ -138,6 +208,40 @@ def getDir(data, ch=None):
     return walkDir
 
 
+def running_ends(vec, stats, key):
+    """ helper function to track the first and last frames of marker vec over blocks of frames
+
+    Arguments:
+        vec     ... n x 3 array, marker for the current block of frames
+        stats   ... dict, running statistics (see init_running_stats)
+        key     ... str, name of the marker in stats
+    Returns:
+        ends    ... 4 x 3 array, first frame seen so far, first valid frame (per coordinate), last valid frame
+                    (per coordinate) and last frame seen so far
+
+    Notes:
+        - the first and last frames are kept as is, valid frames ignore NaN (gaps) as in getDir
+    """
+    valid = ~np.isnan(vec)
+    first_valid = np.full(3, np.nan)
+    last_valid = np.full(3, np.nan)
+    for i in range(3):
+        indx = np.flatnonzero(valid[:, i])
+        if len(indx):
+            first_valid[i] = vec[indx[0], i]
+            last_valid[i] = vec[indx[-1], i]
+
+    if key in stats['ends'] and stats['update']:
+        ends = stats['ends'][key]
+        first_valid = np.where(np.isnan(ends[1]), first_valid, ends[1])
+        last_valid = np.where(np.isnan(last_valid), ends[2], last_valid)
+        stats['ends'][key] = np.vstack((ends[0], first_valid, last_valid, vec[-1]))
+    elif key not in stats['ends']:
+        stats['ends'][key] = np.vstack((vec[0], first_valid, last_valid, vec[-1]))
+
+    return stats['ends'][key]
+
+
 def getDirStat(data, ch=None):
     """ get direction of standing based on foot markers"""
 
@@ -172,6 +276,96 @@ def getDirStat(data, ch=None):
     return standDir
 
 
+def init_direction(stats, settings, sdata=None):
+    """ set how getDir finds the direction of motion from the running statistics stats
+
+    Arguments:
+        stats       ... dict, running statistics (see init_running_stats), updated in place
+        settings    ... dict, settings with optional keys 'direction' ('Ipos', 'Ineg', 'Jpos' or 'Jneg', fixes the
+                        direction of motion), 'min_travel' (distance (mm) the pelvis must travel before the direction
+                        is estimated from it, see MIN_TRAVEL) and 'static_name' (name of the static trial in
+                        settings['data_dir'], Default = 'static.c3d')
+        sdata       ... dict, Default = None. Static trial. If None, the markers of getDirStat are read from the
+                        static trial, if it exists
+    Returns:
+        stats       ... dict, with the direction of motion, or the direction the subject faced in the static trial
+                        as the fallback until the pelvis has travelled min_travel
+
+    Notes:
+        - on a treadmill the pelvis hardly travels, the direction of motion is then the direction the subject
+        faced in the static trial
+    """
+    stats['direction'] = settings.get('direction')
+    stats['min_travel'] = settings.get('min_travel', MIN_TRAVEL)
+    if stats['direction'] is not None:
+        return stats
+
+    if sdata is None and not settings.get('nexus') and 'data_dir' in settings:
+        fl = os.path.join(find_repo_root(os.path.dirname(__file__)), settings['data_dir'],
+                          settings.get('static_name', 'static.c3d'))
+        if os.path.isfile(fl):
+            sdata = c3d_to_dict(fl, markers=STAND_MARKERS, mmap=True)
+    if sdata is not None and all(mrk in sdata for mrk in STAND_MARKERS):
+        stats['fallback_direction'] = getDirStat(sdata)
+
+    return stats
+
+
+def run_sides(fn, data, settings=None, parallel=False, sides=None):
+    """ run the computations of each side of the body, one after the other or concurrently
+
+    Arguments:
+        fn          ... callable, fn(data, side, settings) computes the channels of side ('R' or 'L') and returns
+                        data with the channels appended
+        data        ... dict, trial data
+        settings    ... dict, Default = None. Settings passed to fn
+        parallel    ... bool, Default = False. If true, the sides run concurrently in a thread pool
+        sides       ... list, Default = None. Sides to run. If None, ['R', 'L']
+    Returns:
+        data        ... dict, with the channels of every side appended
+
+    Notes:
+        - in parallel, each side works on a view of data (and of data['parameters']['PROCESSING'] and
+        settings['processing']): channels written by a side are kept in its view and only merged into data once
+        every side is done, so that data is never modified while the other side reads it
+        - sides only overlap while numpy releases the GIL, which the many small n x 3 operations of a side mostly
+        do not, see the parallel_sides stage of openOFM_benchmark for the measured speedup
+    """
+    if sides is None:
+        sides = ['R', 'L']
+
+    if not parallel:
+        for side in sides:
+            data = fn(data, side, settings)
+        return data
+
+    def run(side):
+        view = ChainMap({}, data)
+        if 'parameters' in data:
+            parameters = dict(data['parameters'])
+            parameters['PROCESSING'] = ChainMap({}, parameters.get('PROCESSING', {}))
+            view.maps[0]['parameters'] = parameters
+        view_settings = settings
+        if settings is not None and 'processing' in settings:
+            view_settings = dict(settings, processing=ChainMap({}, settings['processing']))
+        return fn(view, side, view_settings), view_settings
+
+    with ThreadPoolExecutor(max_workers=len(sides)) as pool:
+        results = list(pool.map(run, sides))
+
+    for view, view_settings in results:
+        written = view.maps[0]
+        for key, value in written.items():
+            if key == 'parameters':
+                data['parameters'].setdefault('PROCESSING', {}).update(value['PROCESSING'].maps[0])
+            else:
+                data[key] = value
+        if view_settings is not settings:
+            settings['processing'].update(view_settings['processing'].maps[0])
+
+    return data
+
+
 def get_data(settings):
     # extract settings
     trial_type = settings['trial_type']
@@ -192,15 +386,11 @@ def get_data(settings):
     print('Processing {}'.format(trial_type), 'file {}'.format(fl), 'with openOFM version {}.'.format(version))
 
     # 2.1 load c3d files to dictionary
-    data = c3d_to_dict(fl)
+    data = c3d_to_dict(fl, markers=settings.get('markers'), mmap=settings.get('mmap', False))
 
     # set settings from data if not already present
     if 'processing' not in settings:
-        settings['processing'] = dict(LHindFootFlat=data['parameters']['PROCESSING']['LHindFootFlat']['value'][0].astype(int),
-                                      RHindFootFlat=data['parameters']['PROCESSING']['RHindFootFlat']['value'][0].astype(int),
-                                      LUseFloorFF=data['parameters']['PROCESSING']['LUseFloorFF']['value'][0].astype(int),
-                                      RUseFloorFF=data['parameters']['PROCESSING']['RUseFloorFF']['value'][0].astype(int),
-                                      )
+        settings['processing'] = get_processing(data)
 
     # create empty 'PROCESSING' dict if the .c3d has not been processed at all previously
     if 'PROCESSING' not in data['parameters']:
@@ -222,30 +412,59 @@ def get_data(settings):
 
         if settings['use_settings']:
             print('Loading anthropometric values from settings dictionary')
-            data['parameters']['PROCESSING']['MarkerDiameter'] = {}
-            data['parameters']['PROCESSING']['MarkerDiameter']['value'] = settings['subject_params']['MarkerDiameter']
-            if settings['version'] == '1.0':
-                data['parameters']['PROCESSING']['InterAsisDistance']['value'] = settings['subject_params']['InterAsisDistance']
-                data['parameters']['PROCESSING']['RLegLength']['value'] = settings['subject_params']['RLegLength']
-                data['parameters']['PROCESSING']['LLegLength']['value'] = settings['subject_params']['LLegLength']
-                data['parameters']['PROCESSING']['RKneeWidth']['value'] = settings['subject_params']['RKneeWidth']
-                data['parameters']['PROCESSING']['LKneeWidth']['value'] = settings['subject_params']['LKneeWidth']
-                data['parameters']['PROCESSING']['RAnkleWidth']['value'] = settings['subject_params']['RAnkleWidth']
-                data['parameters']['PROCESSING']['LAnkleWidth']['value'] = settings['subject_params']['LAnkleWidth']
-                data['parameters']['PROCESSING']['RThighRotation']['value'] = settings['subject_params'][
-                    'RThighRotation']
-                data['parameters']['PROCESSING']['LThighRotation']['value'] = settings['subject_params'][
-                    'LThighRotation']
-                data['parameters']['PROCESSING']['RShankRotation']['value'] = settings['subject_params'][
-                    'RShankRotation']
-                data['parameters']['PROCESSING']['LShankRotation']['value'] = settings['subject_params'][
-                    'LShankRotation']
+            data = set_subject_params(data, settings)
         else:
             print('Loading anthropometric values from {}'.format(fl))
 
     return data, settings
 
 
+def get_processing(data):
+    """ helper function to read the processing options (flat hindfoot, floor for forefoot) of a c3d file"""
+    processing = dict(LHindFootFlat=data['parameters']['PROCESSING']['LHindFootFlat']['value'][0].astype(int),
+                      RHindFootFlat=data['parameters']['PROCESSING']['RHindFootFlat']['value'][0].astype(int),
+                      LUseFloorFF=data['parameters']['PROCESSING']['LUseFloorFF']['value'][0].astype(int),
+                      RUseFloorFF=data['parameters']['PROCESSING']['RUseFloorFF']['value'][0].astype(int),
+                      )
+    return processing
+
+
+def get_calibration(sdata):
+    """ helper function to build the parameters of a dynamic trial from a static trial processed by
+    create_virtual_markers, as they would be read back from parameters.txt by get_data"""
+    parameters = {'PROCESSING': {}}
+    for key, value in sdata['parameters']['PROCESSING'].items():
+        if 'openOFM' in key and not isinstance(value, dict):
+            value = {'value': float(value)}
+        parameters['PROCESSING'][key] = value
+
+    return parameters
+
+
+def set_subject_params(data, settings):
+    """ helper function to overwrite the anthropometric values of data with those of settings['subject_params']"""
+    data['parameters']['PROCESSING']['MarkerDiameter'] = {}
+    data['parameters']['PROCESSING']['MarkerDiameter']['value'] = settings['subject_params']['MarkerDiameter']
+    if settings['version'] == '1.0':
+        data['parameters']['PROCESSING']['InterAsisDistance']['value'] = settings['subject_params']['InterAsisDistance']
+        data['parameters']['PROCESSING']['RLegLength']['value'] = settings['subject_params']['RLegLength']
+        data['parameters']['PROCESSING']['LLegLength']['value'] = settings['subject_params']['LLegLength']
+        data['parameters']['PROCESSING']['RKneeWidth']['value'] = settings['subject_params']['RKneeWidth']
+        data['parameters']['PROCESSING']['LKneeWidth']['value'] = settings['subject_params']['LKneeWidth']
+        data['parameters']['PROCESSING']['RAnkleWidth']['value'] = settings['subject_params']['RAnkleWidth']
+        data['parameters']['PROCESSING']['LAnkleWidth']['value'] = settings['subject_params']['LAnkleWidth']
+        data['parameters']['PROCESSING']['RThighRotation']['value'] = settings['subject_params'][
+            'RThighRotation']
+        data['parameters']['PROCESSING']['LThighRotation']['value'] = settings['subject_params'][
+            'LThighRotation']
+        data['parameters']['PROCESSING']['RShankRotation']['value'] = settings['subject_params'][
+            'RShankRotation']
+        data['parameters']['PROCESSING']['LShankRotation']['value'] = settings['subject_params'][
+            'LShankRotation']
+
+    return data
+
+
 def set_data(data, settings):
     # 1.0 get path to c3d files
     ROOT_DIR = find_repo_root(os.path.dirname(__file__))
@@ -262,9 +481,59 @@ def set_data(data, settings):
             print(key, '=', value, file=f)
 
 
+def set_precision(data, precision='float64'):
+    """ casts the markers and the PROCESSING parameters of a trial to the floating point type of the computations
+
+    Arguments:
+        data        ... dict, trial data
+        precision   ... str, Default = 'float64'. 'float64' or 'float32' (see PRECISIONS)
+    Returns:
+        data        ... dict, with n x 3 markers and numeric parameters of type precision
+
+    Notes:
+        - numpy keeps the type of its inputs, so markers and parameters of type float32 run the joint centres,
+        virtual markers, segments and kinematics in float32, halving the memory and bandwidth of every array
+        - markers are only accurate to about 0.1 mm, well within float32, but angles differ from the float64 path
+        by the rounding errors of the computations, see openOFM_validate.py --precision
+        - integer parameters (e.g. processing options) and parameters that are not numbers are left untouched
+    """
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision {}, must be one of {}'.format(precision, list(PRECISIONS)))
+    dtype = PRECISIONS[precision]
+
+    for key, value in data.items():
+        if isinstance(value, np.ndarray) and value.ndim == 2 and value.dtype.kind == 'f' and value.dtype != dtype:
+            data[key] = value.astype(dtype)
+
+    processing = data.get('parameters', {}).get('PROCESSING', {})
+    for key, param in processing.items():
+        value = param.get('value') if isinstance(param, dict) else param
+        if isinstance(value, (float, np.floating)) or (isinstance(value, np.ndarray) and value.dtype.kind == 'f'):
+            value = np.asarray(value, dtype=dtype)
+            value = value[()] if value.ndim == 0 else value
+            if isinstance(param, dict):
+                param['value'] = value
+            else:
+                processing[key] = value
+
+    return data
+
+
+# result of the Nexus probe of is_nexus and its connection, reused by utils_nexus (see nexus_connection)
+_NEXUS = dict(checked=False, vicon=None)
+
+
 def is_nexus():
-    """ check if user is running openOFM via Vicon Nexus"""
+    """ check if user is running openOFM via Vicon Nexus
+
+    Notes:
+        - Nexus is probed once per process, the connection is kept for utils_nexus (see nexus_connection)
+    """
+    if _NEXUS['checked']:
+        return _NEXUS['vicon'] is not None
+
     import warnings
+    vicon = None
     try:
         # check if vicon api is installed
         from viconnexusapi import ViconNexus
@@ -276,53 +545,39 @@ def is_nexus():
             try:
                 # check if a trial with a subject is selected in Nexus
                 vicon.GetSubjectNames()[0]
-                nexus = True
 
             except IndexError:
                 warnings.warn('To use Vicon Nexus, select the trial in Nexus you wish to process.')
-                nexus = False
+                vicon = None
 
         except IOError:
             warnings.warn('To use Vicon Nexus, open Nexus and select the  trial you wish to process')
-            nexus = False
+            vicon = None
 
     except ModuleNotFoundError:
-        nexus = False
+        vicon = None
 
-    if nexus:
+    _NEXUS.update(checked=True, vicon=vicon)
+    if vicon is not None:
         print('running openOFM via Vicon Nexus...')
     else:
         print('running openOFM via python...')
 
-    return nexus
-
+    return vicon is not None
 
-def get_settings():
-
-    import warnings
-    try:
-        # check if vicon api is installed
-        from viconnexusapi import ViconNexus
 
-        try:
-            # check if Nexus is open, and api is installed
-            vicon = ViconNexus.ViconNexus()
+def nexus_connection():
+    """ helper function to get the connection to Nexus opened by is_nexus (None if Nexus was not found)"""
+    return _NEXUS['vicon']
 
-            try:
-                # check if a trial with a subject is selected in Nexus
-                vicon.GetSubjectNames()[0]
-                nexus = True
 
-            except IndexError:
-                warnings.warn('To use Vicon Nexus, select the trial in Nexus you wish to process.')
-                nexus = False
+def reset_nexus():
+    """ helper function to forget the result of the Nexus probe, so that is_nexus probes Nexus again"""
+    _NEXUS.update(checked=False, vicon=None)
 
-        except IOError:
-            warnings.warn('To use Vicon Nexus, open Nexus and select the  trial you wish to process')
-            nexus = False
 
-    except ModuleNotFoundError:
-        nexus = False
+def get_settings():
+    nexus = is_nexus()
 
     if nexus:
         import sys
@@ -390,3 +645,27 @@ def get_nrmse(data_raw, data_processed):
             round(nrmse(data_processed[s + 'ArchHeight'][:, 2], data_raw[s + 'ArchHeight'][:, 2]), 4))
 
     return data_raw
+
+
+def get_jc_error(data_raw, data_processed):
+    """ compares openOFM PiG joint centres to the joint centres computed by Vicon
+
+    Arguments:
+        data_raw        ... dict, openOFM processed dynamic trial containing R/LHipJC, R/LKneeJC and R/LAnkleJC
+        data_processed  ... dict, Vicon processed dynamic trial (e.g. dynamic_processed.c3d)
+    Returns:
+        data_raw        ... dict, with mean and max euclidean distance (mm) appended as e.g. 'jcerrorRHipJC'
+
+    Notes:
+        - Vicon joint centres are the hip joint centre (HJC) and the origins of the femur (FEO, knee joint centre)
+        and tibia (TIO, ankle joint centre) segments
+    """
+    jcs = {'HipJC': 'HJC', 'KneeJC': 'FEO', 'AnkleJC': 'TIO'}
+    for s in ['R', 'L']:
+        for jc, vicon_jc in jcs.items():
+            if s + jc not in data_raw or s + vicon_jc not in data_processed:
+                continue
+            err = magnitude(data_raw[s + jc] - data_processed[s + vicon_jc])
+            data_raw['jcerror' + s + jc] = {'mean': np.nanmean(err), 'max': np.nanmax(err)}
+
+    return data_raw
@@ -0,0 +1,204 @@
+import numpy as np
+from utils.utils_gait import CYCLE_POINTS
+
+# bin edges (deg) of the histograms used as quantile sketches, values outside the edges are counted in the first
+# and last bins
+QUANTILE_BINS = np.arange(-180.0, 180.25, 0.25)
+
+# quantiles reported by aggregate_stats when the aggregate keeps quantile sketches
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def init_aggregate(channels, points=CYCLE_POINTS, sketch=False, bins=None):
+    """ creates an empty aggregate of time-normalised curves over trials
+
+    Arguments:
+        channels    ... list, names of the channels (e.g. 'RightFFHFA_x')
+        points      ... int, Default = CYCLE_POINTS. Points per cycle
+        sketch      ... bool, Default = False. If true, keeps a histogram of each channel and point to estimate
+                        quantiles (see aggregate_stats)
+        bins        ... array, Default = None. Bin edges of the histograms. If None, QUANTILE_BINS
+    Returns:
+        agg         ... dict, running statistics of each channel and point: number of values 'n', 'mean', sum of
+                        squared differences to the mean 'm2', 'min', 'max' and histogram 'hist' (or None)
+
+    Notes:
+        - memory does not depend on the number of trials or cycles aggregated
+    """
+    k = len(channels)
+    agg = dict(channels=list(channels), n=np.zeros((k, points), dtype=np.int64), mean=np.zeros((k, points)),
+               m2=np.zeros((k, points)), min=np.full((k, points), np.inf), max=np.full((k, points), -np.inf),
+               bins=None, hist=None)
+    if sketch:
+        agg['bins'] = np.asarray(QUANTILE_BINS if bins is None else bins, dtype=float)
+        agg['hist'] = np.zeros((k, points, len(agg['bins']) + 1), dtype=np.int32)
+    return agg
+
+
+def update_aggregate(agg, cycles, channels=None):
+    """ adds the cycles of a trial to an aggregate
+
+    Arguments:
+        agg         ... dict, aggregate (see init_aggregate)
+        cycles      ... c x k x points array, time-normalised cycles (see normalise_angles)
+        channels    ... list, Default = None. Names of the k channels of cycles. If None, the channels of agg
+    Returns:
+        agg         ... dict, updated aggregate
+
+    Notes:
+        - the cycles are summarised (count, mean, squared differences) and combined with the running statistics
+        with the parallel form of Welford's algorithm (Chan et al. 1979), NaN values are skipped
+        - channels of cycles that are not in agg are ignored
+    """
+    cycles = np.asarray(cycles, dtype=float)
+    if channels is None:
+        rows = np.arange(len(agg['channels']))
+        cols = rows
+    else:
+        index = {ch: i for i, ch in enumerate(agg['channels'])}
+        cols = np.array([i for i, ch in enumerate(channels) if ch in index], dtype=int)
+        rows = np.array([index[channels[i]] for i in cols], dtype=int)
+    if cycles.shape[0] == 0 or len(rows) == 0:
+        return agg
+    cycles = cycles[:, cols]
+
+    valid = ~np.isnan(cycles)
+    n = valid.sum(axis=0)
+    total = np.where(valid, cycles, 0).sum(axis=0)
+    mean = np.divide(total, n, out=np.zeros(n.shape), where=n > 0)
+    m2 = np.where(valid, (cycles - mean) ** 2, 0).sum(axis=0)
+    batch = dict(n=n, mean=mean, m2=m2, min=np.nanmin(np.where(valid, cycles, np.inf), axis=0),
+                 max=np.nanmax(np.where(valid, cycles, -np.inf), axis=0))
+    if agg['hist'] is not None:
+        batch['hist'] = histogram(cycles, valid, agg['bins'])
+
+    _combine(agg, rows, batch)
+
+    return agg
+
+
+def merge_aggregates(agg, other):
+    """ merges two aggregates of the same channels (e.g. from parallel workers) into agg
+
+    Arguments:
+        agg         ... dict, aggregate updated in place (see init_aggregate)
+        other       ... dict, aggregate to add. Channels of other missing in agg are ignored
+    Returns:
+        agg         ... dict, merged aggregate
+    """
+    index = {ch: i for i, ch in enumerate(agg['channels'])}
+    cols = np.array([i for i, ch in enumerate(other['channels']) if ch in index], dtype=int)
+    rows = np.array([index[other['channels'][i]] for i in cols], dtype=int)
+    if len(rows) == 0:
+        return agg
+
+    batch = {key: other[key][cols] for key in ['n', 'mean', 'm2', 'min', 'max']}
+    if agg['hist'] is not None:
+        if other['hist'] is None or not np.array_equal(agg['bins'], other['bins']):
+            raise ValueError('aggregates with quantile sketches can only be merged with the same bins')
+        batch['hist'] = other['hist'][cols]
+
+    _combine(agg, rows, batch)
+
+    return agg
+
+
+def _combine(agg, rows, batch):
+    """ helper function to combine the statistics of batch into the rows of agg (Chan et al. 1979)"""
+    na = agg['n'][rows]
+    nb = batch['n']
+    n = na + nb
+    delta = batch['mean'] - agg['mean'][rows]
+    ratio = np.divide(nb, n, out=np.zeros(n.shape), where=n > 0)
+    agg['mean'][rows] += delta * ratio
+    agg['m2'][rows] += batch['m2'] + delta ** 2 * na * ratio
+    agg['n'][rows] = n
+    agg['min'][rows] = np.minimum(agg['min'][rows], batch['min'])
+    agg['max'][rows] = np.maximum(agg['max'][rows], batch['max'])
+    if agg['hist'] is not None:
+        agg['hist'][rows] += batch['hist']
+
+
+def histogram(cycles, valid, bins):
+    """ helper function to count the values of each channel and point in bins, for every channel and point at once"""
+    _, k, points = cycles.shape
+    nb = len(bins) + 1
+    idx = np.searchsorted(bins, np.where(valid, cycles, 0), side='right')
+    flat = (np.arange(k)[:, np.newaxis] * points + np.arange(points)) * nb + idx
+    counts = np.bincount(flat[valid], minlength=k * points * nb)
+    return counts.reshape(k, points, nb)
+
+
+def aggregate_stats(agg, quantiles=QUANTILES):
+    """ statistics of each channel and point of an aggregate
+
+    Arguments:
+        agg         ... dict, aggregate (see init_aggregate)
+        quantiles   ... tuple, Default = QUANTILES. Quantiles to estimate if agg keeps quantile sketches
+    Returns:
+        stats       ... dict, k x points arrays 'n', 'mean', 'var' (sample variance), 'std', 'min' and 'max' (NaN
+                        where n is 0), and 'quantiles', a q x k x points array (if agg keeps quantile sketches)
+
+    Notes:
+        - quantiles are interpolated linearly within the bins of the histograms, their precision is the width of
+        the bins
+    """
+    n = agg['n']
+    empty = n == 0
+    var = np.divide(agg['m2'], n - 1, out=np.full(n.shape, np.nan), where=n > 1)
+    stats = dict(channels=list(agg['channels']), n=n.copy(), mean=np.where(empty, np.nan, agg['mean']), var=var,
+                 std=np.sqrt(var), min=np.where(empty, np.nan, agg['min']), max=np.where(empty, np.nan, agg['max']))
+
+    if agg['hist'] is not None:
+        stats['quantiles'] = np.array([sketch_quantile(agg, q) for q in quantiles])
+        stats['quantile_levels'] = np.array(quantiles)
+
+    return stats
+
+
+def sketch_quantile(agg, q):
+    """ helper function to estimate a quantile of each channel and point from the histograms of an aggregate"""
+    hist = agg['hist']
+    bins = agg['bins']
+    n = agg['n']
+    cum = np.cumsum(hist, axis=-1)
+    target = q * n
+    idx = np.argmax(cum >= target[..., np.newaxis], axis=-1)
+    below = np.take_along_axis(cum, idx[..., np.newaxis], axis=-1)[..., 0] - \
+        np.take_along_axis(hist, idx[..., np.newaxis], axis=-1)[..., 0]
+    count = np.take_along_axis(hist, idx[..., np.newaxis], axis=-1)[..., 0]
+    frac = np.divide(target - below, count, out=np.zeros(n.shape), where=count > 0)
+
+    # bin idx spans bins[idx - 1] to bins[idx], the first and last bins span to the min and max
+    lower = np.where(idx > 0, bins[np.clip(idx - 1, 0, len(bins) - 1)], agg['min'])
+    upper = np.where(idx < len(bins), bins[np.clip(idx, 0, len(bins) - 1)], agg['max'])
+    lower = np.where(n > 0, np.maximum(lower, agg['min']), np.nan)
+    upper = np.where(n > 0, np.minimum(upper, agg['max']), np.nan)
+
+    return lower + frac * (upper - lower)
+
+
+def save_aggregate(agg, fl):
+    """ saves an aggregate (to merge or update later, see load_aggregate) and its statistics to fl (.npz)"""
+    arrays = {key: agg[key] for key in ['n', 'mean', 'm2', 'min', 'max']}
+    arrays['channels'] = np.array(agg['channels'])
+    if agg['hist'] is not None:
+        arrays['hist'] = agg['hist']
+        arrays['bins'] = agg['bins']
+    stats = aggregate_stats(agg)
+    for key in ['var', 'std', 'quantiles', 'quantile_levels']:
+        if key in stats:
+            arrays['stats_' + key] = stats[key]
+
+    np.savez(fl, **arrays)
+    print('Saving aggregate of {} channels to {}'.format(len(agg['channels']), fl))
+
+
+def load_aggregate(fl):
+    """ loads an aggregate saved with save_aggregate"""
+    with np.load(fl) as f:
+        agg = {key: f[key] for key in ['n', 'mean', 'm2', 'min', 'max']}
+        agg['channels'] = [str(ch) for ch in f['channels']]
+        agg['hist'] = f['hist'] if 'hist' in f.files else None
+        agg['bins'] = f['bins'] if 'bins' in f.files else None
+    return agg
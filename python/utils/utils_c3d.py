@@ -0,0 +1,341 @@
+import os
+import numpy as np
+
+# processor types stored in the 4th byte of the parameter section
+PROCESSOR_INTEL = 84
+PROCESSOR_DEC = 85
+PROCESSOR_MIPS = 86
+
+# frames written by ezc3d at once (see write_c3d)
+WRITE_CHUNK_FRAMES = 50000
+
+
+def c3d_memmap(fl):
+    """ memory-map the point block of the c3d file located at fl without reading it
+
+    Arguments:
+        fl          ... str, full path to c3d file
+    Returns:
+        points      ... array, frames x markers x 4 view on the point block (X, Y, Z, residual word) in the
+                        storage type of the file (float32 or int16, not scaled)
+        labels      ... list, marker names in the order of the point block
+        parameters  ... dict, c3d parameters organised as in ezc3d, e.g. parameters['POINT']['RATE']['value']
+        header      ... dict, basic information on the trial (frames, first_frame, rate, scale, processor) and
+                        on the point block (data_offset in bytes from the start of the file, frame_bytes per frame)
+
+    Notes:
+        - Intel and MIPS files are mapped without copying. DEC (VAX) floats do not have a numpy dtype and
+        are converted to IEEE floats when read (see c3d_to_dict_mmap)
+        - the analog block is part of each frame record but is never read
+    """
+    with open(fl, 'rb') as f:
+        block = f.read(512)
+        param_block = block[0]
+        f.seek((param_block - 1) * 512)
+        param_header = f.read(4)
+        processor = param_header[3]
+        f.seek((param_block - 1) * 512)
+        param_bytes = f.read(param_header[2] * 512)
+
+    endian = '>' if processor == PROCESSOR_MIPS else '<'
+    words = np.frombuffer(block[:20], dtype=endian + 'i2')
+    n_points = int(words[1])
+    analog_words = int(words[2])
+    first_frame = int(words[3])
+    last_frame = int(words[4])
+    data_start = int(words[8])
+    scale = _read_float(block[12:16], processor)
+    rate = _read_float(block[20:24], processor)
+
+    parameters = read_c3d_parameters(param_bytes, processor)
+
+    # parameters take precedence over header as header words overflow for long trials
+    point = parameters.get('POINT', {})
+    if 'USED' in point:
+        n_points = int(point['USED']['value'][0]) & 0xFFFF
+    if 'DATA_START' in point:
+        data_start = int(point['DATA_START']['value'][0]) & 0xFFFF
+    if 'SCALE' in point:
+        scale = float(point['SCALE']['value'][0])
+    n_frames = last_frame - first_frame + 1
+    if 'FRAMES' in point:
+        frames = point['FRAMES']['value'][0]
+        n_frames = int(frames) if point['FRAMES']['type'] == 4 else int(frames) & 0xFFFF
+    if 'TRIAL' in parameters and 'ACTUAL_END_FIELD' in parameters['TRIAL']:
+        # start and end frame are stored as two 16-bit words
+        start = parameters['TRIAL']['ACTUAL_START_FIELD']['value']
+        end = parameters['TRIAL']['ACTUAL_END_FIELD']['value']
+        first_frame = (int(start[0]) & 0xFFFF) + ((int(start[1]) & 0xFFFF) << 16)
+        last_frame = (int(end[0]) & 0xFFFF) + ((int(end[1]) & 0xFFFF) << 16)
+        n_frames = last_frame - first_frame + 1
+
+    # each frame stores 4 words per marker followed by the analog samples of the frame
+    if scale < 0:
+        word = endian + 'f4' if processor != PROCESSOR_DEC else '<u4'
+    else:
+        word = endian + 'i2'
+    frame_dtype = np.dtype([('points', word, (n_points, 4)), ('analogs', word, (analog_words,))])
+
+    # do not map past the end of truncated files
+    size = os.path.getsize(fl) - (data_start - 1) * 512
+    n_frames = min(n_frames, size // frame_dtype.itemsize)
+
+    record = np.memmap(fl, dtype=frame_dtype, mode='r', offset=(data_start - 1) * 512, shape=(n_frames,))
+    points = record['points']
+
+    labels = []
+    for key in ['LABELS'] + ['LABELS' + str(i) for i in range(2, 100)]:
+        if key not in point:
+            break
+        labels += point[key]['value']
+    labels = labels[:n_points]
+
+    header = dict(frames=n_frames, first_frame=first_frame, rate=rate, scale=scale, processor=processor,
+                  data_offset=(data_start - 1) * 512, frame_bytes=frame_dtype.itemsize)
+
+    return points, labels, parameters, header
+
+
+def c3d_to_dict_mmap(fl, markers=None, frames=None, as_view=False, verbose=False):
+    """ convert c3d file located at fl into dictionary, reading only the requested markers and frames
+
+    Arguments:
+        fl          ... str, full path to c3d file
+        markers     ... list, Default = None. Marker names to load. If None, all markers are loaded.
+                        Missing markers are ignored
+        frames      ... tuple, Default = None. (start, stop) indices of the frames to load (0 = first frame of
+                        the trial, stop excluded). If None, all frames are loaded
+        as_view     ... bool, Default = False. If true, markers are n x 3 read-only views on the memory-mapped
+                        file (float32 or int16 in storage units, invalid points are not masked). If false,
+                        markers are copied to float64 in mm with invalid points set to NaN (as in c3d_to_dict)
+        verbose     ... bool, Default = False. If true, information about processing printed to screen
+    Returns:
+        data        ... dict, c3d file with markers as keys and coordinates as values
+
+    Notes:
+        - memory use and load time depend on the markers and frames requested, not on the size of the file
+        - analog channels are never loaded
+    """
+    if verbose:
+        print('converting c3d to dict (memory-mapped) for: {}'.format(fl))
+
+    points, labels, parameters, header = c3d_memmap(fl)
+    if frames is not None:
+        points = points[frames[0]:frames[1]]
+
+    if markers is None:
+        markers = labels
+
+    data = {}
+    index = {label: i for i, label in enumerate(labels)}
+    for marker in markers:
+        if marker not in index:
+            continue
+        mrk = points[:, index[marker], :]
+        if as_view:
+            data[marker] = mrk[:, 0:3]
+        else:
+            data[marker] = _to_mm(mrk, header)
+
+    data['parameters'] = parameters
+    data['header'] = header
+
+    return data
+
+
+def read_c3d_parameters(param_bytes, processor=PROCESSOR_INTEL):
+    """ parse the parameter section of a c3d file
+
+    Arguments:
+        param_bytes ... bytes, parameter section (starting with the 4 byte parameter header)
+        processor   ... int, processor type (84 Intel, 85 DEC, 86 MIPS)
+    Returns:
+        parameters  ... dict, parameters organised by group as in ezc3d, each parameter is a dict with keys
+                        'type', 'description', 'is_locked' and 'value'
+    """
+    endian = '>' if processor == PROCESSOR_MIPS else '<'
+    groups = {}
+    params = []
+    i = 4
+    while i < len(param_bytes) - 2:
+        n_chars = np.frombuffer(param_bytes, dtype='i1', count=1, offset=i)[0]
+        group_id = np.frombuffer(param_bytes, dtype='i1', count=1, offset=i + 1)[0]
+        if n_chars == 0 or group_id == 0:
+            break
+        is_locked = bool(n_chars < 0)
+        n_chars = abs(int(n_chars))
+        name = param_bytes[i + 2:i + 2 + n_chars].decode('latin-1')
+        j = i + 2 + n_chars
+        offset = int(np.frombuffer(param_bytes, dtype=endian + 'i2', count=1, offset=j)[0])
+        next_i = j + offset
+        j += 2
+
+        if group_id < 0:
+            desc_len = param_bytes[j]
+            desc = param_bytes[j + 1:j + 1 + desc_len].decode('latin-1')
+            groups[-group_id] = (name, {'__METADATA__': {'DESCRIPTION': desc, 'IS_LOCKED': is_locked}})
+        else:
+            dtype = int(np.frombuffer(param_bytes, dtype='i1', count=1, offset=j)[0])
+            n_dims = param_bytes[j + 1]
+            dims = list(param_bytes[j + 2:j + 2 + n_dims])
+            j += 2 + n_dims
+            count = int(np.prod(dims)) if n_dims else 1
+            n_bytes = abs(dtype) * count
+            value = _read_value(param_bytes[j:j + n_bytes], dtype, dims, processor)
+            j += n_bytes
+            desc_len = param_bytes[j]
+            desc = param_bytes[j + 1:j + 1 + desc_len].decode('latin-1')
+            params.append((group_id, name, {'type': dtype, 'description': desc, 'is_locked': is_locked,
+                                            'value': value}))
+
+        if offset == 0:
+            break
+        i = next_i
+
+    parameters = {}
+    for group_id in sorted(groups):
+        name, group = groups[group_id]
+        parameters[name] = group
+    for group_id, name, param in params:
+        if group_id in groups:
+            parameters[groups[group_id][0]][name] = param
+
+    return parameters
+
+
+def _read_value(raw, dtype, dims, processor):
+    """ helper function to decode the value of a c3d parameter"""
+    if dtype == -1:
+        # character data, first dimension is the length of each string
+        if len(dims) == 0:
+            return [raw.decode('latin-1').strip()]
+        length = dims[0]
+        n = int(np.prod(dims[1:])) if len(dims) > 1 else 1
+        return [raw[k * length:(k + 1) * length].decode('latin-1').strip() for k in range(n)]
+
+    endian = '>' if processor == PROCESSOR_MIPS else '<'
+    if dtype == 1:
+        value = np.frombuffer(raw, dtype='i1').astype(int)
+    elif dtype == 2:
+        value = np.frombuffer(raw, dtype=endian + 'i2').astype(int)
+    elif dtype == 4:
+        value = _dec_to_ieee(raw) if processor == PROCESSOR_DEC else np.frombuffer(raw, dtype=endian + 'f4')
+        value = value.astype(float)
+    else:
+        raise IOError('unknown c3d parameter type {}'.format(dtype))
+
+    if len(dims) > 1:
+        value = value.reshape(dims, order='F')
+    return value
+
+
+def _read_float(raw, processor):
+    """ helper function to read a single float from the header"""
+    if processor == PROCESSOR_DEC:
+        return float(_dec_to_ieee(raw)[0])
+    endian = '>' if processor == PROCESSOR_MIPS else '<'
+    return float(np.frombuffer(raw, dtype=endian + 'f4')[0])
+
+
+def _dec_to_ieee(raw):
+    """ helper function to convert DEC (VAX F) floats to IEEE floats"""
+    words = np.frombuffer(raw, dtype='<u4') if isinstance(raw, bytes) else np.asarray(raw, dtype='<u4')
+    swapped = ((words & 0xFFFF) << 16) | (words >> 16)
+    return swapped.view('<f4') / 4
+
+
+def _to_mm(mrk, header):
+    """ helper function to copy an n x 4 memory-mapped marker to an n x 3 float64 array in mm with NaN gaps"""
+    if header['processor'] == PROCESSOR_DEC and header['scale'] < 0:
+        mrk = _dec_to_ieee(np.asarray(mrk)).reshape(mrk.shape)
+    xyz = np.array(mrk[:, 0:3], dtype=float)
+    residual = np.asarray(mrk[:, 3], dtype=float)
+    if header['scale'] > 0:
+        xyz *= header['scale']
+
+    # negative residual words flag invalid points
+    xyz[residual < 0, :] = np.nan
+    return xyz
+
+
+def write_c3d(data, fl, rate=None, chunk_frames=None):
+    """ write the markers and processing parameters of a data dict (as returned by c3d_to_dict) to a c3d file
+
+    Arguments:
+        data        ... dict, markers as keys and n x 3 arrays as values, optional keys 'parameters' and 'header'
+        fl          ... str, full path to c3d file
+        rate        ... float, Default = None. Frame rate in Hz. If None, the rate in data['header'] or 100 Hz
+        chunk_frames ... int, Default = None. Frames written by ezc3d at once. If None, WRITE_CHUNK_FRAMES
+
+    Notes:
+        - numeric PROCESSING parameters (anthropometrics, processing options, ...) are written, other groups are not
+        - NaN coordinates are written as invalid points (gaps)
+        - the number of frames is also stored in TRIAL:ACTUAL_START_FIELD and ACTUAL_END_FIELD, as the c3d header
+        only holds 16 bits
+        - ezc3d holds about 10 kB per frame while writing, longer trials are written chunk_frames at a time: the
+        frame records of each chunk, as written by ezc3d to a temporary file, are appended to the point block.
+        Trials longer than 65535 frames can only be read by c3d_to_dict_mmap
+    """
+    markers = [key for key, value in data.items() if isinstance(value, np.ndarray) and value.ndim == 2
+               and value.shape[1] == 3]
+    n = len(data[markers[0]])
+    if rate is None:
+        rate = data.get('header', {}).get('rate', 100.0)
+    if chunk_frames is None:
+        chunk_frames = WRITE_CHUNK_FRAMES
+
+    processing = data.get('parameters', {}).get('PROCESSING', {})
+    _write_ezc3d(data, markers, (0, min(n, chunk_frames)), n, rate, processing, fl)
+    if n <= chunk_frames:
+        return
+
+    # drop the padding of the last block before appending frames
+    header = c3d_memmap(fl)[3]
+    with open(fl, 'r+b') as f:
+        f.truncate(header['data_offset'] + header['frame_bytes'] * chunk_frames)
+
+    part = os.path.splitext(fl)[0] + '_part.c3d'
+    try:
+        for start in range(chunk_frames, n, chunk_frames):
+            stop = min(start + chunk_frames, n)
+            _write_ezc3d(data, markers, (start, stop), stop - start, rate, {}, part)
+            header = c3d_memmap(part)[3]
+            with open(part, 'rb') as f:
+                f.seek(header['data_offset'])
+                records = f.read(header['frame_bytes'] * (stop - start))
+            with open(fl, 'ab') as f:
+                f.write(records)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+    # pad the point block to whole 512-byte blocks
+    with open(fl, 'ab') as f:
+        f.write(bytes(-f.tell() % 512))
+
+
+def _write_ezc3d(data, markers, frames, n, rate, processing, fl):
+    """ helper function to write frames (start, stop) of the markers of data with ezc3d, n frames in TRIAL"""
+    import ezc3d
+
+    c3d = ezc3d.c3d()
+    c3d['parameters']['POINT']['RATE']['value'] = [rate]
+    c3d['parameters']['POINT']['LABELS']['value'] = markers
+    points = np.ones((4, len(markers), frames[1] - frames[0]))
+    for i, mrk in enumerate(markers):
+        points[0:3, i, :] = data[mrk][frames[0]:frames[1]].T
+    c3d['data']['points'] = points
+
+    # frame numbers are stored as two 16-bit words
+    words = [w - 65536 if w > 32767 else w for w in [n & 0xFFFF, n >> 16]]
+    c3d.add_parameter('TRIAL', 'ACTUAL_START_FIELD', [1, 0])
+    c3d.add_parameter('TRIAL', 'ACTUAL_END_FIELD', words)
+
+    for key, param in processing.items():
+        if not isinstance(param, dict) or 'value' not in param or key.startswith('__'):
+            continue
+        value = np.ravel(np.asarray(param['value']))
+        if value.dtype.kind in 'fiu':
+            c3d.add_parameter('PROCESSING', key, [float(v) for v in value])
+
+    c3d.write(fl)
@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# bump when the layout of the cache or the output of the readers changes
+CACHE_VERSION = '1'
+
+# environment variables controlling the cache
+CACHE_ENV = 'OPENOFM_CACHE'                 # set to 1 to enable the cache
+CACHE_DIR_ENV = 'OPENOFM_CACHE_DIR'         # location of the cache
+CACHE_SIZE_ENV = 'OPENOFM_CACHE_MAX_MB'     # maximum size of the cache
+
+DEFAULT_MAX_MB = 1024
+
+
+def cache_enabled():
+    """ check if the c3d cache is enabled via the OPENOFM_CACHE environment variable"""
+    return os.environ.get(CACHE_ENV, '').lower() in ['1', 'true', 'yes']
+
+
+def get_cache_dir():
+    """ returns the cache directory (OPENOFM_CACHE_DIR or ~/.cache/openOFM)"""
+    default = os.path.join(os.path.expanduser('~'), '.cache', 'openOFM')
+    return os.environ.get(CACHE_DIR_ENV, default)
+
+
+def cached_c3d_to_dict(fl, cache_dir=None, max_mb=None, mmap_mode='c', **kwargs):
+    """ load c3d file located at fl through a columnar sidecar cache
+
+    Arguments:
+        fl          ... str, full path to c3d file
+        cache_dir   ... str, Default = None. Cache location. If None, see get_cache_dir
+        max_mb      ... float, Default = None. Maximum size of the cache in MB, least recently used entries
+                        are evicted. If None, OPENOFM_CACHE_MAX_MB or 1024 MB
+        mmap_mode   ... str, Default = 'c'. Mode used to memory-map the cached arrays (see np.load). 'c' maps
+                        the arrays copy-on-write so that the cache is never modified. None loads them in memory
+        kwargs      ... additional arguments for c3d_to_dict (markers, frames, mmap)
+    Returns:
+        data        ... dict, as returned by c3d_to_dict
+
+    Notes:
+        - entries are keyed by the content of the file, the reader used, its options and CACHE_VERSION
+        - arrays are stored as .npy column blocks, parameters and header are stored as json
+    """
+    from utils.utils import c3d_to_dict
+
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if max_mb is None:
+        max_mb = float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_MB))
+
+    entry = os.path.join(cache_dir, cache_key(fl, **kwargs))
+    if os.path.isdir(entry):
+        try:
+            data = read_entry(entry, mmap_mode)
+            os.utime(entry)  # mark as recently used
+            return data
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+
+    data = c3d_to_dict(fl, cache=False, **kwargs)
+    write_entry(entry, data)
+    evict(cache_dir, max_mb)
+
+    return data
+
+
+def cache_key(fl, **kwargs):
+    """ helper function to build the cache key of file fl read with options kwargs"""
+    h = hashlib.sha1()
+    with open(fl, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    if kwargs.get('mmap', False):
+        reader = 'mmap'
+    else:
+        reader = 'ezc3d-' + _package_version('ezc3d')
+    options = json.dumps({k: kwargs[k] for k in sorted(kwargs)}, default=str)
+    h.update('{}|{}|{}'.format(CACHE_VERSION, reader, options).encode())
+
+    return h.hexdigest()
+
+
+def write_entry(entry, data):
+    """ helper function to write data dict to a cache entry
+
+    Notes:
+        - arrays of the same shape and type (e.g. all markers) are stacked in a single .npy column block so
+        that an entry is read with a few np.load calls, each array is a view on its block
+    """
+    tmp = entry + '.tmp{}'.format(os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    manifest = {'arrays': {}, 'meta': {}}
+    blocks = {}
+    for key, value in data.items():
+        if isinstance(value, np.ndarray):
+            blocks.setdefault((value.shape, value.dtype.str), []).append(key)
+        else:
+            manifest['meta'][key] = _encode(value)
+
+    for i, keys in enumerate(blocks.values()):
+        name = '{:04d}.npy'.format(i)
+        np.save(os.path.join(tmp, name), np.stack([data[key] for key in keys]))
+        for j, key in enumerate(keys):
+            manifest['arrays'][key] = [name, j]
+
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # another process wrote the same entry
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_entry(entry, mmap_mode='c'):
+    """ helper function to read a cache entry back into a data dict"""
+    with open(os.path.join(entry, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+
+    data = {}
+    blocks = {}
+    for key, (name, j) in manifest['arrays'].items():
+        if name not in blocks:
+            blocks[name] = np.load(os.path.join(entry, name), mmap_mode=mmap_mode)
+        data[key] = blocks[name][j]
+    for key, value in manifest['meta'].items():
+        data[key] = _decode(value)
+
+    return data
+
+
+def evict(cache_dir, max_mb):
+    """ remove least recently used cache entries until the cache is smaller than max_mb"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isdir(path) or '.tmp' in name:
+            continue
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def clear_cache(cache_dir=None):
+    """ remove all entries of the cache"""
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _encode(value):
+    """ helper function to convert parameters and header to json"""
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': value.dtype.str, 'shape': list(value.shape)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _decode(value):
+    """ helper function to convert json back to parameters and header"""
+    if isinstance(value, dict):
+        if '__ndarray__' in value:
+            return np.array(value['__ndarray__'], dtype=value['dtype']).reshape(value['shape'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _package_version(name):
+    """ helper function to get the installed version of a package without importing it"""
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return 'unknown'
@@ -0,0 +1,277 @@
+import os
+import json
+import numpy as np
+from utils.utils import find_repo_root
+
+# export formats and the extension of their files
+EXPORT_FORMATS = {'hdf5': '.h5', 'parquet': '.parquet'}
+
+# groups of channels that can be exported, raw markers are left out by default
+CHANNEL_GROUPS = ['kinematics', 'virtual_markers', 'segments', 'markers']
+DEFAULT_GROUPS = ['kinematics', 'virtual_markers', 'segments']
+
+# segment axes of each side (origin 0 and axes 1 to 3, e.g. RTIB0), see segments
+SEGMENT_FRAMES = ['TIB', 'LabTIB', 'HDF', 'FOF', 'HLX']
+
+# frames per chunk of the exported files (HDF5 chunks and Parquet row groups)
+EXPORT_CHUNK = 10000
+
+# compression of the exported files
+HDF5_COMPRESSION = 'gzip'
+PARQUET_COMPRESSION = 'zstd'
+
+
+def export_trial(data, fl, fmt=None, groups=None, channels=None, metadata=None):
+    """ exports the results of a processed trial to a compressed, chunked columnar file
+
+    Arguments:
+        data        ... dict, processed trial data
+        fl          ... str, full path to the file
+        fmt         ... str, Default = None. 'hdf5' or 'parquet'. If None, from the extension of fl
+        groups      ... list, Default = None. Groups of channels to export (see CHANNEL_GROUPS). If None,
+                        DEFAULT_GROUPS
+        channels    ... list, Default = None. Channels to export. If given, groups is ignored
+        metadata    ... dict, Default = None. Metadata of the trial (see trial_metadata)
+    Returns:
+        fl          ... str, full path to the file
+
+    Notes:
+        - channels are written EXPORT_CHUNK frames at a time (see init_export), so the export never copies
+        the whole trial
+    """
+    if channels is None:
+        channels = select_channels(data, groups)
+    n_frames = len(data[channels[0]]) if channels else 0
+
+    export = init_export(fl, fmt, metadata=metadata, parameters=data.get('parameters'))
+    for start in range(0, n_frames, EXPORT_CHUNK):
+        write_export(export, data, channels, frames=(start, min(start + EXPORT_CHUNK, n_frames)))
+    close_export(export)
+
+    return fl
+
+
+def init_export(fl, fmt=None, metadata=None, parameters=None):
+    """ opens a file to which results are written window by window
+
+    Arguments:
+        fl          ... str, full path to the file
+        fmt         ... str, Default = None. 'hdf5' or 'parquet'. If None, from the extension of fl
+        metadata    ... dict, Default = None. Metadata of the trial, stored as attributes (HDF5) or in the schema
+                        (Parquet)
+        parameters  ... dict, Default = None. Parameters of the trial, the PROCESSING parameters (subject
+                        measurements and calibration) are stored with the results
+    Returns:
+        export      ... dict, state of the export, to pass to write_export and close_export
+
+    Notes:
+        - HDF5: one dataset per channel under /channels (n x 3 for markers, n for angles), resizable and chunked
+        by EXPORT_CHUNK frames, parameters under /parameters and metadata as attributes of the root
+        - Parquet: one column per component (e.g. RTIB0_x) and a frame column, one row group per window,
+        metadata and parameters as json in the schema metadata. The schema is set by the first window
+    """
+    if fmt is None:
+        fmt = export_format(fl)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('unknown export format {}, must be one of {}'.format(fmt, list(EXPORT_FORMATS)))
+    metadata = {} if metadata is None else dict(metadata)
+    processing = processing_parameters(parameters)
+
+    folder = os.path.dirname(os.path.abspath(fl))
+    os.makedirs(folder, exist_ok=True)
+    export = dict(fl=fl, fmt=fmt, frames=0, metadata=metadata, parameters=processing, file=None)
+
+    if fmt == 'hdf5':
+        h5py = import_optional('h5py', 'HDF5')
+        f = h5py.File(fl, 'w')
+        for key, value in metadata.items():
+            f.attrs[key] = value if isinstance(value, (str, int, float)) else json.dumps(value)
+        grp = f.create_group('parameters')
+        for key, value in processing.items():
+            value = np.asarray(value)
+            if value.dtype.kind in 'US':
+                value = value.astype(h5py.string_dtype())
+            grp.create_dataset(key, data=value)
+        f.create_group('channels')
+        export['file'] = f
+    else:
+        import_optional('pyarrow', 'Parquet')
+
+    return export
+
+
+def write_export(export, data, channels, frames=None):
+    """ appends frames of channels to an export
+
+    Arguments:
+        export      ... dict, state of the export (see init_export)
+        data        ... dict, trial data or window of frames of a trial
+        channels    ... list, channels to write, the same for every window
+        frames      ... tuple, Default = None. (start, stop) frames of data to write. If None, all frames
+    Returns:
+        export      ... dict, updated state
+    """
+    if len(channels) == 0:
+        return export
+    if frames is None:
+        frames = (0, len(data[channels[0]]))
+    start, stop = frames
+    n = stop - start
+
+    if export['fmt'] == 'hdf5':
+        grp = export['file']['channels']
+        for ch in channels:
+            value = np.asarray(data[ch][start:stop], dtype=float)
+            if ch not in grp:
+                grp.create_dataset(ch, shape=(0,) + value.shape[1:], maxshape=(None,) + value.shape[1:],
+                                   dtype=float, chunks=(EXPORT_CHUNK,) + value.shape[1:],
+                                   compression=HDF5_COMPRESSION, shuffle=True)
+                grp[ch].attrs['group'] = channel_group(data, ch)
+            dset = grp[ch]
+            dset.resize(export['frames'] + n, axis=0)
+            dset[export['frames']:] = value
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {'frame': np.arange(export['frames'], export['frames'] + n)}
+        for ch in channels:
+            value = np.asarray(data[ch][start:stop], dtype=float)
+            if value.ndim == 1:
+                columns[ch] = value
+            else:
+                for i, axis in enumerate(['_x', '_y', '_z']):
+                    columns[ch + axis] = value[:, i]
+        table = pa.table(columns)
+        if export['file'] is None:
+            meta = dict(metadata=json.dumps(export['metadata']), parameters=json.dumps(export['parameters']),
+                        groups=json.dumps({ch: channel_group(data, ch) for ch in channels}))
+            schema = table.schema.with_metadata({'openOFM.' + key: value for key, value in meta.items()})
+            export['file'] = pq.ParquetWriter(export['fl'], schema, compression=PARQUET_COMPRESSION)
+        export['file'].write_table(table.replace_schema_metadata(export['file'].schema.metadata))
+
+    export['frames'] += n
+    return export
+
+
+def close_export(export):
+    """ closes an export (see init_export), records the number of frames written"""
+    if export['fmt'] == 'hdf5':
+        export['file'].attrs['frames'] = export['frames']
+    if export['file'] is not None:
+        export['file'].close()
+    print('Exported {} frames to {}'.format(export['frames'], export['fl']))
+
+
+def read_channel(fl, ch, frames=None):
+    """ reads a single channel of an exported file, without loading the other channels
+
+    Arguments:
+        fl          ... str, full path to the file (see export_trial)
+        ch          ... str, name of the channel (e.g. 'RightFFHFA_x' or 'RTIB0')
+        frames      ... tuple, Default = None. (start, stop) frames to read. If None, all frames
+    Returns:
+        value       ... array, n (angles) or n x 3 (markers) values of the channel
+    """
+    fmt = export_format(fl)
+    start, stop = (None, None) if frames is None else frames
+    if fmt == 'hdf5':
+        h5py = import_optional('h5py', 'HDF5')
+        with h5py.File(fl, 'r') as f:
+            return f['channels'][ch][start:stop]
+
+    import_optional('pyarrow', 'Parquet')
+    import pyarrow.parquet as pq
+    names = pq.read_schema(fl).names
+    columns = [ch] if ch in names else [ch + axis for axis in ['_x', '_y', '_z']]
+    if not all(col in names for col in columns):
+        raise KeyError('channel {} not found in {}'.format(ch, fl))
+    table = pq.read_table(fl, columns=columns)
+    value = np.column_stack([table[col].to_numpy() for col in columns])
+    value = value[:, 0] if ch in names else value
+    return value[start:stop]
+
+
+def read_metadata(fl):
+    """ reads the metadata, parameters and channel groups of an exported file (see init_export)"""
+    if export_format(fl) == 'hdf5':
+        h5py = import_optional('h5py', 'HDF5')
+        with h5py.File(fl, 'r') as f:
+            metadata = dict(f.attrs)
+            parameters = {key: f['parameters'][key][()] for key in f['parameters']}
+            groups = {ch: f['channels'][ch].attrs['group'] for ch in f['channels']}
+        return dict(metadata=metadata, parameters=parameters, groups=groups)
+
+    import_optional('pyarrow', 'Parquet')
+    import pyarrow.parquet as pq
+    meta = pq.read_schema(fl).metadata
+    return {key: json.loads(meta[('openOFM.' + key).encode()]) for key in ['metadata', 'parameters', 'groups']}
+
+
+def select_channels(data, groups=None):
+    """ lists the channels of data in groups (see CHANNEL_GROUPS)"""
+    if groups is None:
+        groups = DEFAULT_GROUPS
+    for group in groups:
+        if group not in CHANNEL_GROUPS:
+            raise ValueError('unknown group of channels {}, must be one of {}'.format(group, CHANNEL_GROUPS))
+    return [ch for ch, value in data.items() if isinstance(value, np.ndarray) and value.ndim in [1, 2] and
+            channel_group(data, ch) in groups]
+
+
+def channel_group(data, ch):
+    """ helper function to find the group of a channel: kinematics (angles and indices), segments (axes of
+    SEGMENT_FRAMES), markers (labels of the c3d file) or virtual_markers"""
+    if data[ch].ndim == 1 or ch.startswith(('Right', 'Left')):
+        return 'kinematics'
+    if ch[0] in ['R', 'L'] and ch[-1] in '0123' and ch[1:-1] in SEGMENT_FRAMES:
+        return 'segments'
+    try:
+        labels = data['parameters']['POINT']['LABELS']['value']
+    except (KeyError, TypeError):
+        labels = []
+    return 'markers' if ch in labels else 'virtual_markers'
+
+
+def processing_parameters(parameters):
+    """ helper function to get the PROCESSING parameters of a trial as lists of values"""
+    if parameters is None or 'PROCESSING' not in parameters:
+        return {}
+    return {key: np.ravel(value['value']).tolist() for key, value in parameters['PROCESSING'].items()
+            if key != '__METADATA__' and 'value' in value}
+
+
+def trial_metadata(data, settings):
+    """ helper function to collect the metadata of a trial: file, subject folder, version and frame rate"""
+    metadata = dict(file_name=settings.get('file_name', ''), data_dir=settings.get('data_dir', ''),
+                    trial_type=settings.get('trial_type', ''), version=settings.get('version', ''))
+    try:
+        metadata['rate'] = float(np.ravel(data['parameters']['POINT']['RATE']['value'])[0])
+    except (KeyError, IndexError, TypeError):
+        pass
+    return metadata
+
+
+def export_format(fl):
+    """ helper function to get the export format from the extension of a file"""
+    ext = os.path.splitext(fl)[1].lower()
+    for fmt, fmt_ext in EXPORT_FORMATS.items():
+        if ext in [fmt_ext, '.' + fmt]:
+            return fmt
+    raise ValueError('unknown export format of {}, use {}'.format(fl, ' or '.join(EXPORT_FORMATS.values())))
+
+
+def export_path(settings):
+    """ helper function to get the export file of a trial, next to the trial"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    name = os.path.splitext(settings['file_name'])[0] + '_openOFM' + EXPORT_FORMATS[settings['export']]
+    return os.path.join(root_dir, settings['data_dir'], name)
+
+
+def import_optional(module, fmt):
+    """ helper function to import the optional package needed by an export format"""
+    try:
+        return __import__(module)
+    except ModuleNotFoundError:
+        raise ImportError('{} export needs the {} package, install it with: conda install {}'.format(
+            fmt, module, module))
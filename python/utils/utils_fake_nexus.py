@@ -0,0 +1,265 @@
+import sys
+import time
+import types
+import collections
+from contextlib import contextmanager
+import numpy as np
+from utils.utils import c3d_to_dict, reset_nexus
+
+# subject of the fake Nexus session
+FAKE_SUBJECT = 'Subject'
+
+# trial selected in the fake Nexus, as the running Nexus application seen by every ViconNexus() connection
+_ACTIVE = dict(state=None)
+
+
+def init_fake_nexus(fl, latency=0.0, subject=FAKE_SUBJECT, region=None, parameters=None):
+    """ creates a fake Nexus session with a subject and a trial read from a c3d file
+
+    Arguments:
+        fl          ... str, full path to the .c3d file of the trial
+        latency     ... float or dict, Default = 0. Time (s) added to every call to the fake Nexus, or dict of times
+                        with method names as keys (e.g. {'GetTrajectory': 0.002}), to mimic the round trip to Nexus
+        subject     ... str, Default = FAKE_SUBJECT. Name of the subject
+        region      ... tuple, Default = None. First and last frame (from 1) of the region of interest. If None,
+                        the whole trial
+        parameters  ... dict, Default = None. PROCESSING parameters of the subject. If None, those of the c3d file
+    Returns:
+        state       ... dict, state of the fake Nexus: trial markers, subject parameters (from the PROCESSING
+                        parameters of the c3d file, e.g. RLegLength as RightLegLength), model outputs and 'calls',
+                        the list of (method, seconds) of every call
+
+    Notes:
+        - pass the state to install_fake_nexus (or use fake_nexus) so that viconnexusapi.ViconNexus connects to it
+        - subject parameters are kept when another trial is loaded (see load_fake_trial), so a static trial
+        processed through the fake Nexus calibrates the dynamic trials that follow, as in Nexus
+    """
+    state = dict(subject=subject, latency=latency, calls=[], params={}, param_units={})
+    load_fake_trial(state, fl, region)
+    if parameters is None:
+        parameters = state['trial']['parameters'].get('PROCESSING', {})
+    for key, value in parameters.items():
+        if key != '__METADATA__' and 'value' in value:
+            state['params'][nexus_param_name(key)] = float(np.ravel(value['value'])[0]) \
+                if np.size(value['value']) else 0.0
+    return state
+
+
+def load_fake_trial(state, fl, region=None):
+    """ loads another trial in a fake Nexus session (see init_fake_nexus), model outputs are cleared, trials are read
+    with the memory-mapped reader, which reads trials of any length"""
+    trial = c3d_to_dict(fl, mmap=True, cache=False)
+    frames = len(next(value for value in trial.values() if isinstance(value, np.ndarray) and value.ndim == 2))
+    state.update(fl=fl, trial=trial, frames=frames, outputs={},
+                 region=(1, frames) if region is None else tuple(region),
+                 markers=[key for key, value in trial.items() if isinstance(value, np.ndarray) and value.ndim == 2
+                          and not key.startswith('*')])
+    return state
+
+
+def install_fake_nexus(state):
+    """ makes viconnexusapi.ViconNexus connect to a fake Nexus session (see init_fake_nexus)
+
+    Notes:
+        - the viconnexusapi package is replaced in sys.modules, so that is_nexus and utils_nexus work without
+        Nexus (e.g. on Linux). Undo with uninstall_fake_nexus
+    """
+    module = types.ModuleType('viconnexusapi')
+    module.ViconNexus = types.ModuleType('viconnexusapi.ViconNexus')
+    module.ViconNexus.ViconNexus = FakeViconNexus
+    sys.modules['viconnexusapi'] = module
+    sys.modules['viconnexusapi.ViconNexus'] = module.ViconNexus
+    if 'utils.utils_nexus' in sys.modules:
+        sys.modules['utils.utils_nexus'].ViconNexus = module.ViconNexus
+    _ACTIVE['state'] = state
+    reset_nexus()
+
+
+def uninstall_fake_nexus():
+    """ closes the fake Nexus session, connections fail as if Nexus was closed"""
+    _ACTIVE['state'] = None
+    reset_nexus()
+    for name in ['viconnexusapi', 'viconnexusapi.ViconNexus']:
+        if name in sys.modules and getattr(sys.modules[name], '__file__', None) is None:
+            del sys.modules[name]
+
+
+@contextmanager
+def fake_nexus(state):
+    """ context manager installing a fake Nexus session (see install_fake_nexus) for the duration of a block"""
+    install_fake_nexus(state)
+    try:
+        yield state
+    finally:
+        uninstall_fake_nexus()
+
+
+class FakeViconNexus:
+    """ stand-in for viconnexusapi.ViconNexus.ViconNexus backed by a c3d file, see init_fake_nexus
+
+    Only the methods used by openOFM are implemented. Values are returned as lists, as by the Nexus API, and
+    every call is delayed by the latency of the session and recorded in state['calls']
+    """
+
+    def __init__(self):
+        if _ACTIVE['state'] is None:
+            raise IOError('fake Nexus session not started, see install_fake_nexus')
+        self.state = _ACTIVE['state']
+
+    def _call(self, name):
+        latency = self.state['latency']
+        if isinstance(latency, dict):
+            latency = latency.get(name, 0.0)
+        t0 = time.perf_counter()
+        if latency > 0:
+            time.sleep(latency)
+        self.state['calls'].append((name, time.perf_counter() - t0))
+
+    def _check_subject(self, subject):
+        if subject != self.state['subject']:
+            raise ValueError('unknown subject {}'.format(subject))
+
+    def GetSubjectNames(self):
+        self._call('GetSubjectNames')
+        return [self.state['subject']]
+
+    def GetSubjectInfo(self):
+        self._call('GetSubjectInfo')
+        return self.state['subject'], 'openOFM', True
+
+    def GetTrialName(self):
+        self._call('GetTrialName')
+        path, name = self.state['fl'].rsplit('/', 1) if '/' in self.state['fl'] else ('', self.state['fl'])
+        return path + '/', name.rsplit('.', 1)[0]
+
+    def GetFrameCount(self):
+        self._call('GetFrameCount')
+        return self.state['frames']
+
+    def GetFrameRate(self):
+        self._call('GetFrameRate')
+        return float(np.ravel(self.state['trial']['parameters']['POINT']['RATE']['value'])[0])
+
+    def GetTrialRegionOfInterest(self):
+        self._call('GetTrialRegionOfInterest')
+        return list(self.state['region'])
+
+    def GetMarkerNames(self, subject):
+        self._call('GetMarkerNames')
+        self._check_subject(subject)
+        return list(self.state['markers'])
+
+    def GetTrajectory(self, subject, marker):
+        self._call('GetTrajectory')
+        self._check_subject(subject)
+        xyz = self.state['trial'][marker]
+        exists = ~np.isnan(xyz).any(axis=1)
+        xyz = np.where(exists[:, np.newaxis], xyz, 0.0)
+        return xyz[:, 0].tolist(), xyz[:, 1].tolist(), xyz[:, 2].tolist(), exists.tolist()
+
+    def GetModelOutputNames(self, subject):
+        self._call('GetModelOutputNames')
+        self._check_subject(subject)
+        return list(self.state['outputs'])
+
+    def GetModelOutput(self, subject, name):
+        self._call('GetModelOutput')
+        self._check_subject(subject)
+        if name not in self.state['outputs']:
+            return [[0.0] * self.state['frames'] for _ in range(3)], [False] * self.state['frames']
+        values, exists = self.state['outputs'][name]
+        return values.tolist(), list(exists)
+
+    def CreateModelOutput(self, subject, name, group, components, types):
+        self._call('CreateModelOutput')
+        self._check_subject(subject)
+        self.state['outputs'][name] = (np.zeros((len(components), self.state['frames'])),
+                                       [False] * self.state['frames'])
+
+    def SetModelOutput(self, subject, name, values, exists):
+        self._call('SetModelOutput')
+        self._check_subject(subject)
+        if name not in self.state['outputs']:
+            raise ValueError('model output {} does not exist, see CreateModelOutput'.format(name))
+        self.state['outputs'][name] = (np.array(values, dtype=float), list(exists))
+
+    def GetSubjectParamNames(self, subject):
+        self._call('GetSubjectParamNames')
+        self._check_subject(subject)
+        return list(self.state['params'])
+
+    def GetSubjectParam(self, subject, name):
+        self._call('GetSubjectParam')
+        self._check_subject(subject)
+        return self.state['params'][name], True
+
+    def CreateSubjectParam(self, subject, name, value, unit, default, required):
+        self._call('CreateSubjectParam')
+        self._check_subject(subject)
+        self.state['params'][name] = value
+        self.state['param_units'][name] = unit
+
+    def SetSubjectParam(self, subject, name, value, required):
+        self._call('SetSubjectParam')
+        self._check_subject(subject)
+        self.state['params'][name] = value
+
+
+def call_summary(state):
+    """ summary of the calls made to a fake Nexus session
+
+    Arguments:
+        state       ... dict, fake Nexus session (see init_fake_nexus)
+    Returns:
+        summary     ... dict, method names as keys and dict of the number of 'calls' and total 'time' (s) as values
+    """
+    summary = collections.OrderedDict()
+    for name, seconds in state['calls']:
+        entry = summary.setdefault(name, dict(calls=0, time=0.0))
+        entry['calls'] += 1
+        entry['time'] += seconds
+    return summary
+
+
+def nexus_param_name(key):
+    """ helper function to get the Nexus name of a c3d PROCESSING parameter (e.g. RLegLength as RightLegLength)"""
+    if len(key) > 1 and key[0] in ['R', 'L'] and key[1].isupper() and '_' not in key:
+        return ('Right' if key[0] == 'R' else 'Left') + key[1:]
+    return key
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    from utils.utils import find_repo_root
+
+    parser = argparse.ArgumentParser(
+        description='runs the Nexus path of openOFM (static then dynamic trial) against a fake Nexus backed by c3d '
+                    'files and reports the calls made to Nexus',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to run')
+    parser.add_argument('--data_dir', default='Data_Sample/Sample', help='Name of subfolder relative to root')
+    parser.add_argument('--static_name', default='static.c3d', help='name of the static trial')
+    parser.add_argument('--file_name', default='dynamic.c3d', help='name of the dynamic trial')
+    parser.add_argument('--latency', type=float, default=0.0, help='time (s) added to every call to Nexus')
+    args = parser.parse_args()
+
+    from openOFM_static import openOFM_static
+    from openOFM_dynamic import openOFM_dynamic
+
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    nexus_state = init_fake_nexus(os.path.join(root_dir, args.data_dir, args.static_name), latency=args.latency)
+    with fake_nexus(nexus_state):
+        for trial_type, file_name, run in [('static', args.static_name, openOFM_static),
+                                           ('dynamic', args.file_name, openOFM_dynamic)]:
+            load_fake_trial(nexus_state, os.path.join(root_dir, args.data_dir, file_name))
+            nexus_state['calls'] = []
+            t0 = time.perf_counter()
+            run(dict(nexus=True, version=args.version, trial_type=trial_type))
+            elapsed = time.perf_counter() - t0
+            summary = call_summary(nexus_state)
+            print('{} trial: {} calls to Nexus, {:.3f} s in calls, {:.3f} s in total'.format(
+                trial_type, sum(s['calls'] for s in summary.values()), sum(s['time'] for s in summary.values()),
+                elapsed))
+            for name, s in summary.items():
+                print('  {:<26} {:6d} calls {:10.4f} s'.format(name, s['calls'], s['time']))
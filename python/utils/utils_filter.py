@@ -0,0 +1,165 @@
+import numpy as np
+from utils.utils_gaps import stack_markers, unstack_markers, gap_frames
+
+# order of the Butterworth filter. The filter runs forward and backward (zero lag), doubling the order
+FILTER_ORDER = 2
+
+# candidate cutoff frequencies (Hz) of the residual analysis. Markers moving little (e.g. pelvis) have residuals
+# down to the noise at very low cutoffs, which distort the start and end of the trial
+RESIDUAL_CUTOFFS = np.arange(3.0, 20.5, 0.5)
+
+# cutoff frequency (Hz) above which the residual is assumed to be due to noise only (see residual_cutoffs)
+NOISE_CUTOFF = 12.0
+
+
+def filter_markers(data, cutoff=6.0, rate=None, markers=None, order=FILTER_ORDER):
+    """ low-pass filters marker trajectories with a zero-lag Butterworth filter
+
+    Arguments:
+        data        ... dict, trial data with markers as n x 3 arrays
+        cutoff      ... float, dict or str, Default = 6.0. Cutoff frequency (Hz) of every marker, a dict of cutoff
+                        frequencies with markers as keys, or 'auto' for the cutoff of each marker found by residual
+                        analysis (see residual_cutoffs)
+        rate        ... float, Default = None. Frame rate (Hz). If None, the POINT:RATE parameter of data
+        markers     ... list, Default = None. Markers to filter. If None, every n x 3 channel of data
+        order       ... int, Default = FILTER_ORDER. Order of the Butterworth filter
+    Returns:
+        data        ... dict, with filtered markers
+
+    Notes:
+        - markers are stacked as a single n x 3m array and filtered in one call per distinct cutoff frequency
+        - gaps (NaN frames) are bridged linearly for filtering and left as gaps in the filtered markers
+    """
+    if rate is None:
+        rate = get_rate(data)
+    if markers is None:
+        markers = [ch for ch, value in data.items() if isinstance(value, np.ndarray) and value.ndim == 2 and
+                   value.shape[1] == 3]
+    if len(markers) == 0:
+        return data
+
+    block = stack_markers(data, markers)
+    if isinstance(cutoff, str):
+        if cutoff != 'auto':
+            raise ValueError("cutoff must be a frequency (Hz) or 'auto', got {}".format(cutoff))
+        cutoff = residual_cutoffs(block, rate, order=order)
+        cutoff = np.repeat(np.max(cutoff.reshape(-1, 3), axis=1), 3)
+    elif isinstance(cutoff, dict):
+        cutoff = np.repeat([cutoff[mrk] for mrk in markers], 3)
+
+    block = butter_filter(block, cutoff, rate, order)
+
+    return unstack_markers(data, markers, block)
+
+
+def butter_filter(block, cutoff, rate, order=FILTER_ORDER):
+    """ zero-lag Butterworth low-pass filter of every column of an array
+
+    Arguments:
+        block       ... n x k array, signals as columns, with NaN gaps
+        cutoff      ... float or array of k floats, cutoff frequency (Hz) of all columns or of each column
+        rate        ... float, sampling rate (Hz)
+        order       ... int, Default = FILTER_ORDER. Order of the Butterworth filter
+    Returns:
+        block       ... n x k array, filtered signals
+    """
+    from scipy.signal import butter, sosfiltfilt
+
+    valid = ~np.isnan(block)
+    bridged = bridge_gaps(block, valid)
+    cutoff = np.broadcast_to(cutoff, block.shape[1])
+
+    filtered = np.empty_like(bridged)
+    for fc in np.unique(cutoff):
+        cols = np.flatnonzero(cutoff == fc)
+        sos = butter(order, fc, btype='low', output='sos', fs=rate)
+        filtered[:, cols] = sosfiltfilt(sos, bridged[:, cols], axis=0)
+    filtered[~valid] = np.nan
+
+    return filtered
+
+
+def residual_cutoffs(block, rate, cutoffs=None, order=FILTER_ORDER):
+    """ finds the cutoff frequency of each column by residual analysis
+
+    Arguments:
+        block       ... n x k array, signals as columns, with NaN gaps
+        rate        ... float, sampling rate (Hz)
+        cutoffs     ... array, Default = None. Candidate cutoff frequencies (Hz). If None, RESIDUAL_CUTOFFS below
+                        the Nyquist frequency
+        order       ... int, Default = FILTER_ORDER. Order of the Butterworth filter
+    Returns:
+        cutoff      ... array of k floats, cutoff frequency (Hz) of each column
+
+    Notes:
+        - the residual (RMS difference between raw and filtered signal) of every candidate and every column is
+        computed at once from the power spectrum of the columns and the gain of the zero-lag filter (Parseval's
+        theorem), as a single matrix product. The line between the first and last frames is removed first to limit
+        spectral leakage, gaps are bridged linearly
+        - a line fitted through the residuals of candidates above NOISE_CUTOFF estimates the noise, the cutoff is
+        the lowest candidate whose residual is down to the noise (intercept of the line, see Winter DA,
+        Biomechanics and motor control of human movement, 2009)
+    """
+    from scipy.signal import butter, sosfreqz
+
+    if cutoffs is None:
+        cutoffs = RESIDUAL_CUTOFFS[RESIDUAL_CUTOFFS < rate / 2]
+    cutoffs = np.asarray(cutoffs, dtype=float)
+
+    signal = bridge_gaps(block)
+    n = signal.shape[0]
+    signal = signal - signal[0] - np.arange(n)[:, np.newaxis] / max(n - 1, 1) * (signal[-1] - signal[0])
+    power = np.abs(np.fft.rfft(signal, axis=0)) ** 2
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+
+    # one-sided spectrum, frequencies other than 0 and Nyquist count twice
+    weights = np.full(len(freqs), 2.0)
+    weights[0] = 1.0
+    if n % 2 == 0:
+        weights[-1] = 1.0
+
+    gain = np.array([np.abs(sosfreqz(butter(order, fc, btype='low', output='sos', fs=rate), worN=freqs,
+                                     fs=rate)[1]) ** 2 for fc in cutoffs])
+    residual = np.sqrt(((1 - gain) ** 2 * weights) @ power) / n
+
+    noise = cutoffs >= NOISE_CUTOFF
+    if noise.sum() < 2:
+        noise = np.arange(len(cutoffs)) >= len(cutoffs) // 2
+    intercept = np.polyfit(cutoffs[noise], residual[noise], 1)[1]
+    below = residual <= intercept
+    cutoff = cutoffs[np.argmax(below, axis=0)]
+    cutoff[~below.any(axis=0)] = cutoffs[-1]
+
+    return cutoff
+
+
+def bridge_gaps(block, valid=None):
+    """ helper function to bridge gaps linearly (and hold the first and last valid values at the ends) for
+    filtering"""
+    if valid is None:
+        valid = ~np.isnan(block)
+    if valid.all():
+        return block
+    n, k = block.shape
+    _, prev, nxt = gap_frames(valid)
+    p = np.where(prev >= 0, prev, nxt)
+    q = np.where(nxt < n, nxt, prev)
+    idx = np.arange(n)[:, np.newaxis]
+    w = np.where(q > p, (idx - p) / np.maximum(q - p, 1), 0.0)
+    cols = np.arange(k)
+    p = np.clip(p, 0, n - 1)
+    q = np.clip(q, 0, n - 1)
+    return np.where(valid, block, (1 - w) * block[p, cols] + w * block[q, cols])
+
+
+def cutoff_type(value):
+    """ helper function to parse a cutoff frequency (Hz) or 'auto' given on the command line"""
+    return value if value == 'auto' else float(value)
+
+
+def get_rate(data):
+    """ helper function to get the frame rate (Hz) of a trial from its POINT:RATE parameter"""
+    try:
+        return float(np.ravel(data['parameters']['POINT']['RATE']['value'])[0])
+    except (KeyError, IndexError):
+        raise ValueError('frame rate of the trial not found, set rate')
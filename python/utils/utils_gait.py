@@ -0,0 +1,169 @@
+import os
+import numpy as np
+from utils.utils import getDir, find_repo_root, ANGLE_JOINTS
+from utils.utils_filter import get_rate
+
+SIDES = {'R': 'Right', 'L': 'Left'}
+
+# marker of each gait event: foot strike when the heel is furthest ahead of the pelvis, foot off when the toe is
+# furthest behind it (Zeni et al. 2008, Gait & Posture 27(4))
+EVENT_MARKERS = {'FootStrike': 'HEE', 'FootOff': 'TOE'}
+
+# shortest time (s) between two events of the same kind on the same side
+MIN_EVENT_INTERVAL = 0.5
+
+# smallest excursion of the marker relative to the pelvis around an event, as a fraction of its range of motion
+MIN_PROMINENCE = 0.25
+
+# points of a time-normalised gait cycle (0 to 100 %)
+CYCLE_POINTS = 101
+
+
+def gait_events(data, rate=None, direction=None, sides=None):
+    """ detects foot strikes and foot offs from the heel and toe markers
+
+    Arguments:
+        data        ... dict, trial data with PiG pelvis markers and HEE and TOE markers of each side
+        rate        ... float, Default = None. Frame rate (Hz). If None, the POINT:RATE parameter of data
+        direction   ... str, Default = None. Direction of walking 'Ipos', 'Ineg', 'Jpos' or 'Jneg'. If None, found
+                        from the pelvis markers (see getDir). Required on a treadmill (e.g. getDirStat of the static
+                        trial)
+        sides       ... list, Default = None. Sides ('R' and/or 'L'). If None, both sides
+    Returns:
+        events      ... dict, frames (indices in data) of each event as arrays, with side + event as keys (e.g.
+                        'RightFootStrike', 'LeftFootOff')
+
+    Notes:
+        - events are extrema of the heel and toe positions relative to the pelvis along the direction of walking,
+        which works both over ground and on a treadmill. Frames with gaps are never events
+    """
+    if rate is None:
+        rate = get_rate(data)
+    if direction is None:
+        direction = getDir(data)
+    if sides is None:
+        sides = list(SIDES)
+
+    dim = 0 if direction[0] == 'I' else 1
+    sign = 1 if direction[1:] == 'pos' else -1
+    pelvis = pelvis_centre(data)[:, dim]
+
+    events = {}
+    for side in sides:
+        for event, marker in EVENT_MARKERS.items():
+            position = sign * (data[side + marker][:, dim] - pelvis)
+            if event == 'FootOff':
+                position = -position
+            events[SIDES[side] + event] = find_extrema(position, rate)
+
+    return events
+
+
+def find_extrema(position, rate):
+    """ helper function to find the frames of the maxima of a position (NaN frames are skipped)"""
+    from scipy.signal import find_peaks
+
+    valid = ~np.isnan(position)
+    if valid.sum() < 3:
+        return np.array([], dtype=int)
+    rom = np.max(position[valid]) - np.min(position[valid])
+    frames, _ = find_peaks(np.where(valid, position, -np.inf), distance=max(1, int(MIN_EVENT_INTERVAL * rate)),
+                           prominence=MIN_PROMINENCE * rom)
+    return frames[valid[frames]]
+
+
+def pelvis_centre(data):
+    """ helper function to get the centre of the PiG pelvis markers"""
+    if 'RPSI' in data:
+        return (data['RASI'] + data['LASI'] + data['RPSI'] + data['LPSI']) / 4
+    elif 'SACR' in data:
+        return (data['RASI'] + data['LASI'] + 2 * data['SACR']) / 4
+    raise ValueError('PiG pelvis markers (RASI, LASI and RPSI, LPSI or SACR) are needed to detect gait events')
+
+
+def gait_cycles(events, side):
+    """ helper function to list the gait cycles of a side as (start, end) frames of consecutive foot strikes"""
+    strikes = events[SIDES[side] + 'FootStrike']
+    return np.column_stack((strikes[:-1], strikes[1:])).astype(int)
+
+
+def time_normalise(signals, cycles, points=CYCLE_POINTS):
+    """ resamples every gait cycle of every channel to a fixed number of points, in one interpolation
+
+    Arguments:
+        signals     ... n x k array, channels as columns (e.g. angles)
+        cycles      ... c x 2 array, start and end frame of each cycle (see gait_cycles)
+        points      ... int, Default = CYCLE_POINTS. Points per cycle
+    Returns:
+        normalised  ... c x k x points array, channels of each cycle from 0 to 100 %
+
+    Notes:
+        - channels are linearly interpolated at the fractional frames of every cycle and point at once
+    """
+    signals = np.asarray(signals, dtype=float)
+    if signals.ndim == 1:
+        signals = signals[:, np.newaxis]
+    cycles = np.asarray(cycles, dtype=float).reshape(-1, 2)
+
+    # fractional frame of each point of each cycle, c x points
+    t = cycles[:, :1] + (cycles[:, 1:] - cycles[:, :1]) * np.linspace(0, 1, points)
+    i0 = np.clip(np.floor(t).astype(int), 0, signals.shape[0] - 2)
+    w = (t - i0)[..., np.newaxis]
+    normalised = (1 - w) * signals[i0] + w * signals[i0 + 1]
+
+    return np.transpose(normalised, (0, 2, 1))
+
+
+def normalise_angles(data, events, side, channels=None, points=CYCLE_POINTS):
+    """ cuts the OFM angles of a side into gait cycles (foot strike to foot strike) and time-normalises them
+
+    Arguments:
+        data        ... dict, processed trial data with OFM angles (see addchannelsgs)
+        events      ... dict, gait events (see gait_events)
+        side        ... str, 'R' or 'L'
+        channels    ... list, Default = None. Channels to normalise. If None, every OFM angle component of side
+                        present in data (e.g. 'RightFFHFA_x')
+        points      ... int, Default = CYCLE_POINTS. Points per cycle
+    Returns:
+        normalised  ... c x k x points array, channels of each cycle (see time_normalise)
+        channels    ... list, names of the k channels
+        cycles      ... c x 2 array, start and end frame of each cycle
+    """
+    if channels is None:
+        channels = [SIDES[side] + angle + axis for angle in ANGLE_JOINTS for axis in ['_x', '_y', '_z']
+                    if SIDES[side] + angle + axis in data]
+    cycles = gait_cycles(events, side)
+    signals = np.column_stack([data[ch] for ch in channels])
+
+    return time_normalise(signals, cycles, points), channels, cycles
+
+
+def save_cycles(data, events, fl):
+    """ saves the time-normalised OFM angles of a processed trial
+
+    Arguments:
+        data        ... dict, processed trial data with OFM angles (see addchannelsgs)
+        events      ... dict, gait events (see gait_events)
+        fl          ... str, full path to the .npz file
+    Returns:
+        arrays      ... dict, saved arrays: normalised angles of each side ('Right', 'Left', c x k x points), their
+                        channels ('Right_channels', 'Left_channels') and cycles ('Right_cycles', 'Left_cycles'), and
+                        the frames of the gait events
+    """
+    arrays = dict(events)
+    for side, name in SIDES.items():
+        normalised, channels, cycles = normalise_angles(data, events, side)
+        arrays[name] = normalised
+        arrays[name + '_channels'] = np.array(channels)
+        arrays[name + '_cycles'] = cycles
+
+    np.savez(fl, **arrays)
+    print('Saving gait cycles to {}'.format(fl))
+
+    return arrays
+
+
+def cycles_path(settings):
+    """ helper function to get the .npz file of the gait cycles of a trial, next to the trial"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    return os.path.join(root_dir, settings['data_dir'], os.path.splitext(settings['file_name'])[0] + '_cycles.npz')
@@ -0,0 +1,389 @@
+import itertools
+import numpy as np
+from linear_algebra.linear_algebra import lcs_axes, gcs_2_lcs, lcs_2_gcs
+
+# markers of each rigid segment, used as donors for pattern and rigid body filling. Markers of the pelvis have
+# no side prefix, the other markers are used for both sides
+SEGMENT_MARKERS = {'pelvis': ['RASI', 'LASI', 'RPSI', 'LPSI', 'SACR'],
+                   'femur': ['THI', 'KNE'],
+                   'tibia': ['TUB', 'SHN', 'ANK', 'HFB', 'TIB'],
+                   'hindfoot': ['HEE', 'HE1', 'STL', 'LCA', 'CPG'],
+                   'forefoot': ['P1M', 'P5M', 'D5M', 'TOE', 'D1M'],
+                   'hallux': ['HLX'],
+                   }
+
+# gap filling methods
+GAP_METHODS = ['rigid', 'pattern', 'spline']
+
+# methods applied by default: rigid body first (exact for markers of rigid segments), spline for what is left.
+# Foot segments rotate too fast during swing for pattern filling to beat a spline over gaps of more than a few frames
+DEFAULT_GAP_METHODS = ['rigid', 'spline']
+
+# valid frames (on each side of the gaps) through which the spline is fitted
+SPLINE_MARGIN = 20
+
+# largest change (mm) of the offset between marker and donor from the frame before to the frame after a gap, for
+# pattern filling. Beyond, the segment rotates too much over the gap for a linear offset and the gap is left to the
+# next donor or method (spline is more accurate on average beyond 20 mm)
+PATTERN_MAX_DRIFT = 20.
+
+# frames used to find the closest donors of pattern filling, evenly spread over the trial
+DONOR_FRAMES = 1000
+
+
+def fill_gaps(data, methods=None, markers=None, max_gap=None):
+    """ fills gaps (NaN frames) of marker trajectories
+
+    Arguments:
+        data        ... dict, trial data with markers as n x 3 arrays
+        methods     ... list, Default = None. Methods applied one after the other, each filling the gaps left by
+                        the previous ones. If None, DEFAULT_GAP_METHODS
+                        'rigid'   ... from 3 other markers of the same segment (see rigid_fill)
+                        'pattern' ... from the trajectory of another marker of the same segment (see pattern_fill)
+                        'spline'  ... cubic spline through the frames without gaps (see spline_fill)
+        markers     ... list, Default = None. Markers to fill. If None, every n x 3 channel of data
+        max_gap     ... int, Default = None. Longest gap (frames) to fill. If None, gaps of any length are filled
+    Returns:
+        data        ... dict, with gaps filled
+
+    Notes:
+        - only gaps with valid frames on both sides are filled, missing frames at the start and end of the trial
+        are left as NaN
+        - markers are stacked as a single n x 3m array, each method runs on all markers at once and only looks at
+        markers with gaps and at the frames around the gaps
+    """
+    if methods is None:
+        methods = DEFAULT_GAP_METHODS
+    if markers is None:
+        markers = [ch for ch, value in data.items() if isinstance(value, np.ndarray) and value.ndim == 2 and
+                   value.shape[1] == 3]
+    if len(markers) == 0:
+        return data
+
+    block = stack_markers(data, markers)
+    if not np.isnan(block).any():
+        return data
+
+    for method in methods:
+        if method == 'rigid':
+            block = rigid_fill(block, markers, max_gap)
+        elif method == 'pattern':
+            block = pattern_fill(block, markers, max_gap)
+        elif method == 'spline':
+            block = spline_fill(block, max_gap)
+        else:
+            raise ValueError('unknown gap filling method {}, must be one of {}'.format(method, GAP_METHODS))
+
+    return unstack_markers(data, markers, block)
+
+
+def stack_markers(data, markers):
+    """ helper function to stack markers as an n x 3m array, marker i in columns 3i to 3i + 2"""
+    return np.hstack([data[mrk] for mrk in markers])
+
+
+def unstack_markers(data, markers, block):
+    """ helper function to split an n x 3m array of markers (see stack_markers) back into data"""
+    for i, mrk in enumerate(markers):
+        data[mrk] = block[:, 3 * i:3 * i + 3].astype(data[mrk].dtype, copy=True)
+    return data
+
+
+def gap_frames(valid, max_gap=None):
+    """ finds the frames of gaps that can be filled, for every column at once
+
+    Arguments:
+        valid       ... n x k bool array, true for frames without gap
+        max_gap     ... int, Default = None. Longest gap (frames) to fill
+    Returns:
+        fill        ... n x k bool array, true for frames of gaps with valid frames on both sides, no longer than
+                        max_gap
+        prev        ... n x k int array, index of the last valid frame up to each frame (-1 if none)
+        nxt         ... n x k int array, index of the first valid frame from each frame (n if none)
+    """
+    n = valid.shape[0]
+    idx = np.arange(n)[:, np.newaxis]
+    prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    nxt = np.minimum.accumulate(np.where(valid, idx, n)[::-1], axis=0)[::-1]
+    fill = ~valid & (prev >= 0) & (nxt < n)
+    if max_gap is not None:
+        fill &= (nxt - prev - 1) <= max_gap
+
+    return fill, prev, nxt
+
+
+def spline_fill(block, max_gap=None):
+    """ fills gaps with a cubic spline through the valid frames around the gaps of each marker
+
+    Arguments:
+        block       ... n x 3m array, markers (see stack_markers) with NaN gaps
+        max_gap     ... int, Default = None. Longest gap (frames) to fill
+    Returns:
+        block       ... n x 3m array, with gaps filled
+
+    Notes:
+        - the spline of a marker is fitted through its valid frames within SPLINE_MARGIN frames of its gaps, with
+        not-a-knot end conditions as scipy.interpolate.CubicSpline
+        - the splines of all markers with gaps are fitted at once: their knots are concatenated and the slopes at
+        the knots are found with a single banded solve (see spline_slopes), then every gap frame is evaluated at
+        once. Markers with fewer than 4 knots are fitted with CubicSpline
+    """
+    xyz = block.reshape(block.shape[0], -1, 3)
+    valid = marker_valid(xyz)
+    gaps = np.flatnonzero(~valid.all(axis=0))
+    if len(gaps) == 0:
+        return block
+    fill, _, _ = gap_frames(valid[:, gaps], max_gap)
+    near = near_frames(fill, SPLINE_MARGIN) & valid[:, gaps]
+
+    # knots of the markers with gaps to fill (frame and column k of gaps), sorted by marker then frame
+    frames, k = np.nonzero(near.T)[::-1]
+    counts = np.bincount(k, minlength=len(gaps))
+    batched = (counts >= 4) & fill.any(axis=0)
+
+    block = block.copy()
+    xyz = block.reshape(block.shape[0], -1, 3)
+    keep = batched[k]
+    frames, k = frames[keep], k[keep]
+    if len(frames):
+        y = xyz[frames, gaps[k]]
+        slopes = spline_slopes(frames, y, k)
+
+        # interval of the knots of its marker holding each gap frame
+        rows, kq = np.nonzero(fill[:, batched].T)[::-1]
+        kq = np.flatnonzero(batched)[kq]
+        key = k * (block.shape[0] + 1) + frames
+        j = np.searchsorted(key, kq * (block.shape[0] + 1) + rows, side='right') - 1
+        dx = (frames[j + 1] - frames[j])[:, np.newaxis]
+        slope = (y[j + 1] - y[j]) / dx
+        t = (slopes[j] + slopes[j + 1] - 2 * slope) / dx
+        h = (rows - frames[j])[:, np.newaxis]
+        xyz[rows, gaps[kq]] = (((t / dx) * h + (slope - slopes[j]) / dx - t) * h + slopes[j]) * h + y[j]
+
+    # too few knots for the not-a-knot system, as CubicSpline
+    few = np.flatnonzero(~batched & fill.any(axis=0) & (counts >= 2))
+    if len(few):
+        from scipy.interpolate import CubicSpline
+    for k in few:
+        rows = np.flatnonzero(fill[:, k])
+        knots = np.flatnonzero(near[:, k])
+        xyz[rows, gaps[k]] = CubicSpline(knots, xyz[knots, gaps[k]], axis=0)(rows)
+
+    return block
+
+
+def spline_slopes(x, y, k):
+    """ slopes at the knots of many not-a-knot cubic splines, with a single banded solve
+
+    Arguments:
+        x           ... N array, knots of all splines, sorted by spline then knot, at least 4 knots per spline
+        y           ... N x 3 array, values at the knots
+        k           ... N array, spline of each knot
+    Returns:
+        s           ... N x 3 array, first derivative at the knots
+
+    Notes:
+        - each spline gives the tridiagonal system of scipy.interpolate.CubicSpline (not-a-knot), the systems are
+        stacked as one block diagonal banded matrix
+    """
+    from scipy.linalg import solve_banded
+
+    n = len(x)
+    first = np.r_[True, k[1:] != k[:-1]]
+    last = np.r_[k[1:] != k[:-1], True]
+    inner = ~first & ~last
+    dx = np.diff(x).astype(float)
+    slope = np.diff(y, axis=0) / dx[:, np.newaxis]
+
+    # dx and slope of the interval before (p) and after (q) each knot, within its spline
+    i = np.flatnonzero(inner)
+    dp, dq = dx[i - 1], dx[i]
+    ab = np.zeros((3, n))
+    b = np.empty_like(y, dtype=float)
+    ab[1, i] = 2 * (dp + dq)
+    ab[0, i + 1] = dp
+    ab[2, i - 1] = dq
+    b[i] = 3 * (dq[:, np.newaxis] * slope[i - 1] + dp[:, np.newaxis] * slope[i])
+
+    # not-a-knot condition at the first knot of each spline
+    i = np.flatnonzero(first)
+    d = (x[i + 2] - x[i]).astype(float)
+    ab[1, i] = dx[i + 1]
+    ab[0, i + 1] = d
+    b[i] = (((dx[i] + 2 * d) * dx[i + 1])[:, np.newaxis] * slope[i] + (dx[i] ** 2)[:, np.newaxis] * slope[i + 1]) / \
+        d[:, np.newaxis]
+
+    # and at the last knot
+    i = np.flatnonzero(last)
+    d = (x[i] - x[i - 2]).astype(float)
+    ab[1, i] = dx[i - 2]
+    ab[2, i - 1] = d
+    b[i] = ((dx[i - 1] ** 2)[:, np.newaxis] * slope[i - 2] +
+            ((2 * d + dx[i - 1]) * dx[i - 2])[:, np.newaxis] * slope[i - 1]) / d[:, np.newaxis]
+
+    return solve_banded((1, 1), ab, b, overwrite_ab=True, overwrite_b=True, check_finite=False)
+
+
+def pattern_fill(block, markers, max_gap=None):
+    """ fills gaps of each marker from the trajectory of another marker of the same segment (donor)
+
+    Arguments:
+        block       ... n x 3m array, markers (see stack_markers) with NaN gaps
+        markers     ... list, names of the m markers of block
+        max_gap     ... int, Default = None. Longest gap (frames) to fill
+    Returns:
+        block       ... n x 3m array, with gaps filled
+
+    Notes:
+        - the gap follows the donor, offset by the distance between marker and donor, which is interpolated
+        linearly from the frame before to the frame after the gap
+        - donors are tried from the closest to the furthest (mean distance), all markers are filled from their
+        closest donor at once, then from their second closest donor and so on
+        - meant for short gaps, over which the segment barely rotates: gaps where the offset changes by more than
+        PATTERN_MAX_DRIFT are not filled from this donor (e.g. foot markers over gaps of 15 frames in swing)
+    """
+    block = block.copy()
+    xyz = block.reshape(block.shape[0], -1, 3)
+    valid = marker_valid(xyz)
+    donors = closest_donors(xyz, segment_donors(markers))
+    gaps = np.flatnonzero(~valid.all(axis=0))
+    for rank in range(max([len(donors[i]) for i in gaps], default=0)):
+        target = np.array([i for i in gaps if len(donors[i]) > rank], dtype=int)
+        source = np.array([donors[i][rank] for i in target], dtype=int)
+
+        fill, _, _ = gap_frames(valid[:, target], max_gap)
+        fill_offset, prev, nxt = gap_frames(valid[:, target] & valid[:, source])
+        rows, k = np.nonzero(fill & fill_offset & valid[:, source])
+        if len(rows) == 0:
+            continue
+
+        p = prev[rows, k]
+        q = nxt[rows, k]
+        t = target[k]
+        s = source[k]
+        offset_p = xyz[p, t] - xyz[p, s]
+        offset_q = xyz[q, t] - xyz[q, s]
+        keep = np.linalg.norm(offset_q - offset_p, axis=1) <= PATTERN_MAX_DRIFT
+        rows, p, q, t, s = rows[keep], p[keep], q[keep], t[keep], s[keep]
+        w = ((rows - p) / (q - p))[:, np.newaxis]
+        xyz[rows, t] = xyz[rows, s] + (1 - w) * offset_p[keep] + w * offset_q[keep]
+        valid[rows, t] = True
+
+    return block
+
+
+def rigid_fill(block, markers, max_gap=None):
+    """ fills gaps of each marker from 3 other markers of the same segment, assuming the segment is rigid
+
+    Arguments:
+        block       ... n x 3m array, markers (see stack_markers) with NaN gaps
+        markers     ... list, names of the m markers of block
+        max_gap     ... int, Default = None. Longest gap (frames) to fill
+    Returns:
+        block       ... n x 3m array, with gaps filled
+
+    Notes:
+        - the marker is expressed in the local coordinate system of the 3 other markers, averaged over the frames
+        before and after its gaps where all 4 markers are visible, and moved with the local coordinate system over
+        the gaps
+        - combinations of 3 donors are tried in the order of SEGMENT_MARKERS, until the gaps are filled: all markers
+        are filled from their first combination, then from their second and so on. Markers sharing the same 3 donors
+        (the other markers of a segment) are filled at once, the local coordinate systems are built once per frame
+    """
+    block = block.copy()
+    xyz = block.reshape(block.shape[0], -1, 3)
+    valid = marker_valid(xyz)
+    donors = segment_donors(markers)
+    gaps = np.flatnonzero(~valid.all(axis=0))
+    if len(gaps) == 0:
+        return block
+    fill, prev, nxt = gap_frames(valid[:, gaps], max_gap)
+
+    # frames to fill and frames before and after the gaps (reference), with their column k of gaps
+    rows, k = np.nonzero(fill)
+    ref = np.zeros_like(fill)
+    ref[prev[rows, k], k] = True
+    ref[nxt[rows, k], k] = True
+    ref_rows, ref_k = np.nonzero(ref)
+    todo = np.ones(len(rows), dtype=bool)
+
+    combinations = [list(itertools.combinations(donors[i], 3)) for i in gaps]
+    for rank in range(max([len(c) for c in combinations], default=0)):
+        triples = {}
+        for kk, c in enumerate(combinations):
+            if len(c) > rank:
+                triples.setdefault(c[rank], []).append(kk)
+
+        for (a, b, c), group in triples.items():
+            member = np.zeros(len(gaps), dtype=bool)
+            member[group] = True
+            sel = np.flatnonzero(todo & member[k])
+            sel = sel[valid[rows[sel], a] & valid[rows[sel], b] & valid[rows[sel], c]]
+            ref_sel = np.flatnonzero(member[ref_k])
+            ref_sel = ref_sel[valid[ref_rows[ref_sel], a] & valid[ref_rows[ref_sel], b] &
+                              valid[ref_rows[ref_sel], c]]
+            # only markers with reference frames visible with these donors
+            count = np.bincount(ref_k[ref_sel], minlength=len(gaps))
+            sel = sel[count[k[sel]] > 0]
+            if len(sel) == 0:
+                continue
+
+            # local coordinate systems of the donors, once per frame
+            frames, idx = np.unique(np.concatenate((ref_rows[ref_sel], rows[sel])), return_inverse=True)
+            axes = lcs_axes(xyz[frames, b] - xyz[frames, a], xyz[frames, c] - xyz[frames, a], 'xyz')
+            origin = xyz[frames, a]
+            f_ref, f_fill = idx[:len(ref_sel)], idx[len(ref_sel):]
+
+            mrk_lcl = gcs_2_lcs(origin[f_ref], axes[f_ref], xyz[ref_rows[ref_sel], gaps[ref_k[ref_sel]]])
+            mrk_lcl_av = np.zeros((len(gaps), 3))
+            np.add.at(mrk_lcl_av, ref_k[ref_sel], mrk_lcl)
+            mrk_lcl_av /= np.maximum(count, 1)[:, np.newaxis]
+
+            xyz[rows[sel], gaps[k[sel]]] = lcs_2_gcs(origin[f_fill], axes[f_fill], mrk_lcl_av[k[sel]])
+            valid[rows[sel], gaps[k[sel]]] = True
+            todo[sel] = False
+
+    return block
+
+
+def marker_valid(xyz):
+    """ helper function to find the frames without gap of each marker of an n x m x 3 array (4 times faster than a
+    reduction over the last axis of 3)"""
+    nan = np.isnan(xyz)
+    return ~(nan[..., 0] | nan[..., 1] | nan[..., 2])
+
+
+def near_frames(fill, margin):
+    """ helper function to find the frames within margin frames of a gap, for every column at once"""
+    n = fill.shape[0]
+    count = np.concatenate((np.zeros((1, fill.shape[1]), dtype=int), np.cumsum(fill, axis=0)))
+    idx = np.arange(n)
+    return (count[np.minimum(idx + margin + 1, n)] - count[np.maximum(idx - margin, 0)]) > 0
+
+
+def segment_donors(markers):
+    """ helper function to list, for each marker, the indices of the other markers of its segment"""
+    donors = []
+    for mrk in markers:
+        segment = []
+        for names in SEGMENT_MARKERS.values():
+            if mrk in names:
+                segment = names
+            elif mrk[1:] in names and mrk[0] in ['R', 'L']:
+                segment = [mrk[0] + name for name in names]
+        donors.append([markers.index(name) for name in segment if name != mrk and name in markers])
+    return donors
+
+
+def closest_donors(xyz, donors):
+    """ helper function to sort the donors of each marker from the closest to the furthest (mean distance over
+    DONOR_FRAMES frames)"""
+    xyz = xyz[::max(1, xyz.shape[0] // DONOR_FRAMES)]
+    ordered = []
+    for i, d in enumerate(donors):
+        dist = np.linalg.norm(xyz[:, [i]] - xyz[:, d], axis=2)
+        valid = ~np.isnan(dist)
+        mean = np.where(valid, dist, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+        mean[~valid.any(axis=0)] = np.inf
+        ordered.append([d[k] for k in np.argsort(mean, kind='stable')])
+    return ordered
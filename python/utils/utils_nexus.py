@@ -1,99 +1,164 @@
-import os
 import numpy as np
 from viconnexusapi import ViconNexus
-
-
-def get_nexus_data(settings):
-    vicon = ViconNexus.ViconNexus()
-
-    region = vicon.GetTrialRegionOfInterest()
-
+from utils.utils import nexus_connection, stream_markers
+
+# markers of each side only used by the static trial (see create_virtual_markers)
+STATIC_MARKERS = ['D1M', 'PCA', 'MMA']
+
+# subject parameters of the processing settings (see get_nexus_data)
+PROCESSING_PARAMS = dict(LHindFootFlat='LeftHindFootFlat', RHindFootFlat='RightHindFootFlat',
+                         LUseFloorFF='LeftUseFloorFF', RUseFloorFF='RightUseFloorFF')
+
+# subject parameters read by the dynamic pipeline besides the openOFM calibration (*_openOFM), without side prefix
+DYNAMIC_PARAMS = ['MarkerDiameter', 'InterAsisDistance', 'LegLength', 'KneeWidth', 'AnkleWidth', 'ThighRotation',
+                  'ShankRotation', 'HindFootFlat', 'UseFloorFF']
+
+# angles written to Nexus, HXFFA has no z component
+NEXUS_ANGLES = ['RightTIBA', 'RightHFTBA', 'RightFFTBA', 'RightFFHFA', 'RightHXFFA',
+                'LeftTIBA', 'LeftHFTBA', 'LeftFFTBA', 'LeftFFHFA', 'LeftHXFFA',
+                ]
+
+
+def init_nexus_session(vicon=None):
+    """ connects to Nexus and caches the information on the trial needed by get_nexus_data and set_nexus_data
+
+    Arguments:
+        vicon       ... ViconNexus, Default = None. Connection to Nexus. If None, the connection of is_nexus, or a
+                        new connection
+    Returns:
+        session     ... dict, connection 'vicon', 'subject', trial 'region' (first and last frame), 'frames', 'rate',
+                        'markers' and model 'outputs' of the subject, names of the subject parameters 'param_names'
+                        and 'params', values of the subject parameters fetched so far
+
+    Notes:
+        - every call to Nexus is a round trip to another process, the session fetches each piece of information
+        once per trial and is updated when outputs and parameters are created
+    """
+    if vicon is None:
+        vicon = nexus_connection()
+    if vicon is None:
+        vicon = ViconNexus.ViconNexus()
     subject = vicon.GetSubjectNames()[0]
-    _, template, active = vicon.GetSubjectInfo()
+    session = dict(vicon=vicon, subject=subject, region=vicon.GetTrialRegionOfInterest(),
+                   frames=vicon.GetFrameCount(), rate=vicon.GetFrameRate(),
+                   markers=set(vicon.GetMarkerNames(subject)), outputs=set(vicon.GetModelOutputNames(subject)),
+                   param_names=list(vicon.GetSubjectParamNames(subject)), params={})
+    return session
 
-    markers = vicon.GetMarkerNames(subject)
-    modeled_markers = vicon.GetModelOutputNames(subject)
+
+def nexus_markers(version, trial_type):
+    """ helper function to list the markers read from Nexus to process a trial with openOFM version"""
+    markers = stream_markers(version)
+    if trial_type == 'static':
+        markers = markers + [side + mrk for side in ['R', 'L'] for mrk in STATIC_MARKERS]
+    return markers
+
+
+def subject_param(session, name):
+    """ helper function to get the value of a subject parameter, fetched from Nexus once per trial"""
+    if name not in session['params']:
+        session['params'][name] = session['vicon'].GetSubjectParam(session['subject'], name)[0]
+    return session['params'][name]
+
+
+def get_nexus_data(settings, session=None):
+    """ reads the markers and subject parameters of the trial selected in Nexus
+
+    Arguments:
+        settings    ... dict, settings with keys 'version' and 'trial_type'
+        session     ... dict, Default = None. Nexus session (see init_nexus_session). If None, a new session is
+                        started and kept in settings['nexus_session'] for set_nexus_data
+    Returns:
+        data        ... dict, markers within the region of interest and parameters
+        settings    ... dict, with processing settings of the subject
+
+    Notes:
+        - only the markers (see nexus_markers) and subject parameters (openOFM calibration and DYNAMIC_PARAMS)
+        used by openOFM are read
+    """
+    if session is None:
+        session = init_nexus_session()
+    settings['nexus_session'] = session
+    vicon = session['vicon']
+    subject = session['subject']
+    region = session['region']
 
     data = {'parameters': {}}
     data['parameters']['PROCESSING'] = {}
+    data['parameters']['POINT'] = {'RATE': {'value': np.array([session['rate']])}}
 
-    for marker in markers:
-        data[marker] = {}
+    for marker in nexus_markers(settings['version'], settings['trial_type']):
+        if marker not in session['markers']:
+            continue
         (X1, Y1, Z1, _) = vicon.GetTrajectory(subject, marker)
         data[marker] = np.array([X1, Y1, Z1]).T[region[0] - 1:region[1]]
 
-    if 'RHE1' in modeled_markers:
-        modeled_markers = ['RHE1', 'LHE1']
-        for marker in modeled_markers:
-            data[marker] = {}
+    if 'RHE1' in session['outputs']:
+        for marker in ['RHE1', 'LHE1']:
             (coords, _) = vicon.GetModelOutput(subject, marker)
             data[marker] = np.array(coords).T[region[0] - 1:region[1]]
 
-    settings['processing'] = dict(LHindFootFlat=vicon.GetSubjectParam(subject, 'LeftHindFootFlat')[0],
-                                  RHindFootFlat=vicon.GetSubjectParam(subject, 'RightHindFootFlat')[0],
-                                  LUseFloorFF=vicon.GetSubjectParam(subject, 'LeftUseFloorFF')[0],
-                                  RUseFloorFF=vicon.GetSubjectParam(subject, 'RightUseFloorFF')[0],
-                                  )
+    settings['processing'] = {key: subject_param(session, name) for key, name in PROCESSING_PARAMS.items()}
 
     if settings['trial_type'] == 'dynamic':
-
-        params = vicon.GetSubjectParamNames(subject)
-        for param in params:
+        for param in session['param_names']:
             param_short = param.replace('Right', 'R')
             param_short = param_short.replace('Left', 'L')
+            if 'openOFM' not in param_short and param_short not in DYNAMIC_PARAMS and \
+                    param_short[1:] not in DYNAMIC_PARAMS:
+                continue
             data['parameters']['PROCESSING'][param_short] = {}
-            data['parameters']['PROCESSING'][param_short]['value'], active = vicon.GetSubjectParam(subject, param)
+            data['parameters']['PROCESSING'][param_short]['value'] = subject_param(session, param)
 
     return data, settings
 
 
-def set_nexus_data(data, trial_type):
-    from viconnexusapi import ViconNexus
-    vicon = ViconNexus.ViconNexus()
+def set_nexus_data(data, trial_type, session=None):
+    """ writes the results of openOFM to the trial selected in Nexus
 
-    # path, folder = vicon.GetTrialName()
-    #
-    frames = vicon.GetFrameCount()
-    region = vicon.GetTrialRegionOfInterest()
-    size = region[1] - region[0] + 1
+    Arguments:
+        data        ... dict, processed trial data
+        trial_type  ... str, 'static' (openOFM subject parameters) or 'dynamic' (angles, see NEXUS_ANGLES)
+        session     ... dict, Default = None. Nexus session (see init_nexus_session). If None, a new session is
+                        started
 
-    subject = vicon.GetSubjectNames()[0]
-    _, template, active = vicon.GetSubjectInfo()
+    Notes:
+        - outputs and parameters missing from the subject are created first, then all values are written in one
+        pass, from a single array holding every angle
+        - angles are flagged as existing within the region of interest only
+    """
+    if session is None:
+        session = init_nexus_session()
+    vicon = session['vicon']
+    subject = session['subject']
+    frames = session['frames']
+    region = session['region']
 
     if trial_type == 'static':
         # create new dictionary with only openOFM processing parameters
         params = dict(filter(lambda item: 'openOFM' in item[0], data['parameters']['PROCESSING'].items()))
-        outputs = vicon.GetSubjectParamNames(subject)
         for key, value in params.items():
-            if key not in outputs:
+            if key not in session['param_names']:
                 vicon.CreateSubjectParam(subject, key, value, 'mm', 0, True)
+                session['param_names'].append(key)
             else:
                 vicon.SetSubjectParam(subject, key, value, True)
+            session['params'][key] = value
 
     if trial_type == 'dynamic':
-        angles = ['RightTIBA', 'RightHFTBA', 'RightFFTBA', 'RightFFHFA', 'RightHXFFA',
-                  'LeftTIBA', 'LeftHFTBA', 'LeftFFTBA', 'LeftFFHFA', 'LeftHXFFA',
-                  ]
         components = ['X', 'Y', 'Z']
         types = ['Angle', 'Angle', 'Angle']
 
-        # (data, exists) = vicon.GetModelOutput(subject, angles)
+        values = np.zeros((len(NEXUS_ANGLES), 3, frames))
+        for i, angle in enumerate(NEXUS_ANGLES):
+            axes = ['_x', '_y'] if angle.endswith('HXFFA') else ['_x', '_y', '_z']
+            values[i, :len(axes), region[0] - 1:region[1]] = [data[angle + axis] for axis in axes]
+        exists = [False] * frames
+        exists[region[0] - 1:region[1]] = [True] * (region[1] - region[0] + 1)
 
-        for angle in angles:
-            # i = region[0]
-            _, exists = vicon.GetModelOutput(subject, angle)
-            if angle == 'RightHXFFA' or angle == 'LeftHXFFA':
-                component = np.zeros((3, frames))
-                component[0, region[0] - 1:region[1]] = data[angle + '_x']
-                component[1, region[0] - 1:region[1]] = data[angle + '_y']
-            else:
-                component = np.zeros((3, frames))
-                component[0, region[0] - 1:region[1]] = data[angle + '_x']
-                component[1, region[0] - 1:region[1]] = data[angle + '_y']
-                component[2, region[0] - 1:region[1]] = data[angle + '_z']
-            outputs = vicon.GetModelOutputNames(subject)
-            if angle not in outputs:
+        for angle in NEXUS_ANGLES:
+            if angle not in session['outputs']:
                 vicon.CreateModelOutput(subject, angle, 'Angles', components, types)
-                exists = [False] * frames
-                exists[region[0] - 1:region[1]] = [True for i in range(size)]
-            vicon.SetModelOutput(subject, angle, component, exists)
+                session['outputs'].add(angle)
+        for i, angle in enumerate(NEXUS_ANGLES):
+            vicon.SetModelOutput(subject, angle, values[i], exists)
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import importlib
+import tracemalloc
+import contextlib
+import numpy as np
+
+from utils.utils import find_repo_root
+
+# set to 1 to profile every trial (e.g. in batch jobs), same as --profile, or to memory, same as --profile_memory
+PROFILE_ENV = 'OPENOFM_PROFILE'
+
+# modules imported at the first use of a stage (settings key of the stage as key), imported by init_profile so that
+# their import time is not counted in the stage
+PROFILE_IMPORTS = {'gap_fill': ['scipy.interpolate'],
+                   'filter': ['scipy.signal'],
+                   'cycles': ['scipy.signal'],
+                   'report': ['matplotlib.figure', 'matplotlib.backends.backend_agg', 'matplotlib.ticker'],
+                   }
+
+
+def init_profile(settings):
+    """ start profiling a trial if settings['profile'] is true or the PROFILE_ENV environment variable is set
+
+    Arguments:
+        settings    ... dict, settings of the trial (trial_type, file_name, version, optional key 'profile', true
+                        to time the stages or 'memory' to also record their peak memory)
+    Returns:
+        profile     ... dict, report of the trial to pass to profile_stage and save_profile, or None if profiling
+                        is off
+
+    Notes:
+        - stages are timed without tracemalloc, which slows down every allocation (up to 20 times for the import
+        of scipy), peak memory is only recorded in memory mode, where the times of the stages are flagged as traced
+        - modules imported at the first use of the stages of the trial (see PROFILE_IMPORTS) are imported first,
+        as an 'imports' stage
+    """
+    mode = profiling_mode(settings)
+    if mode is None:
+        return None
+
+    tracing = tracemalloc.is_tracing()
+    if mode == 'memory' and not tracing:
+        tracemalloc.start()
+    profile = dict(trial=settings.get('file_name'), trial_type=settings.get('trial_type'),
+                   version=settings.get('version'), frames=0, stages=[], traced=mode == 'memory',
+                   _start=(time.perf_counter(), time.process_time(), tracing))
+
+    modules = [module for key, names in PROFILE_IMPORTS.items() if settings.get(key) for module in names]
+    if modules:
+        with profile_stage(profile, 'imports'):
+            for module in modules:
+                importlib.import_module(module)
+    return profile
+
+
+def profiling_enabled(settings):
+    """ helper function to check if a trial is to be profiled, see init_profile"""
+    return profiling_mode(settings) is not None
+
+
+def profiling_mode(settings):
+    """ helper function to get the profiling mode of a trial: None (off), 'time' or 'memory', see init_profile"""
+    mode = settings.get('profile', False) or os.environ.get(PROFILE_ENV, '0')
+    if mode in (False, None, '', '0'):
+        return None
+    return 'memory' if mode == 'memory' else 'time'
+
+
+def set_frames(profile, frames):
+    """ helper function to set the frames of the trial, once loaded, also for the stages recorded so far"""
+    if profile is None:
+        return
+    profile['frames'] = frames
+    for s in profile['stages']:
+        s['frames'] = frames
+        s['fps'] = frames / s['wall'] if s['wall'] > 0 else None
+
+
+def profile_stage(profile, stage):
+    """ context manager recording wall time, CPU time and peak memory of a stage
+
+    Arguments:
+        profile     ... dict, report of the trial (see init_profile). If None, nothing is recorded
+        stage       ... str, name of the stage
+    Notes:
+        - the frames of a stage are the frames of the trial, see set_frames
+        - in memory mode (see init_profile), peak memory is the peak of memory allocated by python and numpy
+        during the stage (see tracemalloc), otherwise None
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return _stage(profile, stage)
+
+
+@contextlib.contextmanager
+def _stage(profile, stage):
+    traced = profile['traced']
+    if traced:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    try:
+        yield profile
+    finally:
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - c0
+        peak = (tracemalloc.get_traced_memory()[1] - base) / 1024 ** 2 if traced else None
+        profile['stages'].append(dict(stage=stage, wall=wall, cpu=cpu, peak_mb=peak, frames=profile['frames'],
+                                      fps=profile['frames'] / wall if wall > 0 else None))
+
+
+def save_profile(profile, fl=None):
+    """ finish the report of a trial, print it and write it as json to fl (if not None)"""
+    if profile is None:
+        return None
+
+    t0, c0, tracing = profile.pop('_start')
+    if profile['traced'] and not tracing:
+        tracemalloc.stop()
+    profile['wall'] = time.perf_counter() - t0
+    profile['cpu'] = time.process_time() - c0
+    profile['peak_mb'] = max([s['peak_mb'] for s in profile['stages']], default=0.0) if profile['traced'] else None
+    profile['fps'] = profile['frames'] / profile['wall'] if profile['wall'] > 0 else None
+
+    print_profile(profile)
+    if fl is not None:
+        with open(fl, 'w') as f:
+            json.dump(profile, f, indent=1)
+        print('Saving profile to {}'.format(fl))
+
+    return profile
+
+
+def profile_path(settings):
+    """ helper function to get the json file of the report of a trial, next to the trial"""
+    root_dir = find_repo_root(os.path.dirname(__file__))
+    return os.path.join(root_dir, settings['data_dir'], os.path.splitext(settings['file_name'])[0] + '_profile.json')
+
+
+def aggregate_profiles(profiles):
+    """ sum the reports of several trials stage by stage
+
+    Arguments:
+        profiles    ... list, reports of trials (see save_profile)
+    Returns:
+        summary     ... list, one dict per trial type and stage with the total wall and CPU time, the share of the
+                        wall time of the trial type, the largest peak memory (None if no trial was profiled in memory
+                        mode), the total frames and frames/s
+    """
+    totals = {}
+    for profile in profiles:
+        for s in profile['stages']:
+            key = (profile['trial_type'], s['stage'])
+            if key not in totals:
+                totals[key] = dict(trial_type=key[0], stage=key[1], trials=0, wall=0.0, cpu=0.0, peak_mb=None,
+                                   frames=0)
+            total = totals[key]
+            total['trials'] += 1
+            total['wall'] += s['wall']
+            total['cpu'] += s['cpu']
+            if s['peak_mb'] is not None:
+                total['peak_mb'] = max(total['peak_mb'] or 0.0, s['peak_mb'])
+            total['frames'] += s['frames']
+
+    summary = list(totals.values())
+    for total in summary:
+        wall = np.sum([t['wall'] for t in summary if t['trial_type'] == total['trial_type']])
+        total['share'] = total['wall'] / wall if wall > 0 else None
+        total['fps'] = total['frames'] / total['wall'] if total['wall'] > 0 else None
+
+    return summary
+
+
+def print_profile(profile):
+    """ helper function to print the report of a trial"""
+    print('profile of {} ({} frames, {:.3f} s wall, {:.3f} s cpu{})'.format(
+        profile['trial'], profile['frames'], profile['wall'], profile['cpu'],
+        ', times include the overhead of tracemalloc' if profile['traced'] else ''))
+    for s in profile['stages']:
+        print('  {:<16} {:9.4f} s wall {:9.4f} s cpu {:>9} MB {:>12} frames/s'.format(
+            s['stage'], s['wall'], s['cpu'], format_mb(s['peak_mb']),
+            '-' if s['fps'] is None else '{:.0f}'.format(s['fps'])))
+
+
+def print_summary(summary):
+    """ helper function to print the aggregated reports of several trials"""
+    for total in summary:
+        print('{:<8} {:<16} {:4d} trials {:9.3f} s wall ({:5.1%}) {:9.3f} s cpu {:>9} MB {:>12} frames/s'.format(
+            total['trial_type'], total['stage'], total['trials'], total['wall'], total['share'] or 0.0,
+            total['cpu'], format_mb(total['peak_mb']), '-' if total['fps'] is None else '{:.0f}'.format(total['fps'])))
+
+
+def format_mb(mb):
+    """ helper function to print a peak memory, '-' if it was not recorded"""
+    return '-' if mb is None else '{:.1f}'.format(mb)
@@ -0,0 +1,179 @@
+import time
+import socket
+import numpy as np
+
+# default address of the marker stream (local stand-in for a motion capture stream)
+STREAM_HOST = '127.0.0.1'
+STREAM_PORT = 50510
+
+# largest datagram accepted, about 180 frames of 30 markers (12 bytes per marker and frame, see encode_frames).
+# Larger blocks are split over several datagrams (see encode_packets)
+MAX_PACKET = 65507
+
+
+def encode_frames(frames, channels):
+    """ pack a block of frames into a datagram
+
+    Arguments:
+        frames      ... dict, channel names as keys and n x 3 arrays as values
+        channels    ... list, channel names in the order agreed by sender and receiver. Missing channels are
+                        sent as NaN (gaps)
+    Returns:
+        packet      ... bytes, little-endian float32 array of shape n x channels x 3
+    """
+    n = len(next(iter(frames.values())))
+    block = np.full((n, len(channels), 3), np.nan, dtype='<f4')
+    for i, ch in enumerate(channels):
+        if ch in frames:
+            block[:, i, :] = np.reshape(frames[ch], (n, 3))
+    return block.tobytes()
+
+
+def encode_packets(frames, channels):
+    """ pack a block of frames into as few datagrams of at most MAX_PACKET bytes as possible
+
+    Arguments:
+        frames      ... dict, channel names as keys and n x 3 arrays as values
+        channels    ... list, channel names in the order agreed by sender and receiver (see encode_frames)
+    Returns:
+        packets     ... list, bytes of each datagram, consecutive frames of the block
+
+    Notes:
+        - the receiver (see udp_source) merges the datagrams queued up, the split is only visible as smaller
+        blocks
+    """
+    size = 12 * len(channels)
+    if size > MAX_PACKET:
+        raise ValueError('a frame of {} channels takes {} bytes, more than the largest datagram ({} bytes)'.format(
+            len(channels), size, MAX_PACKET))
+    n = len(next(iter(frames.values())))
+    step = MAX_PACKET // size
+    return [encode_frames({ch: value[i:i + step] for ch, value in frames.items()}, channels)
+            for i in range(0, n, step)]
+
+
+def decode_frames(packet, channels):
+    """ unpack a datagram made by encode_frames into a dict of n x 3 float arrays"""
+    block = np.frombuffer(packet, dtype='<f4').reshape(-1, len(channels), 3).astype(float)
+    return {ch: block[:, i, :] for i, ch in enumerate(channels)}
+
+
+def udp_source(markers, host=STREAM_HOST, port=STREAM_PORT, timeout=None):
+    """ receive blocks of marker frames over UDP
+
+    Arguments:
+        markers     ... list, marker names in the order of the stream (see encode_frames)
+        host, port  ... address to listen on
+        timeout     ... float, Default = None. Seconds without data after which the stream is considered
+                        finished. If None, waits forever
+    Yields:
+        frames      ... dict, markers as keys and n x 3 arrays as values
+
+    Notes:
+        - datagrams that queued up while the previous block was processed are merged into a single block, so
+        that a slow consumer catches up instead of falling further behind
+        - an empty datagram ends the stream
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    sock.settimeout(timeout)
+    try:
+        while True:
+            try:
+                packets = [sock.recv(MAX_PACKET)]
+            except socket.timeout:
+                return
+
+            # drain datagrams received meanwhile
+            sock.setblocking(False)
+            try:
+                while packets[-1]:
+                    packets.append(sock.recv(MAX_PACKET))
+            except BlockingIOError:
+                pass
+            sock.settimeout(timeout)
+
+            end = not packets[-1]
+            packets = [p for p in packets if p]
+            if packets:
+                yield decode_frames(b''.join(packets), markers)
+            if end:
+                return
+    finally:
+        sock.close()
+
+
+def udp_sink(channels, host=STREAM_HOST, port=STREAM_PORT + 1):
+    """ returns a function sending blocks of frames (e.g. angles) to host:port, see encode_packets"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(frames):
+        for packet in encode_packets(frames, channels):
+            sock.sendto(packet, (host, port))
+
+    return send
+
+
+def c3d_source(fl, markers, block=1, rate=None):
+    """ replay the markers of a c3d file as blocks of frames
+
+    Arguments:
+        fl          ... str, full path to c3d file
+        markers     ... list, marker names to replay (missing markers are skipped)
+        block       ... int, Default = 1. Number of frames per block
+        rate        ... float, Default = None. Frame rate of the replay in Hz. If None, blocks are produced as
+                        fast as they are consumed
+    Yields:
+        frames      ... dict, markers as keys and block x 3 arrays as values
+    """
+    from utils.utils_c3d import c3d_to_dict_mmap
+
+    data = c3d_to_dict_mmap(fl, markers=markers)
+    present = [mrk for mrk in markers if mrk in data]
+    if not present:
+        raise ValueError('none of the markers {} is in {}'.format(markers, fl))
+    n = len(data[present[0]])
+    t0 = time.perf_counter()
+    for i in range(0, n, block):
+        if rate is not None:
+            # wait until the last frame of the block would have been captured
+            delay = t0 + (i + block) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield {mrk: data[mrk][i:i + block] for mrk in present}
+
+
+def send_c3d(fl, markers, host=STREAM_HOST, port=STREAM_PORT, block=1, rate=100.0):
+    """ stream the markers of a c3d file over UDP in real time, a stand-in for a motion capture system"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    n = 0
+    for frames in c3d_source(fl, markers, block=block, rate=rate):
+        for packet in encode_packets(frames, markers):
+            sock.sendto(packet, (host, port))
+        n += len(next(iter(frames.values())))
+    sock.sendto(b'', (host, port))
+    sock.close()
+
+    return n
+
+
+if __name__ == "__main__":
+    # run from the python folder as: python -m utils.utils_stream path/to/dynamic.c3d
+    import argparse
+    from utils.utils import stream_markers
+
+    parser = argparse.ArgumentParser(
+        description='stream the markers of a c3d file over UDP',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('fl', help='full path to c3d file')
+    parser.add_argument('--version', default='1.0', choices={'1.0', '1.1'}, help='Version of openOFM to stream for')
+    parser.add_argument('--host', default=STREAM_HOST, help='address of the receiver')
+    parser.add_argument('--port', type=int, default=STREAM_PORT, help='port of the receiver')
+    parser.add_argument('--block', type=int, default=1,
+                        help='number of frames per block, split into datagrams of at most {} bytes'.format(MAX_PACKET))
+    parser.add_argument('--rate', type=float, default=100.0, help='frame rate of the stream in Hz')
+    args = parser.parse_args()
+
+    n = send_c3d(args.fl, stream_markers(args.version), host=args.host, port=args.port, block=args.block,
+                 rate=args.rate)
+    print('sent {} frames to {}:{}'.format(n, args.host, args.port))